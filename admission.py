@@ -0,0 +1,203 @@
+import os
+import time
+from collections import OrderedDict, deque
+from threading import Condition
+
+from metrics import Counter, Gauge, observe_stage
+from structured_log import log_event
+
+# Control de admisión de ejecuciones del asistente: un token bucket por
+# usuario (evita que un solo usuario agote el límite de la organización) y
+# uno global para todo el proceso. Si no hay token global la petición espera
+# en una cola FIFO acotada y recibe su posición; lo que no cabe o espera
+# demasiado se rechaza con un tiempo sugerido para reintentar.
+# ADMISSION_GLOBAL_RATE es el límite de toda la instalación: con WEB_WORKERS
+# procesos cada uno recibe su parte. Con sesiones sticky un usuario se queda
+# en un worker, así que su bucket sigue siendo local.
+WEB_WORKERS = max(int(os.environ.get("WEB_WORKERS", 1)), 1)
+ADMISSION_USER_RATE = float(os.environ.get("ADMISSION_USER_RATE", 6)) / 60
+ADMISSION_USER_BURST = float(os.environ.get("ADMISSION_USER_BURST", 3))
+ADMISSION_GLOBAL_RATE = float(os.environ.get("ADMISSION_GLOBAL_RATE", 5)) \
+    / WEB_WORKERS
+ADMISSION_GLOBAL_BURST = max(
+    float(os.environ.get("ADMISSION_GLOBAL_BURST", 10)) / WEB_WORKERS, 1)
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", 100))
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 60))
+ADMISSION_MAX_USERS = int(os.environ.get("ADMISSION_MAX_USERS", 10000))
+
+REJECTION_MESSAGES = {
+    "user_rate": "Estás enviando mensajes muy rápido. Espera unos segundos "
+                 "antes de enviar otra pregunta.",
+    "queue_full": "Hay muchas preguntas en curso en este momento. Intenta de "
+                  "nuevo en unos segundos.",
+    "timeout": "Tu pregunta esperó demasiado en la cola. Intenta de nuevo en "
+               "unos segundos.",
+}
+
+admission_total = Counter(
+    "admission_total", "Decisiones del control de admisión", ["outcome"])
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(REJECTION_MESSAGES[reason])
+
+
+class TokenBucket:
+    # No es seguro entre hilos por sí solo: lo protege el candado del
+    # AdmissionController
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def wait_time(self):
+        # Segundos hasta que haya un token disponible
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class AdmissionController:
+
+    def __init__(self, user_rate=ADMISSION_USER_RATE,
+                 user_burst=ADMISSION_USER_BURST,
+                 global_rate=ADMISSION_GLOBAL_RATE,
+                 global_burst=ADMISSION_GLOBAL_BURST,
+                 max_queue=ADMISSION_QUEUE_SIZE,
+                 max_wait=ADMISSION_MAX_WAIT,
+                 max_users=ADMISSION_MAX_USERS):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_users = max_users
+        self._global = TokenBucket(global_rate, global_burst)
+        self._users = OrderedDict()
+        self._queue = deque()
+        self._cond = Condition()
+
+    def _user_bucket(self, user_id):
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.user_rate,
+                                                        self.user_burst)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return bucket
+
+    def _eta(self, position):
+        # Estimación del tiempo de espera para la posición dada
+        rate = self._global.rate
+        return round(self._global.wait_time() + (position - 1) / rate, 1) \
+            if rate > 0 else None
+
+    def admit(self, user_id, on_position=None):
+        # Bloquea hasta que la petición puede ejecutarse o lanza
+        # AdmissionRejected. on_position(position, queue_length, eta) se
+        # llama cada vez que cambia la posición en la cola.
+        started = time.monotonic()
+        with self._cond:
+            user_bucket = self._user_bucket(user_id)
+            if not user_bucket.take():
+                admission_total.inc(outcome="rejected_user_rate")
+                raise AdmissionRejected("user_rate",
+                                        round(user_bucket.wait_time(), 1))
+            if not self._queue and self._global.take():
+                admission_total.inc(outcome="admitted")
+                return 0.0
+            if len(self._queue) >= self.max_queue:
+                # El rechazo no es culpa del usuario: no gasta su token
+                user_bucket.refund()
+                admission_total.inc(outcome="rejected_queue_full")
+                raise AdmissionRejected("queue_full",
+                                        self._eta(len(self._queue) + 1))
+            ticket = object()
+            self._queue.append(ticket)
+            admission_total.inc(outcome="queued")
+
+        deadline = started + self.max_wait
+        notified = None
+        try:
+            while True:
+                with self._cond:
+                    position = self._queue.index(ticket) + 1
+                    if position == 1 and self._global.take():
+                        self._queue.popleft()
+                        self._cond.notify_all()
+                        waited = time.monotonic() - started
+                        observe_stage("admission_wait", waited)
+                        return waited
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        admission_total.inc(outcome="rejected_timeout")
+                        raise AdmissionRejected("timeout", self._eta(position))
+                    update = (position, len(self._queue), self._eta(position))
+                    if notified == position:
+                        # Esperar a que avance la cola o haya un token nuevo
+                        wait = self._global.wait_time() if position == 1 \
+                            else remaining
+                        self._cond.wait(min(max(wait, 0.01), remaining))
+                        continue
+                # Notificar fuera del candado
+                notified = position
+                if on_position is not None:
+                    try:
+                        on_position(*update)
+                    except Exception as e:
+                        log_event("queue_position_notify_failed",
+                                  level="warning", error=str(e))
+        except BaseException:
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+            raise
+
+    def queue_length(self):
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_length": len(self._queue),
+                "max_queue": self.max_queue,
+                "max_wait": self.max_wait,
+                "global_tokens": round(self._global.tokens, 2),
+                "global_rate": self._global.rate,
+                "global_burst": self._global.capacity,
+                "user_rate_per_minute": self.user_rate * 60,
+                "user_burst": self.user_burst,
+                "tracked_users": len(self._users),
+                "workers": WEB_WORKERS,
+            }
+
+
+admission = AdmissionController()
+
+Gauge("admission_queue_length", "Peticiones esperando turno para ejecutarse",
+      admission.queue_length)
@@ -0,0 +1,133 @@
+import os
+import re
+import time
+import unicodedata
+from datetime import datetime, timedelta
+from threading import Lock
+
+from models import db, CachedAnswer
+from assistant_manifest import text_sha256
+from shared_state import shared_state
+from ttl_cache import TTLCache
+
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 5000))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 24 * 3600))
+ANSWER_CACHE_PERSIST = os.environ.get("ANSWER_CACHE_PERSIST",
+                                      "false").lower() == "true"
+# Preguntas muy cortas ("¿y eso?") dependen de la conversación: no se cachean
+ANSWER_CACHE_MIN_WORDS = int(os.environ.get("ANSWER_CACHE_MIN_WORDS", 4))
+# Cada cuánto (segundos, entre todos los workers) se borran de CachedAnswer
+# las filas caducadas o de versiones anteriores de la base de conocimiento
+ANSWER_CACHE_PRUNE_INTERVAL = float(os.environ.get("ANSWER_CACHE_PRUNE_INTERVAL",
+                                                   3600))
+
+
+def standalone(context):
+    # Un turno sin mensajes previos ni resumen sólo depende de la pregunta y de
+    # la base de conocimiento; con contexto la respuesta es de esa conversación
+    return not context or (not context["messages"] and not context["summary"])
+
+
+def normalize_question(text):
+    # Minúsculas, sin acentos, sin signos de puntuación y espacios simples
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+class AnswerCache:
+    # Respuestas por pregunta normalizada y versión de la base de conocimiento:
+    # cuando cambia el vector store cambia la clave y las entradas anteriores
+    # dejan de usarse. Sólo se guardan y se sirven turnos sin contexto previo
+    # (ver standalone): la respuesta de un turno con historial depende de esa
+    # conversación y no puede darse a otro usuario. Opcionalmente se guardan
+    # en CachedAnswer, de donde se purgan las filas caducadas y las de otras
+    # versiones.
+
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+                 persist=ANSWER_CACHE_PERSIST,
+                 prune_interval=ANSWER_CACHE_PRUNE_INTERVAL):
+        self.ttl = ttl
+        self.persist = persist
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        self._cache = TTLCache(max_size=max_size, ttl=ttl)
+        self._endpoints = {}
+        self._lock = Lock()
+
+    def _key(self, question, kb_version, context=None):
+        normalized = normalize_question(question)
+        if kb_version is None or not standalone(context) or \
+                len(normalized.split()) < ANSWER_CACHE_MIN_WORDS:
+            return None
+        return text_sha256(f"{kb_version}:{normalized}")
+
+    def _count(self, endpoint, hit):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {"hits": 0, "misses": 0})
+            stats["hits" if hit else "misses"] += 1
+
+    def get(self, question, kb_version, endpoint, context=None):
+        key = self._key(question, kb_version, context)
+        if key is None:
+            return None
+
+        answer = self._cache.get(key)
+        if answer is None and self.persist:
+            row = db.session.get(CachedAnswer, key)
+            if row is not None and \
+                    row.created_at > datetime.utcnow() - timedelta(seconds=self.ttl):
+                answer = row.answer
+                self._cache.set(key, answer)
+        self._count(endpoint, answer is not None)
+        return answer
+
+    def put(self, question, kb_version, answer, context=None):
+        key = self._key(question, kb_version, context)
+        if key is None:
+            return
+        self._cache.set(key, answer)
+        if self.persist:
+            db.session.merge(CachedAnswer(key=key,
+                                          kb_version=kb_version,
+                                          question=normalize_question(question),
+                                          answer=answer,
+                                          created_at=datetime.utcnow()))
+            db.session.commit()
+            self._maybe_prune(kb_version)
+
+    def _maybe_prune(self, kb_version):
+        # Como mucho una purga por intervalo en este proceso y, con varios
+        # workers, en toda la instalación
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_prune:
+                return
+            self._next_prune = now + self.prune_interval
+        if shared_state.claim("answer_cache_prune", self.prune_interval):
+            self.prune(kb_version)
+
+    def prune(self, kb_version):
+        # Borra las filas que ya no pueden servirse; devuelve cuántas
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        deleted = CachedAnswer.query.filter(
+            (CachedAnswer.kb_version != kb_version)
+            | (CachedAnswer.created_at < cutoff)).delete(
+                synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint, counts in self._endpoints.items():
+                total = counts["hits"] + counts["misses"]
+                endpoints[endpoint] = dict(
+                    counts, hit_rate=counts["hits"] / total if total else 0.0)
+        cache = self._cache.stats()
+        return {"size": cache["size"], "max_size": cache["max_size"],
+                "endpoints": endpoints}
+
+
+answer_cache = AnswerCache()
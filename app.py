@@ -1,19 +1,68 @@
 import os
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, flash, session
+
+# Socket.IO runs on eventlet when it is available. Blocking I/O (OpenAI, DB)
+# must be patched to cooperate with it before anything else is imported.
+SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'eventlet')
+if SOCKETIO_ASYNC_MODE == 'eventlet':
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+    except ImportError:
+        SOCKETIO_ASYNC_MODE = 'threading'
+    else:
+        # monkey_patch() does not reach psycopg2's C socket calls: without
+        # this every PostgreSQL query blocks all greenlets until it returns
+        try:
+            from psycogreen.eventlet import patch_psycopg
+            patch_psycopg()
+        except ImportError:  # psycogreen (and psycopg2) are optional, e.g. with SQLite
+            pass
+
+import base64
+import binascii
+import functools
+import glob
+import hashlib
+import mimetypes
+import re
+import threading
+import time
+import uuid
+from flask import Flask, Response, abort, render_template, request, jsonify, send_from_directory, redirect, url_for, flash, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from werkzeug.utils import secure_filename
+from werkzeug.http import parse_content_range_header
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from models import db, ChatMessage, User
-from chatbot import initialize_conversation, get_chatbot_response, reset_conversation, upload_pdf, get_vector_store_id
-from datetime import timedelta
-from flask_socketio import SocketIO, emit
+from flask.sessions import SecureCookieSessionInterface
+from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from models import db, ChatMessage, ChatMessageArchive, User, IngestionJob
+from run_waiter import RunCancelledError
+from thread_registry import registry
+from chatbot import get_chatbot_response, stream_chatbot_response, reset_conversation, get_vector_store_id, initialize_assistant, is_ready, append_exchange, NO_RESPONSE, ERROR_RESPONSE, PDF_PATHS
+from admission import admission, AdmissionRejected
+from answer_cache import answer_cache
+import assistant_manifest
+from assistant_manifest import current_knowledge_base_version
+from conversation_context import contexts
+from lexical_index import lexical_index
+from openai_transport import transport as openai_transport, upstream_unavailable, UNAVAILABLE_MESSAGE
+from metrics import render_metrics, begin_turn, end_turn, timed, chat_turn_seconds, uploads_total, upload_bytes_total
+from ingestion import ingestion_queue, job_to_dict, QueueFullError
+from upload_sessions import chunked_uploads, UploadError, UPLOAD_MAX_SIZE
+from persistence import save_turn, write_behind, WRITE_BEHIND, backfill_rendered_html
+from message_store import new_message, load_bodies, texts, visible, message_maintenance
+from shared_state import shared_state
+from static_assets import static_assets
+from structured_log import log_event
+from offload import run_blocking
+from ttl_cache import TTLCache
+from datetime import datetime, timedelta
+from flask_socketio import SocketIO, emit, join_room
+from sqlalchemy import and_, event, or_
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY',
                                           'qLiAAc92kN98OojsXFoSUvSQZuSw9Jiq')
-print(f"SECRET_KEY: {app.config['SECRET_KEY']}")
 
 # Database configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL")
@@ -29,9 +78,66 @@ app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_NAME'] = 'my_session_cookie'
 
+
+class AssetAwareSessionInterface(SecureCookieSessionInterface):
+    # Static assets never save the session: no Set-Cookie or Vary: Cookie on
+    # them, so shared caches can keep them too
+    def save_session(self, app, session, response):
+        if request.endpoint == 'static':
+            return
+        super().save_session(app, session, response)
+
+
+app.session_interface = AssetAwareSessionInterface()
+
+# Stream assistant tokens to the client as they are generated
+app.config['STREAM_RESPONSES'] = os.environ.get('STREAM_RESPONSES',
+                                                'true').lower() == 'true'
+
+# Maximum number of assistant runs in flight per process
+app.config['LLM_CONCURRENCY'] = int(os.environ.get('LLM_CONCURRENCY', 8))
+
+# Multi-worker mode: run WEB_WORKERS copies of this app (PORT=5000, 5001, ...)
+# with the same SECRET_KEY, DATABASE_URL and SOCKETIO_MESSAGE_QUEUE (e.g.
+# redis://host:6379/0) behind a load balancer with sticky sessions (see
+# deploy/nginx.conf). Emits fan out through the queue to whichever worker
+# holds the socket; per-user locks and cache versions live in the same Redis
+# (shared_state.py) and the assistant manifest in the database
+# (assistant_manifest.py), so any worker can serve any user. Across hosts,
+# UPLOAD_FOLDER must be shared storage too.
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+app.config['SOCKETIO_CHANNEL'] = os.environ.get('SOCKETIO_CHANNEL',
+                                                'chatbot-socketio')
+
 db.init_app(app)
 migrate = Migrate(app, db)
-socketio = SocketIO(app)
+socketio = SocketIO(app, async_mode=SOCKETIO_ASYNC_MODE,
+                    message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'],
+                    channel=app.config['SOCKETIO_CHANNEL'])
+llm_slots = threading.BoundedSemaphore(app.config['LLM_CONCURRENCY'])
+
+
+def user_room(user_id):
+    # Every socket of a user joins this room, so background work can reach them
+    return f"user_{user_id}"
+
+
+def emit_job_progress(job):
+    socketio.emit('upload_progress', job_to_dict(job), to=user_room(job.user_id))
+
+
+# Assistant ids and knowledge-base version live in the database, so every
+# worker on every host shares them
+assistant_manifest.init_app(app)
+ingestion_queue.init_app(app, notify=emit_job_progress)
+if WRITE_BEHIND:
+    write_behind.init_app(app)
+message_maintenance.init_app(app)
+
+# Operators allowed to see the /debug_* endpoints (comma-separated usernames)
+app.config['ADMIN_USERNAMES'] = {
+    name.strip() for name in os.environ.get('ADMIN_USERNAMES', '').split(',')
+    if name.strip()}
 
 # Flask-Login configuration
 login_manager = LoginManager()
@@ -41,42 +147,156 @@ login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
 
+# Cache of lightweight user records for the user_loader, which otherwise runs a
+# primary-key lookup on every request and Socket.IO event. Entries are dropped
+# when a User row changes in this process; other workers see the change after
+# at most USER_CACHE_TTL seconds. The reset watermark is also cached, so
+# /history needs no user subquery; a reset invalidates it in every worker at
+# once (see forget_cached_user).
+user_cache = TTLCache(max_size=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+                      ttl=float(os.environ.get('USER_CACHE_TTL', 300)))
+
+
+class CachedUser(UserMixin):
+
+    def __init__(self, id, username, email, history_cleared_id, version=None):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.history_cleared_id = history_cleared_id
+        # shared_state version of the user when it was loaded
+        self.version = version
+
+    def __repr__(self):
+        return f"<User {self.id}>"
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    version = shared_state.version(f"user:{user_id}")
+    user = user_cache.get(user_id)
+    if user is None or version is None or user.version != version:
+        row = User.query.with_entities(
+            User.id, User.username, User.email,
+            User.history_cleared_id).filter_by(id=user_id).first()
+        if row is None:
+            return None
+        user = CachedUser(*row, version=version)
+        user_cache.set(user_id, user)
+    return user
+
+
+def forget_cached_user(user_id):
+    # For bulk updates, which skip the mapper events below (e.g. the reset
+    # watermark); other workers reload the user on their next request
+    user_cache.pop(user_id)
+    shared_state.bump(f"user:{user_id}")
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    user_cache.pop(target.id)
+
+
+def admin_required(view):
+    # Internals are only shown to logged-in operators listed in
+    # ADMIN_USERNAMES; for everybody else the endpoint does not exist
+    @functools.wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if current_user.username not in app.config['ADMIN_USERNAMES']:
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
 
 
 # File upload configuration
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Request bodies are cut off while they stream in; the margin leaves room for
+# the multipart framing of a single-request upload of the largest file
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_SIZE + 64 * 1024
+
+# Uploads are stored under their sha256 (see save_upload), so a stored file
+# never changes: the hash is its strong ETag and browsers may keep it for a
+# year. Behind nginx, UPLOADS_ACCEL_REDIRECT (e.g. /protected-uploads/) hands
+# the transfer to an internal location served with sendfile.
+app.config['UPLOAD_MAX_AGE'] = int(os.environ.get('UPLOAD_MAX_AGE',
+                                                  365 * 24 * 3600))
+app.config['UPLOADS_ACCEL_REDIRECT'] = os.environ.get('UPLOADS_ACCEL_REDIRECT')
+CONTENT_HASHED_UPLOAD = re.compile(r'^([0-9a-f]{64})\.[a-z0-9]+$')
+
+# Content-hashed URLs and precompressed variants for static/; uploads are
+# not assets and are only served, with the login check, from /uploads
+static_assets.init_app(app, exclude=(os.path.basename(UPLOAD_FOLDER),))
+
+
+def file_extension(filename):
+    # Lowercase extension without the dot; taken from the name as sent, since
+    # secure_filename() drops non-ASCII base names ('文件.pdf' -> 'pdf')
+    return os.path.splitext(filename)[1][1:].lower()
 
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit(
-        '.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return file_extension(filename) in ALLOWED_EXTENSIONS
+
+
+def original_filename(filename):
+    # The name as sent, without any client path. It is only kept for display
+    # (search results, citations); the stored file is named after its hash.
+    return os.path.basename(str(filename or '').replace('\\', '/'))[-255:]
+
+
+def save_upload(file, folder, chunk_size=1024 * 1024, max_size=UPLOAD_MAX_SIZE):
+    # Streams the upload to disk while hashing it and stores it under its
+    # content hash, so identical files share one copy
+    extension = file_extension(file.filename)
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(folder, f".upload-{uuid.uuid4().hex}")
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(chunk_size), b''):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadError(413, 'File is too large',
+                                      max_size=max_size)
+                # Hashing a 1 MiB chunk is CPU work; see offload.py
+                run_blocking(digest.update, chunk)
+                out.write(chunk)
+        sha256 = digest.hexdigest()
+        filename = f"{sha256}.{extension}"
+        file_path = os.path.join(folder, filename)
+        if os.path.exists(file_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return sha256, filename
 
 
 @app.before_request
 def make_session_permanent():
-    session.permanent = True
+    # Assets need no session; elsewhere the flag is only set once, so the
+    # session is not marked as modified on every request
+    if request.endpoint == 'static':
+        return
+    if not session.permanent:
+        session.permanent = True
     app.permanent_session_lifetime = timedelta(days=14)
 
 
 @app.route('/')
 @login_required
 def index():
-    print(
-        f"Accessing index route. User authenticated: {current_user.is_authenticated}"
-    )
-    print(f"Current user: {current_user}")
-    messages = ChatMessage.query.filter_by(user_id=current_user.id).order_by(
-        ChatMessage.timestamp).all()
-    initial_history = [{
-        'role': 'user' if msg.is_user else 'assistant',
-        'content': msg.content
-    } for msg in messages]
-    initialize_conversation(initial_history)
+    log_event('index_view', user_id=current_user.id)
+    # The assistant thread is hydrated lazily on the first send_message
     return render_template('index.html')
 
 
@@ -90,11 +310,9 @@ def register():
             email = request.form['email']
             password = request.form['password']
 
-            print(f"Attempting to register user: {username}")
-
             user = User.query.filter_by(username=username).first()
             if user:
-                print(f"Username {username} already exists")
+                log_event('register_rejected', reason='username_taken')
                 flash(
                     'Username already exists. Please choose a different username.',
                     'error')
@@ -102,7 +320,7 @@ def register():
 
             email_user = User.query.filter_by(email=email).first()
             if email_user:
-                print(f"Email {email} already registered")
+                log_event('register_rejected', reason='email_taken')
                 flash(
                     'Email already registered. Please use a different email address.',
                     'error')
@@ -114,12 +332,12 @@ def register():
             db.session.add(new_user)
             db.session.commit()
 
-            print(f"User {username} registered successfully")
+            log_event('register', user_id=new_user.id)
             flash('Registration successful. Please log in.', 'success')
             return redirect(url_for('login'))
         except Exception as e:
             db.session.rollback()
-            print(f"Error during registration: {str(e)}")
+            log_event('register_failed', level='error', error=str(e))
             app.logger.error(f"Error during registration: {str(e)}")
             flash('An error occurred during registration. Please try again.',
                   'error')
@@ -131,16 +349,11 @@ def register():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
-        print(
-            f"User {current_user.username} is already authenticated, redirecting to index"
-        )
         return redirect(url_for('index'))
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
-        print(f"Attempting to log in user: {username}")
-
         user = User.query.filter_by(username=username).first()
 
         if user and check_password_hash(user.password_hash, password):
@@ -148,19 +361,13 @@ def login():
             session[
                 'logged_in'] = True  # Modify session to ensure cookie is sent
             session.modified = True  # Force Flask to send the session cookie
-            print(f"User {username} logged in successfully")
-            print(
-                f"current_user.is_authenticated: {current_user.is_authenticated}"
-            )
-            print(f"current_user: {current_user}")
-            print(f"session: {session}")
+            log_event('login', user_id=user.id)
             app.logger.info(f"User {username} logged in successfully")
             flash('Logged in successfully.', 'success')
             next_page = request.args.get('next')
-            print(f"Next page: {next_page}")
             return redirect(next_page or url_for('index'))
         else:
-            print(f"Failed login attempt for username: {username}")
+            log_event('login_failed', level='warning', username=username)
             app.logger.warning(
                 f"Failed login attempt for username: {username}")
             flash('Invalid username or password. Please try again.', 'error')
@@ -175,108 +382,661 @@ def logout():
     return redirect(url_for('login'))
 
 
+@socketio.on('connect')
+def handle_connect():
+    if current_user.is_authenticated:
+        join_room(user_room(current_user.id))
+
+
 @socketio.on('send_message')
 def handle_message(data):
     user_message = data['message']
+    received_at = datetime.utcnow()
+
+    # Token-budgeted window of previous turns plus a rolling summary. The
+    # user message is persisted together with the reply, in one transaction.
+    context = contexts.snapshot(current_user.id)
 
-    # Save user message to database
-    chat_message = ChatMessage(content=user_message,
-                               is_user=True,
-                               user_id=current_user.id)
-    db.session.add(chat_message)
-    db.session.commit()
-
-    # Get chatbot response
-    bot_response = get_chatbot_response(user_message)
-
-    # Save bot response to database
-    bot_message = ChatMessage(content=bot_response,
-                              is_user=False,
-                              user_id=current_user.id)
-    db.session.add(bot_message)
-    db.session.commit()
-
-    # Emit the response back to the client
-    emit('receive_message', {
-        'message': bot_response,
+    # A reset from now on drops this turn: the reply is neither stored nor
+    # sent, and a run in progress is cancelled
+    was_reset = registry.watch(current_user.id)
+
+    # Answer in a background task so this handler returns right away and the
+    # socket keeps serving other events (e.g. reset_conversation)
+    socketio.start_background_task(generate_reply, request.sid,
+                                   current_user.id, user_message, context,
+                                   received_at, was_reset)
+
+
+def generate_reply(sid, user_id, user_message, context, received_at,
+                   was_reset):
+    with app.app_context():
+        started = time.perf_counter()
+        begin_turn()
+        path = 'run'
+        try:
+            path = _generate_reply(sid, user_id, user_message, context,
+                                   received_at, was_reset)
+        finally:
+            was_reset.close()
+            elapsed = time.perf_counter() - started
+            chat_turn_seconds.observe(elapsed, path=path)
+            log_event('chat_turn', user_id=user_id, path=path,
+                      seconds=round(elapsed, 4), stages=end_turn())
+
+
+def _generate_reply(sid, user_id, user_message, context, received_at,
+                    was_reset):
+    # Returns how the turn was answered: 'cached', 'run', 'unavailable',
+    # 'rejected', 'error' or 'reset' (dropped by a reset). was_reset() is
+    # checked before anything is stored or sent.
+    # Common course questions are answered from the cache, skipping the run.
+    # Only turns without earlier context are cached: a reply that depends on
+    # the user's conversation must not be served to anybody else.
+    kb_version = current_knowledge_base_version()
+    cached_response = answer_cache.get(user_message, kb_version,
+                                       endpoint='send_message',
+                                       context=context)
+    if cached_response is not None:
+        if was_reset():
+            return 'reset'
+        with timed('db_insert'):
+            chat_message, bot_message = save_turn(user_id, user_message,
+                                                  cached_response,
+                                                  user_timestamp=received_at)
+        contexts.record(user_id, [chat_message, bot_message])
+        with timed('emit'):
+            socketio.emit('receive_message', {
+                'message': cached_response,
+                'html': message_html(bot_message),
+                'is_user': False,
+                'message_id': bot_message.id,
+                **saved_turn(chat_message, bot_message)
+            }, to=sid)
+        # Keep the assistant thread in sync for follow-up questions
+        try:
+            append_exchange(user_id, user_message, cached_response)
+        except Exception as e:
+            log_event('append_exchange_failed', level='error',
+                      user_id=user_id, error=str(e))
+        return 'cached'
+
+    def emit_chunk(delta):
+        if was_reset():
+            return
+        with timed('emit_chunk'):
+            socketio.emit('receive_message_chunk', {'delta': delta}, to=sid)
+
+    # Fail fast while OpenAI is degraded instead of queueing for a slot
+    if openai_transport.breaker.is_open():
+        if was_reset():
+            return 'reset'
+        return _reply_unavailable(sid, user_id, user_message, received_at)
+
+    # Per-user and global rate limits; while queued the client is told its
+    # position, and requests over the limits are turned away with a hint
+    def emit_position(position, queue_length, eta):
+        socketio.emit('queue_position', {
+            'position': position,
+            'queue_length': queue_length,
+            'eta_seconds': eta
+        }, to=sid)
+
+    try:
+        admission.admit(user_id, on_position=emit_position)
+    except AdmissionRejected as e:
+        socketio.emit('backpressure', {
+            'reason': e.reason,
+            'retry_after': e.retry_after,
+            'message': str(e)
+        }, to=sid)
+        return 'rejected'
+
+    try:
+        # At most LLM_CONCURRENCY runs at once; the rest wait here
+        with timed('llm_slot_wait'):
+            llm_slots.acquire()
+        try:
+            # Reset while queued: no run at all
+            if was_reset():
+                return 'reset'
+            # Get chatbot response, streaming partial text if enabled
+            if app.config['STREAM_RESPONSES']:
+                bot_response = stream_chatbot_response(user_id,
+                                                       user_message,
+                                                       emit_chunk,
+                                                       context=context,
+                                                       abandoned=was_reset)
+            else:
+                bot_response = get_chatbot_response(user_id,
+                                                    user_message,
+                                                    context=context,
+                                                    abandoned=was_reset)
+        finally:
+            llm_slots.release()
+    except RunCancelledError:
+        return 'reset'
+    except Exception as e:
+        if was_reset():
+            return 'reset'
+        if upstream_unavailable(e):
+            return _reply_unavailable(sid, user_id, user_message, received_at)
+        log_event('generate_reply_failed', level='error', user_id=user_id,
+                  error=str(e))
+        app.logger.error(f"Error generating reply: {str(e)}")
+        # Keep the user's message even though there is no reply
+        with timed('db_insert'):
+            chat_message = new_message(user_id, user_message, is_user=True,
+                                       timestamp=received_at)
+            db.session.add(chat_message)
+            db.session.commit()
+        socketio.emit('receive_message', {
+            'message': 'Lo siento, ocurrió un error al generar la respuesta. Intenta de nuevo.',
+            'is_user': False,
+            'message_id': None,
+            **saved_turn(chat_message, chat_message)
+        }, to=sid)
+        return 'error'
+
+    if was_reset():
+        return 'reset'
+
+    # Save the user message and bot response in a single transaction
+    with timed('db_insert'):
+        chat_message, bot_message = save_turn(user_id, user_message,
+                                              bot_response,
+                                              user_timestamp=received_at)
+    contexts.record(user_id, [chat_message, bot_message])
+    if bot_response not in (NO_RESPONSE, ERROR_RESPONSE):
+        answer_cache.put(user_message, kb_version, bot_response,
+                         context=context)
+
+    # Emit the response back to the originating client session
+    with timed('emit'):
+        socketio.emit('receive_message', {
+            'message': bot_response,
+            'html': message_html(bot_message),
+            'is_user': False,
+            'message_id': bot_message.id,
+            **saved_turn(chat_message, bot_message)
+        }, to=sid)
+    return 'run'
+
+
+def message_html(message):
+    # Stored HTML of a just-saved message; long ones keep it in their body
+    return texts(message, load_bodies([message]))[1]
+
+
+def saved_turn(user_message, last_message):
+    # Lets the client swap the temporary id of the message it typed for the
+    # stored one and move its /history 'after' cursor past this turn, so a
+    # reconnect does not fetch (and render) these messages again
+    return {
+        'user_message_id': user_message.id,
+        'after': encode_cursor(last_message),
+    }
+
+
+def _reply_unavailable(sid, user_id, user_message, received_at):
+    # Keep the user's message and tell them to retry later
+    with timed('db_insert'):
+        chat_message = new_message(user_id, user_message, is_user=True,
+                                   timestamp=received_at)
+        db.session.add(chat_message)
+        db.session.commit()
+    socketio.emit('receive_message', {
+        'message': UNAVAILABLE_MESSAGE,
         'is_user': False,
-        'message_id': bot_message.id
-    })
+        'message_id': None,
+        **saved_turn(chat_message, chat_message)
+    }, to=sid)
+    return 'unavailable'
 
 
 @socketio.on('reset_conversation')
 def handle_reset():
-    reset_conversation()
-    ChatMessage.query.filter_by(user_id=current_user.id).delete()
-    db.session.commit()
+    # Does not wait for a reply in progress: that turn sees the reset,
+    # cancels its run and stores and sends nothing
+    reset_conversation(current_user.id)
+    # The history is hidden behind a watermark in one row update and deleted
+    # in the background. The watermark goes first, so no worker reloads the
+    # old messages after the context is cleared.
+    cleared_id = message_maintenance.reset(current_user.id)
+    forget_cached_user(current_user.id)
+    contexts.clear(current_user.id, cleared_id)
     emit('conversation_reset')
 
 
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-
-        # Asegúrate de que el directorio de subida existe
-        if not os.path.exists(app.config['UPLOAD_FOLDER']):
-            os.makedirs(app.config['UPLOAD_FOLDER'])
-
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        file_url = f"/uploads/{filename}"
-
-        # Subir PDF al asistente de OpenAI
-        if filename.lower().endswith('.pdf'):
-            file.stream.seek(0)  # Reinicia el puntero del archivo
-            vector_store_id = get_vector_store_id()
-            upload_pdf(file_url, vector_store_id)
-
-        # Guardar información del archivo en la base de datos
-        file_message = ChatMessage(content=f"File uploaded: {file_url}",
-                                   is_user=True,
-                                   user_id=current_user.id)
-        db.session.add(file_message)
+    # Single-request upload; large files should use /upload/sessions. The
+    # body is only parsed inside the slot, so a full server rejects it
+    # before reading it, and MAX_CONTENT_LENGTH stops it while it streams.
+    try:
+        with chunked_uploads.slot():
+            if 'file' not in request.files:
+                return jsonify({'error': 'No file part'}), 400
+
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'No selected file'}), 400
+            if not allowed_file(file.filename):
+                return jsonify({'error': 'File type not allowed'}), 400
+
+            # Asegúrate de que el directorio de subida existe
+            if not os.path.exists(app.config['UPLOAD_FOLDER']):
+                os.makedirs(app.config['UPLOAD_FOLDER'])
+            sha256, filename = save_upload(file, app.config['UPLOAD_FOLDER'])
+    except UploadError as e:
+        return upload_error(e)
+
+    upload_bytes_total.inc(
+        os.path.getsize(os.path.join(app.config['UPLOAD_FOLDER'], filename)))
+    return register_upload(sha256, filename, original_filename(file.filename))
+
+
+def register_upload(sha256, filename, original_name=None):
+    # Records a stored upload for the current user and queues PDF ingestion
+    # under its original name
+    file_url = f"/uploads/{filename}"
+    uploads_total.inc(extension=file_extension(filename))
+
+    # Guardar información del archivo en la base de datos; sin
+    # write-behind se confirma en la misma transacción que el trabajo de
+    # ingesta
+    upload_message = None
+    if not WRITE_BEHIND:
+        upload_message = new_message(current_user.id,
+                                     f"File uploaded: {file_url}",
+                                     is_user=True)
+        db.session.add(upload_message)
+
+    # Encolar la ingesta del PDF en el vector store; el progreso se
+    # notifica por Socket.IO y en /upload/<job_id>
+    job = None
+    if filename.endswith('.pdf'):
+        try:
+            job = ingestion_queue.submit(
+                current_user.id,
+                os.path.join(app.config['UPLOAD_FOLDER'], filename),
+                file_url, sha256, filename=original_name)
+        except QueueFullError:
+            db.session.rollback()
+            return jsonify({
+                'error': 'Too many uploads in progress, try again later'
+            }), 503
+    elif not WRITE_BEHIND:
         db.session.commit()
 
-        return jsonify({
-            'message': 'File uploaded successfully',
-            'file_url': file_url
-        })
+    if WRITE_BEHIND:
+        write_behind.add_message(current_user.id,
+                                 f"File uploaded: {file_url}")
+
+    response = {
+        'message': 'File uploaded successfully',
+        'file_url': file_url
+    }
+    if upload_message is not None:
+        response['message_id'] = upload_message.id
+    if job is not None:
+        response['job_id'] = job.id
+        return jsonify(response), 202
+    return jsonify(response)
+
+
+def upload_error(error):
+    response = jsonify(error.to_dict())
+    response.status_code = error.status
+    if 'retry_after' in error.extra:
+        response.headers['Retry-After'] = str(error.extra['retry_after'])
+    return response
+
+
+def upload_session_state(session, offset):
+    return {
+        'upload_id': session.id,
+        'offset': offset,
+        'size': session.size,
+        'chunk_size': chunked_uploads.chunk_size,
+    }
+
+
+# Chunked, resumable uploads: POST /upload/sessions {filename, size}, then
+# PUT /upload/sessions/<id> with each chunk (Content-Range: bytes a-b/size, or
+# ?offset=a), then POST /upload/sessions/<id>/finalize. After an interruption
+# GET /upload/sessions/<id> returns the offset to continue from.
+@app.route('/upload/sessions', methods=['POST'])
+@login_required
+def create_upload_session():
+    data = request.get_json(silent=True) or {}
+    filename = original_filename(data.get('filename'))
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    try:
+        session_row = chunked_uploads.create(current_user.id, filename,
+                                             data.get('size'),
+                                             app.config['UPLOAD_FOLDER'])
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify(upload_session_state(session_row, 0)), 201
+
+
+@app.route('/upload/sessions/<upload_id>', methods=['GET'])
+@login_required
+def get_upload_session(upload_id):
+    try:
+        session_row = chunked_uploads.get(current_user.id, upload_id)
+        offset = chunked_uploads.offset(session_row,
+                                        app.config['UPLOAD_FOLDER'])
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify(upload_session_state(session_row, offset))
 
-    return jsonify({'error': 'File type not allowed'}), 400
+
+@app.route('/upload/sessions/<upload_id>', methods=['PUT'])
+@login_required
+def put_upload_chunk(upload_id):
+    content_range = parse_content_range_header(
+        request.headers.get('Content-Range'))
+    if content_range is not None:
+        offset = content_range.start
+    else:
+        offset = request.args.get('offset', type=int)
+    if offset is None or offset < 0:
+        return jsonify({'error': 'Missing chunk offset'}), 400
+    try:
+        session_row = chunked_uploads.get(current_user.id, upload_id)
+        with chunked_uploads.slot():
+            offset = chunked_uploads.write_chunk(
+                session_row, app.config['UPLOAD_FOLDER'], offset,
+                request.stream, request.content_length)
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify(upload_session_state(session_row, offset))
+
+
+@app.route('/upload/sessions/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload_session(upload_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        session_row = chunked_uploads.get(current_user.id, upload_id)
+        # The session row is deleted by finalize
+        original_name = session_row.filename
+        sha256, filename = chunked_uploads.finalize(
+            session_row, app.config['UPLOAD_FOLDER'], data.get('sha256'))
+    except UploadError as e:
+        return upload_error(e)
+    return register_upload(sha256, filename, original_name)
+
+
+@app.route('/upload/sessions/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_upload_session(upload_id):
+    try:
+        session_row = chunked_uploads.get(current_user.id, upload_id)
+        chunked_uploads.abort(session_row, app.config['UPLOAD_FOLDER'])
+    except UploadError as e:
+        return upload_error(e)
+    return '', 204
+
+
+@app.route('/upload/<job_id>')
+@login_required
+def upload_status(job_id):
+    job = IngestionJob.query.filter_by(id=job_id,
+                                       user_id=current_user.id).first()
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_to_dict(job))
 
 
 @app.route('/uploads/<filename>')
 @login_required
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    match = CONTENT_HASHED_UPLOAD.match(filename)
+    if match is None:
+        # Files stored before uploads were content-addressed
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+
+    etag = match.group(1)
+    if request.if_none_match.contains_weak(etag):
+        # Revalidation needs no disk access at all
+        response = Response(status=304)
+    elif app.config['UPLOADS_ACCEL_REDIRECT']:
+        if not os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'],
+                                           filename)):
+            abort(404)
+        # nginx serves the body, including byte ranges, with sendfile
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or
+                            'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = \
+            app.config['UPLOADS_ACCEL_REDIRECT'] + filename
+    else:
+        # Conditional response: If-None-Match, Range and If-Range
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename,
+                                       etag=etag, conditional=True)
+    response.set_etag(etag)
+    response.cache_control.public = None
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['UPLOAD_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
+
+SEARCH_MAX_RESULTS = 20
+
+
+@app.route('/search')
+@login_required
+def search_materials():
+    # Local BM25 lookup: "where is this covered?" without an assistant run
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+    k = min(request.args.get('k', 5, type=int) or 5, SEARCH_MAX_RESULTS)
+    started = time.monotonic()
+    passages = lexical_index.search(query, k=k)
+    return jsonify({
+        'query': query,
+        'passages': passages,
+        'took_ms': round((time.monotonic() - started) * 1000, 2)
+    })
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(render_metrics(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/debug_admission')
+@admin_required
+def debug_admission():
+    return jsonify(admission.stats())
+
+
+@app.route('/debug_uploads')
+@admin_required
+def debug_uploads():
+    return jsonify(chunked_uploads.stats())
+
+
+@app.route('/debug_message_store')
+@admin_required
+def debug_message_store():
+    return jsonify(message_maintenance.stats())
+
+
+@app.route('/debug_static_assets')
+@admin_required
+def debug_static_assets():
+    return jsonify(static_assets.stats())
+
+
+@app.route('/debug_workers')
+@admin_required
+def debug_workers():
+    return jsonify({
+        'pid': os.getpid(),
+        'async_mode': socketio.async_mode,
+        'message_queue': bool(app.config['SOCKETIO_MESSAGE_QUEUE']),
+        'shared_state': shared_state.stats(),
+    })
+
+
+@app.route('/debug_openai_transport')
+@admin_required
+def debug_openai_transport():
+    return jsonify(openai_transport.stats())
+
+
+@app.route('/debug_lexical_index')
+@admin_required
+def debug_lexical_index():
+    return jsonify(lexical_index.stats())
+
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+HISTORY_FIELDS = ('id', 'timestamp', 'content', 'content_html', 'body_id',
+                  'is_user', 'feedback', 'there_is_feedback')
+# Archived messages are all older than the hot ones: paging back reads the hot
+# table first, paging forward reads the archive first
+HISTORY_TIERS = (ChatMessage, ChatMessageArchive)
+
+
+def encode_cursor(msg):
+    raw = f"{msg.timestamp.isoformat()}|{msg.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    timestamp, message_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+
+def history_rows(model, user, before, after, limit):
+    # One tier's rows for a page, in the order they are read: oldest first
+    # for ?after=, newest first otherwise. Only the columns the client needs;
+    # rows come back as plain tuples. The reset watermark comes from the
+    # cached user instead of a subquery.
+    query = model.query.with_entities(
+        *(getattr(model, field) for field in HISTORY_FIELDS)).filter(
+            visible(model, user.id, user.history_cleared_id))
+    if after:
+        timestamp, message_id = after
+        return query.filter(
+            or_(model.timestamp > timestamp,
+                and_(model.timestamp == timestamp,
+                     model.id > message_id))).order_by(
+                model.timestamp, model.id).limit(limit).all()
+    if before:
+        timestamp, message_id = before
+        query = query.filter(
+            or_(model.timestamp < timestamp,
+                and_(model.timestamp == timestamp,
+                     model.id < message_id)))
+    return query.order_by(model.timestamp.desc(),
+                          model.id.desc()).limit(limit).all()
 
 
 @app.route('/history')
 @login_required
 def get_chat_history():
-    messages = ChatMessage.query.filter_by(user_id=current_user.id).order_by(
-        ChatMessage.timestamp).all()
-    print(f"messages: {messages}")
-    history = [{
-        'content': msg.content,
-        'is_user': msg.is_user,
-        'feedback': msg.feedback,
-        'thereIsFeedback': msg.there_is_feedback,
-        'message_id': msg.id,
-    } for msg in messages]
-    return jsonify(history)
+    # Keyset pagination on (timestamp, id). Without cursors the newest page is
+    # returned; ?before=<cursor> pages back, ?after=<cursor> only returns
+    # messages newer than the last one the client has seen.
+    try:
+        limit = min(int(request.args.get('limit', HISTORY_PAGE_SIZE)),
+                    HISTORY_MAX_PAGE_SIZE)
+        before = request.args.get('before')
+        after = request.args.get('after')
+        before = decode_cursor(before) if before else None
+        after = decode_cursor(after) if after else None
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+    # A page may span both tiers; the archive is only read when the hot
+    # table runs out of rows in the direction being paged
+    tiers = HISTORY_TIERS[::-1] if after else HISTORY_TIERS
+    messages = []
+    for model in tiers:
+        messages += history_rows(model, current_user, before, after,
+                                 limit + 1 - len(messages))
+        if len(messages) > limit:
+            break
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if not after:
+        messages.reverse()
+
+    # 'html' is the sanitized markup rendered when the message was stored;
+    # it is null for rows the backfill has not reached yet. Long messages are
+    # decompressed in one query for the whole page.
+    bodies = load_bodies(messages)
+    history = []
+    for msg in messages:
+        content, html = texts(msg, bodies)
+        history.append({
+            'content': content,
+            'html': html,
+            'is_user': msg.is_user,
+            'feedback': msg.feedback,
+            'thereIsFeedback': msg.there_is_feedback,
+            'message_id': msg.id,
+        })
+
+    # 'before' pages further back; 'after' is the cursor of the newest message
+    # the client now has, to poll for newer ones. 'has_more' tells whether
+    # another page exists in the direction being paged.
+    response = jsonify({
+        'messages': history,
+        'before': encode_cursor(messages[0]) if has_more and not after else None,
+        'after': encode_cursor(messages[-1]) if messages else request.args.get('after'),
+        'has_more': has_more,
+    })
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@app.route('/ready')
+def readiness():
+    # Reports whether the assistant and knowledge base are warm
+    if is_ready():
+        return jsonify({'ready': True, 'vector_store_id': get_vector_store_id()})
+    return jsonify({'ready': False}), 503
+
+
+def warm_knowledge_base():
+    try:
+        initialize_assistant()
+        log_event('knowledge_base_ready', sample_rate=1)
+    except Exception as e:
+        log_event('knowledge_base_warm_failed', level='error', error=str(e))
+        app.logger.error(f"Error warming knowledge base: {str(e)}")
+    # The local index only needs the files on disk; already indexed
+    # contents are skipped by hash. Uploads are indexed under the name they
+    # were uploaded with.
+    with app.app_context():
+        upload_names = {
+            os.path.join(UPLOAD_FOLDER, f"{sha256}.pdf"): filename
+            for sha256, filename in IngestionJob.query.with_entities(
+                IngestionJob.sha256, IngestionJob.filename).filter(
+                    IngestionJob.filename.isnot(None))}
+    lexical_index.add_pdfs(
+        PDF_PATHS + sorted(glob.glob(os.path.join(UPLOAD_FOLDER, '*.pdf'))),
+        names=upload_names)
 
 
 @app.route('/debug_users')
+@admin_required
 def debug_users():
     users = User.query.all()
     user_list = [{
@@ -287,7 +1047,20 @@ def debug_users():
     return jsonify(user_list)
 
 
+@app.route('/debug_user_cache')
+@admin_required
+def debug_user_cache():
+    return jsonify(user_cache.stats())
+
+
+@app.route('/debug_answer_cache')
+@admin_required
+def debug_answer_cache():
+    return jsonify(answer_cache.stats())
+
+
 @app.route('/debug_auth')
+@admin_required
 def debug_auth():
     if current_user.is_authenticated:
         return jsonify({
@@ -316,6 +1089,12 @@ def unauthorized(error):
     flash('Please log in to access this page.', 'error')
     return redirect(url_for('login', next=request.url))
 
+
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({'error': 'File is too large',
+                    'max_size': UPLOAD_MAX_SIZE}), 413
+
 # adding feedback
 @app.route('/feedback', methods=['POST'])
 @login_required
@@ -324,19 +1103,27 @@ def handle_feedback():
     message_id = data.get('message_id')
     is_like = data.get('is_like')
 
-    print(f"Received feedback for message ID {message_id}: {is_like}")
-
     # Extract the numeric ID from the message_id string
     numeric_id = int(message_id)
 
+    # Buffered: applied with the next bulk flush, scoped to the current user
+    if WRITE_BEHIND:
+        write_behind.add_feedback(current_user.id, numeric_id, is_like)
+        return jsonify({"status": "success"})
+
     # Update the message in the database
     message = ChatMessage.query.filter_by(id=numeric_id,
                                           user_id=current_user.id).first()
+    if message is None:
+        # Older messages may have been moved to the archive
+        message = ChatMessageArchive.query.filter_by(
+            id=numeric_id, user_id=current_user.id).first()
     if message:
         message.feedback = is_like
         message.there_is_feedback = True
         db.session.commit()
-        print(f"Feedback saved: Message ID: {numeric_id}, Like: {is_like}")
+        log_event('feedback', user_id=current_user.id, message_id=numeric_id,
+                  is_like=is_like)
         return jsonify({"status": "success"})
     else:
         return jsonify({
@@ -346,6 +1133,15 @@ def handle_feedback():
 
 
 if __name__ == '__main__':
-    with app.app_context():
+    # Workers starting together must not race to create the tables
+    with app.app_context(), shared_state.lock('create_all'):
         db.create_all()
-    socketio.run(app, host='0.0.0.0', port=5000, debug=False)
+    socketio.start_background_task(warm_knowledge_base)
+    ingestion_queue.resume()
+    # Render the HTML of messages stored before content_html existed; one
+    # worker is enough
+    if shared_state.claim('render_backfill', 3600):
+        socketio.start_background_task(backfill_rendered_html, app)
+    message_maintenance.start()
+    socketio.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)),
+                 debug=False)
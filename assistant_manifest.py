@@ -0,0 +1,130 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from models import db, AssistantManifest
+from offload import run_blocking
+from shared_state import shared_state
+from structured_log import log_event
+
+# Guarda entre reinicios los ids del asistente y del vector store y el hash de
+# cada archivo ya ingerido, para no recrearlos en cada arranque. Vive en la
+# base de datos (AssistantManifest), así que todos los workers, en cualquier
+# host, comparten el mismo asistente y la misma versión de la base de
+# conocimiento. MANIFEST_PATH es el archivo de versiones anteriores: si la
+# tabla está vacía se importa de ahí una vez.
+MANIFEST_PATH = os.environ.get("ASSISTANT_MANIFEST", "assistant_manifest.json")
+# Lo que puede durar una inicialización con el lock tomado (subidas incluidas)
+MANIFEST_LOCK_TTL = float(os.environ.get("MANIFEST_LOCK_TTL", 600))
+# Cada cuánto se relee la versión de la base de conocimiento si el estado
+# compartido no avisa del cambio (un solo worker, o Redis caído)
+KB_VERSION_TTL = float(os.environ.get("KB_VERSION_TTL", 5))
+
+_app = None
+
+
+def init_app(app):
+    global _app
+    _app = app
+
+
+def _load_legacy_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        log_event("manifest_invalid", level="warning", path=MANIFEST_PATH,
+                  error=str(e))
+        return {}
+
+
+def load_manifest():
+    # Contexto propio: la sesión de quien llama no se ve afectada
+    with _app.app_context():
+        row = db.session.get(AssistantManifest, 1)
+        if row is not None:
+            return json.loads(row.content)
+    return _load_legacy_manifest()
+
+
+def save_manifest(manifest):
+    version = knowledge_base_version(manifest)
+    with _app.app_context():
+        db.session.merge(AssistantManifest(
+            id=1, content=json.dumps(manifest, sort_keys=True),
+            kb_version=version, updated_at=datetime.utcnow()))
+        db.session.commit()
+    # Los demás workers descartan su versión cacheada
+    _remember_version(version, shared_state.bump("knowledge_base"))
+
+
+@contextmanager
+def manifest_lock():
+    # Sólo un worker inicializa o ingiere a la vez y los demás reutilizan lo
+    # que ese haya creado. Con el estado compartido el lock vale entre hosts;
+    # sin él, un bloqueo de archivo cubre los procesos de este host.
+    if shared_state.enabled:
+        with shared_state.lock("manifest", ttl=MANIFEST_LOCK_TTL):
+            yield
+        return
+    with open(f"{MANIFEST_PATH}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    # Lee y calcula fuera del hub de eventlet (ver offload.py)
+    return run_blocking(_file_sha256, path, chunk_size)
+
+
+def _file_sha256(path, chunk_size):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def knowledge_base_version(manifest):
+    # Cambia cada vez que cambia el conjunto de archivos del vector store
+    file_ids = sorted(
+        [entry["file_id"] for entry in manifest.get("files", {}).values()]
+        + list(manifest.get("uploads", {}).values()))
+    return text_sha256(manifest.get("vector_store_id", "") + ",".join(file_ids))
+
+
+# (versión compartida, versión de la base de conocimiento, cuándo se leyó)
+_version_cache = (None, None, 0.0)
+
+
+def _remember_version(version, shared_version):
+    global _version_cache
+    _version_cache = (shared_version, version, time.monotonic())
+
+
+def current_knowledge_base_version():
+    # Se relee de la base de datos sólo cuando otro worker guardó el
+    # manifiesto o, como mucho, cada KB_VERSION_TTL segundos
+    shared_version = shared_state.version("knowledge_base")
+    cached_shared, version, loaded_at = _version_cache
+    if shared_version is not None and shared_version == cached_shared and \
+            time.monotonic() - loaded_at < KB_VERSION_TTL:
+        return version
+    with _app.app_context():
+        version = db.session.query(AssistantManifest.kb_version).filter_by(
+            id=1).scalar()
+    _remember_version(version, shared_version)
+    return version
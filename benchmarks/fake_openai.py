@@ -0,0 +1,525 @@
+"""Local stand-in for the parts of the OpenAI Assistants API the chatbot uses:
+assistants, vector stores (files and file batches), files, threads, messages
+and runs, including streamed runs (server-sent events).
+
+Nothing leaves the machine. Point the app at it through the SDK's base URL:
+
+    python benchmarks/fake_openai.py --port 8089 --run-latency 1.5 \\
+        --failure-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python app.py
+
+Latency, failure rates and the token stream are configurable:
+  --request-latency  seconds added to every HTTP request
+  --run-latency      seconds a run spends queued/in progress before completing
+  --token-delay      seconds between streamed tokens
+  --reply-tokens     words per assistant reply
+  --failure-rate     fraction of runs that end as "failed"
+  --error-rate       fraction of requests answered with a 500 (the SDK retries)
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WORDS = ('el mantenimiento preventivo del vehiculo incluye la revision del '
+         'aceite los frenos y la presion de las llantas segun el manual').split()
+CITATION = '【4:0†source】'
+
+
+def _id(prefix):
+    return f'{prefix}_{uuid.uuid4().hex[:24]}'
+
+
+class FakeAssistants:
+    # In-memory state shared by all request handler threads
+
+    def __init__(self, request_latency=0.0, run_latency=1.0, token_delay=0.02,
+                 reply_tokens=40, failure_rate=0.0, error_rate=0.0, seed=None):
+        self.request_latency = request_latency
+        self.run_latency = run_latency
+        self.token_delay = token_delay
+        self.reply_tokens = reply_tokens
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.assistants = {}
+        self.vector_stores = {}
+        self.files = {}
+        self.threads = {}
+        self.runs = {}
+        self.requests = {}
+
+    def count(self, route):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def chance(self, rate):
+        with self.lock:
+            return rate > 0 and self.random.random() < rate
+
+    # -- object builders --------------------------------------------------
+
+    def message(self, thread_id, role, text, run_id=None, file_id=None):
+        annotations = []
+        if file_id:
+            start = len(text)
+            text = text + CITATION
+            annotations.append({
+                'type': 'file_citation',
+                'text': CITATION,
+                'start_index': start,
+                'end_index': len(text),
+                'file_citation': {'file_id': file_id},
+            })
+        return {
+            'id': _id('msg'),
+            'object': 'thread.message',
+            'created_at': int(time.time()),
+            'thread_id': thread_id,
+            'role': role,
+            'status': 'completed',
+            'content': [{'type': 'text',
+                         'text': {'value': text, 'annotations': annotations}}],
+            'run_id': run_id,
+            'assistant_id': None,
+            'attachments': [],
+            'metadata': {},
+        }
+
+    def reply_text(self):
+        with self.lock:
+            return ' '.join(self.random.choice(WORDS)
+                            for _ in range(self.reply_tokens)) + '. '
+
+    def cited_file(self):
+        with self.lock:
+            return next(iter(self.files), None)
+
+    def run_object(self, run):
+        return {key: value for key, value in run.items()
+                if not key.startswith('_')}
+
+    def advance(self, run):
+        # Runs move queued -> in_progress -> completed/failed with time
+        if run['status'] in ('completed', 'failed', 'cancelled', 'expired'):
+            return run
+        elapsed = time.monotonic() - run['_started']
+        if elapsed < self.run_latency / 4:
+            run['status'] = 'queued'
+        elif elapsed < self.run_latency:
+            run['status'] = 'in_progress'
+        elif run['_fail']:
+            run['status'] = 'failed'
+            run['last_error'] = {'code': 'server_error',
+                                 'message': 'Simulated run failure'}
+        else:
+            run['status'] = 'completed'
+            message = self.message(run['thread_id'], 'assistant',
+                                   self.reply_text(), run_id=run['id'],
+                                   file_id=self.cited_file())
+            with self.lock:
+                self.threads[run['thread_id']]['messages'].append(message)
+        return run
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # -- plumbing ---------------------------------------------------------
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json') and raw:
+            return json.loads(raw)
+        if content_type.startswith('multipart/form-data'):
+            match = re.search(rb'filename="([^"]*)"', raw)
+            return {'filename': match.group(1).decode() if match else 'upload',
+                    'bytes': len(raw)}
+        return {}
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_found(self, what):
+        self._send(404, {'error': {'message': f'No {what} found',
+                                   'type': 'invalid_request_error',
+                                   'code': None, 'param': None}})
+
+    def _dispatch(self, method):
+        fake = self.fake
+        path = urlparse(self.path).path.rstrip('/')
+        if path.startswith('/v1'):
+            path = path[3:]
+        body = self._body() if method in ('POST',) else {}
+        route = re.sub(r'/(asst|vs|file|thread|msg|run|vsfb)_[0-9a-f]{24}',
+                       '/{id}', path)
+        fake.count(f'{method} {route}')
+
+        if fake.request_latency:
+            time.sleep(fake.request_latency)
+        if fake.chance(fake.error_rate):
+            return self._send(500, {'error': {'message': 'Simulated error',
+                                              'type': 'server_error',
+                                              'code': None, 'param': None}})
+
+        for pattern, handler in ROUTES.get(method, ()):
+            match = re.fullmatch(pattern, path)
+            if match:
+                return handler(self, fake, body, *match.groups())
+        self._not_found(path)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    # -- assistants and vector stores ---------------------------------------
+
+    def create_assistant(self, fake, body):
+        assistant = dict(body, id=_id('asst'), object='assistant',
+                         created_at=int(time.time()), metadata={})
+        with fake.lock:
+            fake.assistants[assistant['id']] = assistant
+        self._send(200, assistant)
+
+    def get_assistant(self, fake, body, assistant_id):
+        assistant = fake.assistants.get(assistant_id)
+        if assistant is None:
+            return self._not_found('assistant')
+        self._send(200, assistant)
+
+    def update_assistant(self, fake, body, assistant_id):
+        assistant = fake.assistants.get(assistant_id)
+        if assistant is None:
+            return self._not_found('assistant')
+        assistant.update(body)
+        self._send(200, assistant)
+
+    def create_vector_store(self, fake, body):
+        store = {'id': _id('vs'), 'object': 'vector_store',
+                 'created_at': int(time.time()), 'name': body.get('name'),
+                 'status': 'completed', 'usage_bytes': 0, 'metadata': {},
+                 'file_counts': {'in_progress': 0, 'completed': 0,
+                                 'failed': 0, 'cancelled': 0, 'total': 0},
+                 'files': {}}
+        with fake.lock:
+            fake.vector_stores[store['id']] = store
+        self._send(200, self._store(store))
+
+    def _store(self, store):
+        return {k: v for k, v in store.items() if k != 'files'}
+
+    def get_vector_store(self, fake, body, store_id):
+        store = fake.vector_stores.get(store_id)
+        if store is None:
+            return self._not_found('vector store')
+        self._send(200, self._store(store))
+
+    def _vector_store_file(self, store_id, file_id):
+        return {'id': file_id, 'object': 'vector_store.file',
+                'vector_store_id': store_id, 'status': 'completed',
+                'created_at': int(time.time()), 'usage_bytes': 0,
+                'last_error': None}
+
+    def add_vector_store_file(self, fake, body, store_id):
+        store = fake.vector_stores.get(store_id)
+        if store is None:
+            return self._not_found('vector store')
+        store['files'][body['file_id']] = True
+        self._send(200, self._vector_store_file(store_id, body['file_id']))
+
+    def get_vector_store_file(self, fake, body, store_id, file_id):
+        store = fake.vector_stores.get(store_id)
+        if store is None or file_id not in store['files']:
+            return self._not_found('vector store file')
+        self._send(200, self._vector_store_file(store_id, file_id))
+
+    def delete_vector_store_file(self, fake, body, store_id, file_id):
+        store = fake.vector_stores.get(store_id)
+        if store is None or store['files'].pop(file_id, None) is None:
+            return self._not_found('vector store file')
+        self._send(200, {'id': file_id, 'object': 'vector_store.file.deleted',
+                         'deleted': True})
+
+    def _batch(self, store_id, batch_id, file_ids):
+        return {'id': batch_id, 'object': 'vector_store.files_batch',
+                'vector_store_id': store_id, 'status': 'completed',
+                'created_at': int(time.time()),
+                'file_counts': {'in_progress': 0, 'completed': len(file_ids),
+                                'failed': 0, 'cancelled': 0,
+                                'total': len(file_ids)}}
+
+    def create_file_batch(self, fake, body, store_id):
+        store = fake.vector_stores.get(store_id)
+        if store is None:
+            return self._not_found('vector store')
+        for file_id in body.get('file_ids', []):
+            store['files'][file_id] = True
+        self._send(200, self._batch(store_id, _id('vsfb'),
+                                    body.get('file_ids', [])))
+
+    def get_file_batch(self, fake, body, store_id, batch_id):
+        self._send(200, self._batch(store_id, batch_id, []))
+
+    # -- files ----------------------------------------------------------------
+
+    def create_file(self, fake, body):
+        file = {'id': _id('file'), 'object': 'file',
+                'created_at': int(time.time()), 'purpose': 'assistants',
+                'filename': body.get('filename'), 'bytes': body.get('bytes', 0),
+                'status': 'processed'}
+        with fake.lock:
+            fake.files[file['id']] = file
+        self._send(200, file)
+
+    def get_file(self, fake, body, file_id):
+        file = fake.files.get(file_id)
+        if file is None:
+            return self._not_found('file')
+        self._send(200, file)
+
+    def delete_file(self, fake, body, file_id):
+        with fake.lock:
+            file = fake.files.pop(file_id, None)
+        if file is None:
+            return self._not_found('file')
+        self._send(200, {'id': file_id, 'object': 'file', 'deleted': True})
+
+    # -- threads, messages and runs -------------------------------------------
+
+    def create_thread(self, fake, body):
+        thread_id = _id('thread')
+        messages = [fake.message(thread_id, m['role'], m['content'])
+                    for m in body.get('messages', [])]
+        with fake.lock:
+            fake.threads[thread_id] = {'messages': messages}
+        self._send(200, {'id': thread_id, 'object': 'thread',
+                         'created_at': int(time.time()), 'metadata': {},
+                         'tool_resources': None})
+
+    def create_message(self, fake, body, thread_id):
+        thread = fake.threads.get(thread_id)
+        if thread is None:
+            return self._not_found('thread')
+        message = fake.message(thread_id, body['role'], body['content'])
+        with fake.lock:
+            thread['messages'].append(message)
+        self._send(200, message)
+
+    def list_messages(self, fake, body, thread_id):
+        thread = fake.threads.get(thread_id)
+        if thread is None:
+            return self._not_found('thread')
+        query = parse_qs(urlparse(self.path).query)
+        with fake.lock:
+            messages = list(thread['messages'])
+        if 'run_id' in query:
+            messages = [m for m in messages if m['run_id'] == query['run_id'][0]]
+        if query.get('order', ['desc'])[0] == 'desc':
+            messages.reverse()
+        limit = int(query.get('limit', [20])[0])
+        data = messages[:limit]
+        self._send(200, {'object': 'list', 'data': data,
+                         'first_id': data[0]['id'] if data else None,
+                         'last_id': data[-1]['id'] if data else None,
+                         'has_more': len(messages) > limit})
+
+    def create_run(self, fake, body, thread_id):
+        thread = fake.threads.get(thread_id)
+        if thread is None:
+            return self._not_found('thread')
+        run = {'id': _id('run'), 'object': 'thread.run',
+               'created_at': int(time.time()), 'thread_id': thread_id,
+               'assistant_id': body.get('assistant_id'), 'status': 'queued',
+               'last_error': None, 'required_action': None,
+               'model': 'fake', 'instructions': '', 'tools': [],
+               'metadata': {}, 'usage': None,
+               '_started': time.monotonic(),
+               '_fail': fake.chance(fake.failure_rate)}
+        with fake.lock:
+            fake.runs[run['id']] = run
+        if body.get('stream'):
+            return self._stream_run(fake, run)
+        self._send(200, fake.run_object(run))
+
+    def get_run(self, fake, body, thread_id, run_id):
+        run = fake.runs.get(run_id)
+        if run is None or run['thread_id'] != thread_id:
+            return self._not_found('run')
+        self._send(200, fake.run_object(fake.advance(run)))
+
+    def cancel_run(self, fake, body, thread_id, run_id):
+        run = fake.runs.get(run_id)
+        if run is None:
+            return self._not_found('run')
+        run['status'] = 'cancelled'
+        self._send(200, fake.run_object(run))
+
+    def _event(self, name, data):
+        payload = data if isinstance(data, str) else json.dumps(data)
+        chunk = f'event: {name}\ndata: {payload}\n\n'.encode()
+        self.wfile.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+        self.wfile.flush()
+
+    def _stream_run(self, fake, run):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        run['status'] = 'queued'
+        self._event('thread.run.created', fake.run_object(run))
+        # Time to first token
+        time.sleep(fake.run_latency / 2)
+        if run['status'] == 'cancelled':
+            return self._end_stream(fake, run)
+        run['status'] = 'in_progress'
+        self._event('thread.run.in_progress', fake.run_object(run))
+
+        if run['_fail']:
+            run['status'] = 'failed'
+            run['last_error'] = {'code': 'server_error',
+                                 'message': 'Simulated run failure'}
+            self._event('thread.run.failed', fake.run_object(run))
+        else:
+            message = fake.message(run['thread_id'], 'assistant',
+                                   fake.reply_text(), run_id=run['id'],
+                                   file_id=fake.cited_file())
+            pending = dict(message, status='in_progress', content=[])
+            self._event('thread.message.created', pending)
+            self._event('thread.message.in_progress', pending)
+            text = message['content'][0]['text']['value']
+            for token in re.findall(r'\S+\s*', text):
+                time.sleep(fake.token_delay)
+                if run['status'] == 'cancelled':
+                    # runs.cancel was called while streaming
+                    return self._end_stream(fake, run)
+                self._event('thread.message.delta', {
+                    'id': message['id'], 'object': 'thread.message.delta',
+                    'delta': {'content': [{'index': 0, 'type': 'text',
+                                           'text': {'value': token}}]}})
+            self._event('thread.message.completed', message)
+            with fake.lock:
+                fake.threads[run['thread_id']]['messages'].append(message)
+            run['status'] = 'completed'
+            self._event('thread.run.completed', fake.run_object(run))
+        self._end_stream(fake, run)
+
+    def _end_stream(self, fake, run):
+        if run['status'] == 'cancelled':
+            self._event('thread.run.cancelled', fake.run_object(run))
+        self._event('done', '[DONE]')
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    # -- introspection ----------------------------------------------------------
+
+    def stats(self, fake, body):
+        with fake.lock:
+            self._send(200, {'requests': dict(fake.requests),
+                             'threads': len(fake.threads),
+                             'runs': len(fake.runs),
+                             'files': len(fake.files)})
+
+
+ID = r'([A-Za-z0-9_]+)'
+ROUTES = {
+    'GET': [
+        (r'/assistants/' + ID, Handler.get_assistant),
+        (r'/vector_stores/' + ID, Handler.get_vector_store),
+        (r'/vector_stores/' + ID + '/files/' + ID, Handler.get_vector_store_file),
+        (r'/vector_stores/' + ID + '/file_batches/' + ID, Handler.get_file_batch),
+        (r'/files/' + ID, Handler.get_file),
+        (r'/threads/' + ID + '/messages', Handler.list_messages),
+        (r'/threads/' + ID + '/runs/' + ID, Handler.get_run),
+        (r'/_stats', Handler.stats),
+    ],
+    'POST': [
+        (r'/assistants', Handler.create_assistant),
+        (r'/assistants/' + ID, Handler.update_assistant),
+        (r'/vector_stores', Handler.create_vector_store),
+        (r'/vector_stores/' + ID + '/files', Handler.add_vector_store_file),
+        (r'/vector_stores/' + ID + '/file_batches', Handler.create_file_batch),
+        (r'/files', Handler.create_file),
+        (r'/threads', Handler.create_thread),
+        (r'/threads/' + ID + '/messages', Handler.create_message),
+        (r'/threads/' + ID + '/runs', Handler.create_run),
+        (r'/threads/' + ID + '/runs/' + ID + '/cancel', Handler.cancel_run),
+    ],
+    'DELETE': [
+        (r'/vector_stores/' + ID + '/files/' + ID,
+         Handler.delete_vector_store_file),
+        (r'/files/' + ID, Handler.delete_file),
+    ],
+}
+
+
+def start_server(fake, host='127.0.0.1', port=0):
+    # Serves in a daemon thread; returns the server and its /v1 base URL
+    handler = type('FakeHandler', (Handler,), {'fake': fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True,
+                              name='fake-openai')
+    thread.start()
+    return server, f'http://{host}:{server.server_address[1]}/v1'
+
+
+def add_arguments(parser):
+    parser.add_argument('--request-latency', type=float, default=0.0)
+    parser.add_argument('--run-latency', type=float, default=1.0)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--reply-tokens', type=int, default=40)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def from_arguments(args):
+    return FakeAssistants(request_latency=args.request_latency,
+                          run_latency=args.run_latency,
+                          token_delay=args.token_delay,
+                          reply_tokens=args.reply_tokens,
+                          failure_rate=args.failure_rate,
+                          error_rate=args.error_rate,
+                          seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, base_url = start_server(from_arguments(args), args.host, args.port)
+    print(f'Fake Assistants API listening on {base_url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
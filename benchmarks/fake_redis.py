@@ -0,0 +1,298 @@
+"""A small in-memory, Redis-compatible server for offline multi-worker tests.
+
+It speaks RESP2 and RESP3 (HELLO) and implements only what the app uses: the
+Socket.IO message queue (PUBLISH/SUBSCRIBE) and shared_state.py (GET, SET
+NX/PX, INCR, DEL, PEXPIRE/PTTL and WATCH/MULTI/EXEC for lock release and
+renewal). Not for production
+use.
+
+    python benchmarks/fake_redis.py --port 6390
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class RedisError(Exception):
+    pass
+
+
+class Push(list):
+    # Out-of-band pub/sub messages (a plain array in RESP2)
+    pass
+
+
+class FakeRedis:
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        # key -> number of writes, to detect changes to WATCHed keys
+        self.versions = {}
+        self.channels = {}
+        self.commands = 0
+        self.lock = threading.Lock()
+
+    def _alive(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._delete(key)
+        return key in self.data
+
+    def _write(self, key, value, ttl=None):
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if ttl is not None:
+            self.expires[key] = time.monotonic() + ttl
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def _delete(self, key):
+        if key not in self.data:
+            return 0
+        del self.data[key]
+        self.expires.pop(key, None)
+        self.versions[key] = self.versions.get(key, 0) + 1
+        return 1
+
+    def version(self, key):
+        with self.lock:
+            self._alive(key)
+            return self.versions.get(key, 0)
+
+    def execute(self, name, args):
+        # Commands that only touch the keyspace; called with the lock held
+        self.commands += 1
+        if name == 'PING':
+            return args[0] if args else 'PONG'
+        if name in ('SELECT', 'CLIENT', 'FLUSHDB', 'FLUSHALL'):
+            if name.startswith('FLUSH'):
+                for key in list(self.data):
+                    self._delete(key)
+            return 'OK'
+        if name == 'GET':
+            return self.data[args[0]] if self._alive(args[0]) else None
+        if name == 'SET':
+            key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+            ttl = None
+            for flag, scale in ((b'PX', 0.001), (b'EX', 1)):
+                if flag in options:
+                    ttl = float(args[2 + options.index(flag) + 1]) * scale
+            exists = self._alive(key)
+            if (b'NX' in options and exists) or (b'XX' in options and not exists):
+                return None
+            self._write(key, value, ttl)
+            return 'OK'
+        if name in ('INCR', 'INCRBY'):
+            step = int(args[1]) if name == 'INCRBY' else 1
+            value = (int(self.data[args[0]]) if self._alive(args[0]) else 0) + step
+            ttl = self.expires.get(args[0])
+            self._write(args[0], str(value).encode(),
+                        None if ttl is None else ttl - time.monotonic())
+            return value
+        if name == 'DEL':
+            return sum(self._delete(key) for key in args if self._alive(key))
+        if name == 'EXISTS':
+            return sum(1 for key in args if self._alive(key))
+        if name in ('EXPIRE', 'PEXPIRE'):
+            if not self._alive(args[0]):
+                return 0
+            scale = 1 if name == 'EXPIRE' else 0.001
+            self.expires[args[0]] = time.monotonic() + float(args[1]) * scale
+            return 1
+        if name in ('TTL', 'PTTL'):
+            if not self._alive(args[0]):
+                return -2
+            expires = self.expires.get(args[0])
+            if expires is None:
+                return -1
+            scale = 1 if name == 'TTL' else 1000
+            return int((expires - time.monotonic()) * scale)
+        if name == 'DBSIZE':
+            return sum(1 for key in list(self.data) if self._alive(key))
+        raise RedisError(f"ERR unknown command '{name}'")
+
+    def publish(self, channel, message):
+        with self.lock:
+            self.commands += 1
+            subscribers = list(self.channels.get(channel, ()))
+        for handler in subscribers:
+            handler.send(Push([b'message', channel, message]))
+        return len(subscribers)
+
+    def subscribe(self, handler, channel):
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(handler)
+
+    def unsubscribe(self, handler, channel):
+        with self.lock:
+            self.channels.get(channel, set()).discard(handler)
+
+
+def encode(value, resp3=False):
+    if value is None:
+        return b'_\r\n' if resp3 else b'$-1\r\n'
+    if isinstance(value, RedisError):
+        return f'-{value}\r\n'.encode()
+    if isinstance(value, str):
+        return f'+{value}\r\n'.encode()
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return f':{value}\r\n'.encode()
+    if isinstance(value, bytes):
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+    if isinstance(value, dict):
+        if resp3:
+            return b'%%%d\r\n' % len(value) + b''.join(
+                encode(k, resp3) + encode(v, resp3) for k, v in value.items())
+        value = [item for pair in value.items() for item in pair]
+    kind = b'>' if resp3 and isinstance(value, Push) else b'*'
+    return kind + b'%d\r\n' % len(value) + b''.join(
+        encode(v, resp3) for v in value)
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.subscriptions = set()
+        self.watched = {}
+        self.transaction = None
+        self.resp3 = False
+
+    def send(self, value):
+        with self.write_lock:
+            try:
+                self.wfile.write(encode(value, self.resp3))
+                self.wfile.flush()
+            except OSError:
+                pass
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.readline(length + 2)[:length])
+        return args
+
+    def handle(self):
+        fake = self.server.fake
+        try:
+            while True:
+                command = self.read_command()
+                if command is None:
+                    break
+                if not command:
+                    continue
+                name, args = command[0].decode().upper(), command[1:]
+                self.send(self.dispatch(fake, name, args))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            for channel in self.subscriptions:
+                fake.unsubscribe(self, channel)
+
+    def dispatch(self, fake, name, args):
+        if name == 'HELLO':
+            if args:
+                if args[0] not in (b'2', b'3'):
+                    return RedisError('NOPROTO unsupported protocol version')
+                self.resp3 = args[0] == b'3'
+            return {'server': 'redis', 'version': '7.0.0',
+                    'proto': 3 if self.resp3 else 2, 'mode': 'standalone',
+                    'role': 'master', 'modules': []}
+        if name == 'PUBLISH':
+            return fake.publish(args[0], args[1])
+        if name in ('SUBSCRIBE', 'UNSUBSCRIBE'):
+            # One confirmation per channel
+            replies = []
+            for channel in args or list(self.subscriptions):
+                if name == 'SUBSCRIBE':
+                    self.subscriptions.add(channel)
+                    fake.subscribe(self, channel)
+                else:
+                    self.subscriptions.discard(channel)
+                    fake.unsubscribe(self, channel)
+                replies.append(Push([name.lower().encode(), channel,
+                                     len(self.subscriptions)]))
+            if not replies:
+                return Push([name.lower().encode(), None, 0])
+            for reply in replies[:-1]:
+                self.send(reply)
+            return replies[-1]
+        if name == 'WATCH':
+            for key in args:
+                self.watched[key] = fake.version(key)
+            return 'OK'
+        if name == 'UNWATCH':
+            self.watched = {}
+            return 'OK'
+        if name == 'MULTI':
+            self.transaction = []
+            return 'OK'
+        if name == 'DISCARD':
+            self.transaction = None
+            self.watched = {}
+            return 'OK'
+        if name == 'EXEC':
+            queued, self.transaction = self.transaction or [], None
+            watched, self.watched = self.watched, {}
+            with fake.lock:
+                for key, version in watched.items():
+                    fake._alive(key)
+                    if fake.versions.get(key, 0) != version:
+                        return None
+                results = []
+                for queued_name, queued_args in queued:
+                    try:
+                        results.append(fake.execute(queued_name, queued_args))
+                    except RedisError as e:
+                        results.append(e)
+                return results
+        if self.transaction is not None:
+            self.transaction.append((name, args))
+            return 'QUEUED'
+        with fake.lock:
+            try:
+                return fake.execute(name, args)
+            except RedisError as e:
+                return e
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server(fake=None, host='127.0.0.1', port=0):
+    # Serves in a daemon thread; returns the server and its redis:// URL
+    server = Server((host, port), Handler)
+    server.fake = fake or FakeRedis()
+    threading.Thread(target=server.serve_forever, daemon=True,
+                     name='fake-redis').start()
+    host, port = server.server_address[:2]
+    return server, f'redis://{host}:{port}/0'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    server, url = start_server(host=args.host, port=args.port)
+    print(f'Fake Redis listening on {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Benchmark the per-user chat history queries with and without the
+(user_id, timestamp, id) index on chat_message.
+
+Seeds a local database (SQLite by default, or BENCH_DATABASE_URL) with
+synthetic messages spread over many users, then times the legacy full-history
+query and the paginated /history queries before and after creating the index.
+
+    python benchmarks/history_queries.py --rows 2000000 --users 2000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, create_engine, func, insert, or_, select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, ChatMessage, User  # noqa: E402
+
+INDEX_NAME = 'ix_chat_message_user_id_timestamp_id'
+PAGE_SIZE = 50
+
+
+def seed(engine, rows, users, batch_size=50000):
+    messages = ChatMessage.__table__
+    with engine.begin() as conn:
+        conn.execute(insert(User.__table__), [{
+            'id': i,
+            'username': f'user{i}',
+            'email': f'user{i}@example.com'
+        } for i in range(1, users + 1)])
+
+    start = datetime(2024, 1, 1)
+    written = 0
+    while written < rows:
+        batch = []
+        for i in range(written, min(written + batch_size, rows)):
+            batch.append({
+                'content': f'Mensaje de prueba {i}',
+                'timestamp': start + timedelta(seconds=i),
+                'is_user': i % 2 == 0,
+                'user_id': random.randint(1, users),
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(messages), batch)
+        written += len(batch)
+        print(f'  seeded {written}/{rows}', end='\r', flush=True)
+    print()
+
+
+def history_columns():
+    return (ChatMessage.id, ChatMessage.timestamp, ChatMessage.content,
+            ChatMessage.is_user, ChatMessage.feedback,
+            ChatMessage.there_is_feedback)
+
+
+def queries(conn, user_id, pivot):
+    # Legacy: every row and column for the user, ordered by timestamp
+    def full_history():
+        return conn.execute(
+            select(ChatMessage).where(ChatMessage.user_id == user_id).order_by(
+                ChatMessage.timestamp)).all()
+
+    def newest_page():
+        return conn.execute(
+            select(*history_columns()).where(
+                ChatMessage.user_id == user_id).order_by(
+                    ChatMessage.timestamp.desc(),
+                    ChatMessage.id.desc()).limit(PAGE_SIZE + 1)).all()
+
+    # Keyset pages around a message in the middle of the user's history
+    timestamp, message_id = pivot
+
+    def before_page():
+        return conn.execute(
+            select(*history_columns()).where(
+                ChatMessage.user_id == user_id,
+                or_(ChatMessage.timestamp < timestamp,
+                    and_(ChatMessage.timestamp == timestamp,
+                         ChatMessage.id < message_id))).order_by(
+                             ChatMessage.timestamp.desc(),
+                             ChatMessage.id.desc()).limit(PAGE_SIZE + 1)).all()
+
+    def after_page():
+        return conn.execute(
+            select(*history_columns()).where(
+                ChatMessage.user_id == user_id,
+                or_(ChatMessage.timestamp > timestamp,
+                    and_(ChatMessage.timestamp == timestamp,
+                         ChatMessage.id > message_id))).order_by(
+                             ChatMessage.timestamp,
+                             ChatMessage.id).limit(PAGE_SIZE + 1)).all()
+
+    return {
+        'full history (legacy)': full_history,
+        'newest page': newest_page,
+        'before cursor page': before_page,
+        'after cursor page': after_page,
+    }
+
+
+def pick_pivots(engine, user_ids):
+    pivots = {}
+    with engine.connect() as conn:
+        for user_id in user_ids:
+            count = conn.execute(
+                select(func.count()).where(
+                    ChatMessage.user_id == user_id)).scalar()
+            pivot = conn.execute(
+                select(ChatMessage.timestamp, ChatMessage.id).where(
+                    ChatMessage.user_id == user_id).order_by(
+                        ChatMessage.timestamp).offset(count // 2).limit(1)).first()
+            if pivot is not None:
+                pivots[user_id] = tuple(pivot)
+    return pivots
+
+
+def measure(engine, pivots):
+    results = {}
+    with engine.connect() as conn:
+        for user_id, pivot in pivots.items():
+            for name, query in queries(conn, user_id, pivot).items():
+                started = time.perf_counter()
+                query()
+                results.setdefault(name, []).append(
+                    (time.perf_counter() - started) * 1000)
+    return results
+
+
+def report(label, results):
+    print(f'\n{label}')
+    print(f'  {"query":<24}{"median ms":>12}{"p95 ms":>12}')
+    for name, timings in results.items():
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f'  {name:<24}{statistics.median(timings):>12.2f}{p95:>12.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='number of users to sample per measurement')
+    parser.add_argument('--keep', action='store_true',
+                        help='reuse an already seeded database')
+    args = parser.parse_args()
+
+    url = os.environ.get('BENCH_DATABASE_URL', 'sqlite:///bench_history.db')
+    engine = create_engine(url)
+    metadata = db.metadata
+    index = next(i for i in ChatMessage.__table__.indexes
+                 if i.name == INDEX_NAME)
+
+    if not args.keep:
+        metadata.drop_all(engine)
+        metadata.create_all(engine)
+        print(f'Seeding {args.rows} messages for {args.users} users...')
+        index.drop(engine)
+        seed(engine, args.rows, args.users)
+    else:
+        index.drop(engine, checkfirst=True)
+
+    sample = random.sample(range(1, args.users + 1), min(args.repeat, args.users))
+    pivots = pick_pivots(engine, sample)
+
+    report('Without composite index', measure(engine, pivots))
+
+    started = time.perf_counter()
+    index.create(engine)
+    print(f'\nCreated {INDEX_NAME} in {time.perf_counter() - started:.1f}s')
+
+    report('With composite index', measure(engine, pivots))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,601 @@
+"""Drive many concurrent learners against the chat server and report
+throughput and latency percentiles per operation.
+
+By default everything runs locally and offline: a fake Assistants API
+(benchmarks/fake_openai.py) and the app itself (threading mode, SQLite) are
+started in this process. Each virtual user registers, logs in, connects a
+Socket.IO client and loops over send_message (waiting for receive_message),
+/history, and occasionally /upload and reset_conversation.
+
+    python benchmarks/load_test.py --users 50 --duration 60 --run-latency 1.5
+    python benchmarks/load_test.py --target http://127.0.0.1:5000 --users 20
+    python benchmarks/load_test.py --compare benchmarks/results/load-<...>.json
+    python benchmarks/load_test.py --workers 1 2 4 --users 64
+
+--workers runs the multi-worker deployment mode instead: that many app
+processes on consecutive ports, sharing a fake Redis
+(benchmarks/fake_redis.py) as Socket.IO message queue and shared state, with
+every user stuck to one worker. Several counts run one test each and print
+how send_message throughput scales. Workers, the fakes and the virtual users
+all share this machine's CPUs, so the speedup levels off once they are
+saturated; on a small machine, make the per-worker run limit the bottleneck
+to see the scaling of the deployment itself:
+
+    LLM_CONCURRENCY=4 ADMISSION_GLOBAL_RATE=100000 ADMISSION_USER_RATE=100000 \
+        python benchmarks/load_test.py --workers 1 2 4 --users 48 \
+        --run-latency 2 --reply-tokens 10 --upload-rate 0
+
+Logins and connects happen before the measured window starts.
+
+Admission control applies as in production; raise ADMISSION_USER_RATE,
+ADMISSION_GLOBAL_RATE etc. to measure raw capacity instead. Rejections are
+reported as send_message errors (backpressure:<reason>).
+
+Results are written to benchmarks/results/ as JSON. --compare loads an
+earlier result and exits with status 1 when a p50/p95 latency regressed by
+more than --tolerance, or the throughput dropped by more than that.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+import socketio
+from engineio.payload import Payload
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_openai  # noqa: E402
+import fake_redis  # noqa: E402
+
+# A streamed reply arrives as dozens of small chunk events and a long-poll
+# response may carry all of them; the Python client rejects payloads with
+# more than 16 packets by default (browsers have no such limit)
+Payload.max_decode_packets = 1000
+
+try:
+    import websocket  # noqa: F401  (websocket-client, enables websockets)
+    DEFAULT_TRANSPORTS = None
+except ImportError:
+    DEFAULT_TRANSPORTS = ['polling']
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+SAMPLE_PDF = os.path.join(ROOT, 'pdf-test.pdf')
+
+# A few questions repeat across learners, like real course questions do
+QUESTIONS = [
+    '¿Qué incluye el mantenimiento preventivo del vehículo?',
+    '¿Cada cuánto se debe cambiar el aceite del motor?',
+    '¿Qué sistemas de seguridad tiene la camioneta nueva?',
+    '¿Cómo se revisa la presión de las llantas?',
+    '¿Dónde se explica el proceso de garantía?',
+]
+
+
+class Recorder:
+    # Latency samples and errors per operation, shared by all virtual users
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, operation, seconds):
+        with self.lock:
+            self.samples.setdefault(operation, []).append(seconds)
+
+    def error(self, operation, reason):
+        with self.lock:
+            errors = self.errors.setdefault(operation, {})
+            errors[reason] = errors.get(reason, 0) + 1
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(recorder, elapsed):
+    operations = {}
+    for operation in sorted(set(recorder.samples) | set(recorder.errors)):
+        values = sorted(recorder.samples.get(operation, []))
+        errors = sum(recorder.errors.get(operation, {}).values())
+        operations[operation] = {
+            'count': len(values),
+            'errors': errors,
+            'error_reasons': recorder.errors.get(operation, {}),
+            'throughput': round(len(values) / elapsed, 3),
+            'mean': round(sum(values) / len(values), 4) if values else None,
+            'p50': percentile(values, 0.50),
+            'p90': percentile(values, 0.90),
+            'p95': percentile(values, 0.95),
+            'p99': percentile(values, 0.99),
+            'max': values[-1] if values else None,
+        }
+    return operations
+
+
+class Backpressure(Exception):
+    pass
+
+
+class VirtualUser:
+
+    def __init__(self, target, index, recorder, args):
+        self.target = target
+        self.username = f'load{index}-{uuid.uuid4().hex[:6]}'
+        self.recorder = recorder
+        self.args = args
+        # Set by run_users once every user is connected
+        self.stop_at = None
+        self.random = random.Random(index if args.seed is None
+                                    else args.seed + index)
+        self.http = requests.Session()
+        # The Socket.IO client polls from its own threads, so it gets its own
+        # HTTP session (with the login cookies) instead of sharing self.http
+        self.socket_http = requests.Session()
+        self.sio = socketio.Client(http_session=self.socket_http,
+                                   reconnection=False)
+        self.reply = threading.Event()
+        self.first_chunk = None
+        self.reset_done = threading.Event()
+        self.sio.on('receive_message', self._on_reply)
+        self.sio.on('receive_message_chunk', self._on_chunk)
+        self.sio.on('backpressure', self._on_backpressure)
+        self.backpressure = None
+        self.sio.on('conversation_reset', lambda *a: self.reset_done.set())
+
+    def _on_reply(self, data):
+        self.reply.set()
+
+    def _on_backpressure(self, data):
+        self.backpressure = data
+        self.reply.set()
+
+    def _on_chunk(self, data):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter()
+
+    def timed(self, operation, fn):
+        started = time.perf_counter()
+        try:
+            ok = fn()
+        except Exception as e:
+            reason = type(e).__name__
+            if isinstance(e, Backpressure):
+                reason = f'backpressure:{e}'
+            self.recorder.error(operation, reason)
+            return False
+        if ok is False:
+            self.recorder.error(operation, 'failed')
+            return False
+        self.recorder.record(operation, time.perf_counter() - started)
+        return True
+
+    def login(self):
+        credentials = {'username': self.username, 'password': 'load-test'}
+        self.http.post(f'{self.target}/register', allow_redirects=False,
+                       data=dict(credentials,
+                                 email=f'{self.username}@example.com'))
+        response = self.http.post(f'{self.target}/login', data=credentials,
+                                  allow_redirects=False)
+        return response.status_code == 302 and 'login' not in \
+            response.headers.get('Location', '')
+
+    def send_message(self):
+        self.reply.clear()
+        self.first_chunk = None
+        self.backpressure = None
+        started = time.perf_counter()
+        self.sio.emit('send_message',
+                      {'message': self.random.choice(QUESTIONS)})
+        if not self.reply.wait(self.args.reply_timeout):
+            raise TimeoutError()
+        if self.backpressure is not None:
+            # Rejected by admission control: back off as the browser does
+            time.sleep(min(self.backpressure.get('retry_after') or 1,
+                           max(self.stop_at - time.monotonic(), 0)))
+            raise Backpressure(self.backpressure.get('reason'))
+        if self.first_chunk is not None:
+            self.recorder.record('first_chunk', self.first_chunk - started)
+
+    def history(self):
+        response = self.http.get(f'{self.target}/history',
+                                 params={'limit': 20})
+        return response.status_code == 200
+
+    def upload(self):
+        # Unique bytes per upload so every file goes through ingestion
+        with open(SAMPLE_PDF, 'rb') as f:
+            content = f.read() + f'\n%{uuid.uuid4().hex}\n'.encode()
+        response = self.http.post(
+            f'{self.target}/upload',
+            files={'file': ('material.pdf', content, 'application/pdf')})
+        return response.status_code in (200, 202)
+
+    def reset(self):
+        self.reset_done.clear()
+        self.sio.emit('reset_conversation')
+        if not self.reset_done.wait(self.args.reply_timeout):
+            raise TimeoutError()
+
+    def setup(self):
+        if not self.timed('login', self.login):
+            return False
+        self.socket_http.cookies.update(self.http.cookies)
+        return self.timed('connect', lambda: self.sio.connect(
+            self.target, transports=self.args.transports))
+
+    def run(self, start, delay):
+        # Waits for `start`, then sends until stop_at
+        start.wait()
+        time.sleep(delay)
+        try:
+            turns = 0
+            while time.monotonic() < self.stop_at and \
+                    (not self.args.turns or turns < self.args.turns):
+                turns += 1
+                self.timed('send_message', self.send_message)
+                if turns % self.args.history_every == 0:
+                    self.timed('history', self.history)
+                if self.random.random() < self.args.upload_rate:
+                    self.timed('upload', self.upload)
+                if self.random.random() < self.args.reset_rate:
+                    self.timed('reset_conversation', self.reset)
+                if self.args.think_time:
+                    time.sleep(self.random.uniform(0, 2 * self.args.think_time))
+        finally:
+            self.sio.disconnect()
+
+
+def local_environment(workdir, base_url):
+    return {
+        'OPENAI_BASE_URL': base_url,
+        'OPENAI_API_KEY': 'fake',
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        'SOCKETIO_ASYNC_MODE': 'threading',
+        'ASSISTANT_MANIFEST': os.path.join(workdir, 'assistant_manifest.json'),
+        'LEXICAL_INDEX_PATH': os.path.join(workdir, 'lexical_index.npz'),
+        'STATIC_BUILD_DIR': os.path.join(workdir, 'static_build'),
+        'LOAD_TEST_WORKDIR': workdir,
+    }
+
+
+def wait_until_up(target, path='/ready', timeout=60, process=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'worker for {target} exited with status '
+                               f'{process.returncode}')
+        try:
+            if requests.get(f'{target}{path}', timeout=1).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f'{target} did not become ready')
+
+
+def prepare_app():
+    # Imports the app configured by local_environment() and creates its tables
+    os.environ.setdefault('LOG_SAMPLE_RATE', '0')
+    os.chdir(ROOT)
+    import app as chat_app
+    from models import db
+    from shared_state import shared_state
+
+    chat_app.app.config['UPLOAD_FOLDER'] = os.path.join(
+        os.environ['LOAD_TEST_WORKDIR'], 'uploads')
+    with chat_app.app.app_context(), shared_state.lock('create_all'):
+        db.create_all()
+    chat_app.ingestion_queue.resume()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    return chat_app
+
+
+def run_app(chat_app, port):
+    chat_app.socketio.run(chat_app.app, host='127.0.0.1', port=port,
+                          allow_unsafe_werkzeug=True, log_output=False)
+
+
+def start_local_app(args):
+    # Fake Assistants API and the app, both in this process
+    fake = fake_openai.from_arguments(args)
+    fake_server, base_url = fake_openai.start_server(fake)
+
+    workdir = tempfile.mkdtemp(prefix='load-test-')
+    os.environ.update(local_environment(workdir, base_url))
+    chat_app = prepare_app()
+    thread = threading.Thread(target=run_app, args=(chat_app, args.port),
+                              daemon=True, name='app-server')
+    thread.start()
+    target = f'http://127.0.0.1:{args.port}'
+    wait_until_up(target, '/metrics')
+    # Create the assistant up front, like the warm-up task on startup
+    chat_app.warm_knowledge_base()
+    return target, fake
+
+
+def serve_worker(args):
+    # Body of one worker process in --workers mode; the parent passes the
+    # configuration through the environment
+    chat_app = prepare_app()
+    chat_app.warm_knowledge_base()
+    run_app(chat_app, args.port)
+
+
+class Workers:
+    # Fake Assistants API and fake Redis in this process, plus `count` app
+    # processes sharing them, like the multi-worker deployment mode
+
+    def __init__(self, args, count, port):
+        self.fake = fake_openai.from_arguments(args)
+        self.servers = []
+        self.processes = []
+        self.targets = []
+        fake_server, base_url = fake_openai.start_server(self.fake)
+        redis_server, redis_url = fake_redis.start_server()
+        self.servers = [fake_server, redis_server]
+
+        workdir = tempfile.mkdtemp(prefix='load-test-')
+        env = dict(os.environ, **local_environment(workdir, base_url),
+                   SOCKETIO_MESSAGE_QUEUE=redis_url,
+                   WEB_WORKERS=str(count))
+        try:
+            for i in range(count):
+                target = f'http://127.0.0.1:{port + i}'
+                self.processes.append(subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__),
+                     '--serve-worker', '--port', str(port + i)],
+                    env=dict(env, PORT=str(port + i)), cwd=ROOT))
+                self.targets.append(target)
+            for target, process in zip(self.targets, self.processes):
+                wait_until_up(target, process=process)
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+def stage_means(targets):
+    # Mean server-side time per chat stage, from /metrics of every worker
+    sums, counts = {}, {}
+    for target in targets:
+        try:
+            text = requests.get(f'{target}/metrics', timeout=5).text
+        except requests.RequestException:
+            continue
+        for pattern, totals in ((r'chat_stage_seconds_sum\{stage="(\w+)"\} (\S+)', sums),
+                                (r'chat_stage_seconds_count\{stage="(\w+)"\} (\S+)', counts)):
+            for stage, value in re.findall(pattern, text):
+                totals[stage] = totals.get(stage, 0.0) + float(value)
+    return {stage: round(sums[stage] / counts[stage], 4)
+            for stage in sums if counts.get(stage)}
+
+
+def run_users(args, targets):
+    # Each user sticks to one worker, as behind an ip_hash balancer. Logins
+    # (password hashing) and connects happen first and are left out of the
+    # measured window, so throughput only counts the conversation loop.
+    recorder = Recorder()
+    users = [VirtualUser(targets[i % len(targets)], i, recorder, args)
+             for i in range(args.users)]
+    ready = [None] * len(users)
+
+    def setup(i):
+        ready[i] = users[i].setup()
+
+    setups = [threading.Thread(target=setup, args=(i,), daemon=True)
+              for i in range(len(users))]
+    for thread in setups:
+        thread.start()
+    for thread in setups:
+        thread.join()
+
+    start = threading.Event()
+    threads = []
+    for i, user in enumerate(users):
+        if not ready[i]:
+            continue
+        thread = threading.Thread(
+            target=user.run, daemon=True, name=f'virtual-user-{i}',
+            args=(start, i * args.ramp_up / max(args.users, 1)))
+        thread.start()
+        threads.append(thread)
+    started = time.monotonic()
+    for user in users:
+        user.stop_at = started + args.ramp_up + args.duration
+    start.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    return {
+        'elapsed': round(elapsed, 3),
+        'operations': summarize(recorder, elapsed),
+        'server_stages': stage_means(targets),
+    }
+
+
+def print_operations(result):
+    print(f"{'operation':<20}{'count':>7}{'errors':>7}{'ops/s':>9}"
+          f"{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for operation, stats in result['operations'].items():
+        cells = [f"{stats[k]:>9.3f}" if stats[k] is not None else f"{'-':>9}"
+                 for k in ('throughput', 'p50', 'p95', 'p99', 'max')]
+        print(f"{operation:<20}{stats['count']:>7}{stats['errors']:>7}"
+              + ''.join(cells))
+    if result['server_stages']:
+        print('\nServer-side mean per stage (s): ' + ', '.join(
+            f'{stage}={value}' for stage, value in
+            sorted(result['server_stages'].items())))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline, tolerance):
+    # Returns the list of regressions and prints a side-by-side table
+    regressions = []
+    print(f"\nComparison with {baseline['started_at']} "
+          f"(commit {baseline.get('commit')})")
+    print(f"{'operation':<20}{'metric':<12}{'baseline':>12}{'current':>12}"
+          f"{'change':>10}")
+    for operation, stats in current['operations'].items():
+        before = baseline['operations'].get(operation)
+        if not before:
+            continue
+        for metric in ('throughput', 'p50', 'p95'):
+            old, new = before.get(metric), stats.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change < -tolerance if metric == 'throughput' \
+                else change > tolerance
+            flag = '  <-- regression' if worse else ''
+            print(f'{operation:<20}{metric:<12}{old:>12.4f}{new:>12.4f}'
+                  f'{change:>+10.1%}{flag}')
+            if worse:
+                regressions.append((operation, metric, change))
+    return regressions
+
+
+def print_scaling(runs):
+    base = runs[0]['operations'].get('send_message', {}).get('throughput')
+    print(f"\n{'workers':>8}{'send/s':>10}{'speedup':>9}{'p50':>9}{'p95':>9}"
+          f"{'errors':>8}")
+    for run in runs:
+        stats = run['operations'].get('send_message', {})
+        throughput = stats.get('throughput') or 0
+        speedup = throughput / base if base else 0
+        cells = [f"{stats[k]:>9.3f}" if stats.get(k) is not None else f"{'-':>9}"
+                 for k in ('p50', 'p95')]
+        print(f"{run['workers']:>8}{throughput:>10.3f}{speedup:>8.2f}x"
+              + ''.join(cells) + f"{stats.get('errors', 0):>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', help='base URL of a running server; '
+                        'by default the app and a fake API run in-process')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--turns', type=int, default=0,
+                        help='messages per user (0 = until --duration)')
+    parser.add_argument('--ramp-up', type=float, default=2.0)
+    parser.add_argument('--think-time', type=float, default=0.0)
+    parser.add_argument('--history-every', type=int, default=3)
+    parser.add_argument('--upload-rate', type=float, default=0.02)
+    parser.add_argument('--reset-rate', type=float, default=0.02)
+    parser.add_argument('--reply-timeout', type=float, default=60)
+    parser.add_argument('--transports', nargs='+', default=DEFAULT_TRANSPORTS,
+                        help='Socket.IO transports, e.g. polling websocket')
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', help='result file (default: '
+                        'benchmarks/results/load-<timestamp>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    parser.add_argument('--workers', type=int, nargs='+', default=[],
+                        help='run the app as this many worker processes '
+                        'sharing a fake Redis; several values run one test '
+                        'per count and report how throughput scales')
+    parser.add_argument('--serve-worker', action='store_true',
+                        help=argparse.SUPPRESS)
+    fake_openai.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.serve_worker:
+        serve_worker(args)
+        return
+
+    result = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'label': args.label,
+        'target': args.target or 'in-process',
+        'cpus': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('output', 'compare', 'serve_worker')},
+    }
+    if args.target or not args.workers:
+        fake = None
+        target = args.target
+        if not target:
+            target, fake = start_local_app(args)
+        result.update(run_users(args, [target]))
+        if fake is not None:
+            result['fake_api_requests'] = dict(fake.requests)
+        print(f"\n{args.users} users, {result['elapsed']:.1f}s against "
+              f"{result['target']}")
+        print_operations(result)
+    else:
+        result['target'] = 'workers'
+        result['runs'] = []
+        port = args.port
+        for count in args.workers:
+            workers = Workers(args, count, port)
+            port += count
+            try:
+                run = dict(run_users(args, workers.targets), workers=count,
+                           fake_api_requests=dict(workers.fake.requests))
+            finally:
+                workers.stop()
+            result['runs'].append(run)
+            print(f"\n{args.users} users, {run['elapsed']:.1f}s against "
+                  f"{count} worker(s)")
+            print_operations(run)
+        # The last run is the one --compare looks at
+        result.update({key: result['runs'][-1][key]
+                       for key in ('elapsed', 'operations', 'server_stages')})
+        if len(result['runs']) > 1:
+            print(f"\n{os.cpu_count()} CPU(s) shared by all workers, the fakes "
+                  f"and the virtual users")
+            print_scaling(result['runs'])
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f'\nResults saved to {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
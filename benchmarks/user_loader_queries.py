@@ -0,0 +1,99 @@
+"""Count the user lookups the Flask-Login user_loader issues per chat turn,
+with and without the in-process user cache.
+
+A chat turn is modelled as the traffic one learner produces: the send_message
+Socket.IO event, a feedback POST and an incremental /history refresh. The
+assistant run itself is skipped (generate_reply is replaced by a no-op) since
+only database traffic is being measured.
+
+    python benchmarks/user_loader_queries.py --turns 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+db_path = os.path.join(tempfile.mkdtemp(), 'bench_users.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{db_path}')
+os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'threading')
+os.environ.setdefault('OPENAI_API_KEY', 'unused')
+
+from sqlalchemy import event  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+import app as chat_app  # noqa: E402
+from models import db, ChatMessage, User  # noqa: E402
+
+
+def run_turns(turns):
+    flask_client = chat_app.app.test_client()
+    flask_client.post('/login', data={'username': 'bench', 'password': 'bench'})
+    socket_client = chat_app.socketio.test_client(
+        chat_app.app, flask_test_client=flask_client)
+
+    with chat_app.app.app_context():
+        message_id = ChatMessage.query.filter_by(is_user=False).first().id
+
+    counter = {'user': 0, 'total': 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter['total'] += 1
+        if 'FROM user' in statement:
+            counter['user'] += 1
+
+    with chat_app.app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for i in range(turns):
+            socket_client.emit('send_message', {'message': f'pregunta {i}'})
+            flask_client.post('/feedback', json={'message_id': str(message_id),
+                                                 'is_like': i % 2 == 0})
+            flask_client.get('/history?limit=10')
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+        socket_client.disconnect()
+    return counter
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--turns', type=int, default=200)
+    args = parser.parse_args()
+
+    # Only database traffic is measured; skip the assistant round trip
+    chat_app.generate_reply = lambda *args, **kwargs: None
+
+    with chat_app.app.app_context():
+        db.create_all()
+        db.session.add(User(username='bench', email='bench@example.com',
+                            password_hash=generate_password_hash('bench')))
+        db.session.commit()
+        user_id = User.query.filter_by(username='bench').first().id
+        db.session.add(ChatMessage(content='respuesta', is_user=False,
+                                   user_id=user_id))
+        db.session.commit()
+
+    cache = chat_app.user_cache
+    original_get = cache.get
+
+    cache.get = lambda key, default=None: default
+    uncached = run_turns(args.turns)
+    cache.get = original_get
+    cache.clear()
+    cached = run_turns(args.turns)
+
+    print(f'{args.turns} chat turns (send_message + feedback + history)')
+    print(f'  {"":<14}{"user queries":>14}{"per turn":>10}{"all queries":>14}')
+    for label, counter in (('without cache', uncached), ('with cache', cached)):
+        print(f'  {label:<14}{counter["user"]:>14}'
+              f'{counter["user"] / args.turns:>10.2f}{counter["total"]:>14}')
+    saved = (uncached['user'] - cached['user']) / args.turns
+    print(f'  saved {saved:.2f} user lookups per chat turn')
+    print(f'  cache stats: {cache.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,40 @@
 import os
-from openai import OpenAI
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import httpx
+from openai import OpenAI, NotFoundError, APITimeoutError
 from openai.types.beta.threads import message_content
+from assistant_manifest import load_manifest, save_manifest, manifest_lock, file_sha256, text_sha256
+from run_waiter import wait_for_run, RunError, RunCancelledError, RunTracker, RUN_TIMEOUT_SECONDS
+from thread_registry import registry
+from shared_state import shared_state
+from ttl_cache import TTLCache
+from lexical_index import lexical_index, format_passages
+from metrics import timed, observe_stage
+from openai_transport import build_http_client
+from structured_log import log_event
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# Pool de conexiones, timeouts, reintentos y circuit breaker en el transporte
+client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"),
+                http_client=build_http_client(),
+                max_retries=0)
 
 assistant = None
-thread = None
 vector_store = None
 
-def initialize_assistant():
-    global assistant, vector_store
+NO_RESPONSE = "No se encontró respuesta del asistente."
+ERROR_RESPONSE = "Lo siento, no pude generar una respuesta en este momento. Intenta de nuevo."
 
-    # Create a new assistant
-    assistant = client.beta.assistants.create(
-        name="PDF Assistant",
-        instructions="""Actua como un compañero de estudios personalizado (llamado Lapzito) para los colaboradores de Mazda en la plataforma Lapzo, ayudando a resolver dudas relacionadas con los cursos de manera eficiente. Además, deberá escalar consultas complejas a instructores o administradores cuando sea necesario.
+# Nombres de archivo por file_id, para resolver las citas sin ir a la API
+file_names = TTLCache(max_size=int(os.environ.get("FILE_CACHE_SIZE", 4096)),
+                      ttl=float(os.environ.get("FILE_CACHE_TTL", 3600)))
+_lookup_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="file-lookup")
+
+ASSISTANT_NAME = "PDF Assistant"
+ASSISTANT_MODEL = "gpt-4o"
+ASSISTANT_INSTRUCTIONS = """Actua como un compañero de estudios personalizado (llamado Lapzito) para los colaboradores de Mazda en la plataforma Lapzo, ayudando a resolver dudas relacionadas con los cursos de manera eficiente. Además, deberá escalar consultas complejas a instructores o administradores cuando sea necesario.
 
     **Funciones principales:**
     
@@ -48,150 +68,510 @@ def initialize_assistant():
        - No proporciona asesoramiento técnico o especializado más allá de los materiales del curso.
     
     **Llamado a la acción final:**
-   - Si el colaborador tiene dudas adicionales, puede preguntar nuevamente o solicitar que la consulta sea derivada a un experto.""",
-        model="gpt-4o",
-        tools=[{"type": "file_search"}]
-    )
+   - Si el colaborador tiene dudas adicionales, puede preguntar nuevamente o solicitar que la consulta sea derivada a un experto."""
+
+# Ruta de los archivos PDF a cargar
+PDF_PATHS = ["pdf-test.pdf", "pdf-test-1.pdf", "pdf-test-2.pdf"]
+
+# Lo que el lock del hilo debe durar más allá del límite de una ejecución,
+# para leer su respuesta con el lock todavía tomado
+RUN_LOCK_MARGIN = float(os.environ.get("RUN_LOCK_MARGIN", 60))
+
+# Pasajes del índice local que se adjuntan a cada ejecución (0 = ninguno)
+LOCAL_CONTEXT_PASSAGES = int(os.environ.get("LOCAL_CONTEXT_PASSAGES", 0))
+
+_init_lock = Lock()
+
+def initialize_assistant():
+    global assistant, vector_store
+
+    # Idempotente: sólo la primera llamada del proceso hace trabajo remoto
+    with _init_lock:
+        if assistant is not None:
+            return assistant
+
+        with manifest_lock():
+            manifest = load_manifest()
+            store = _ensure_vector_store(manifest)
+            current = _ensure_assistant(manifest, store.id)
+            _sync_files(manifest, store.id, PDF_PATHS)
+            save_manifest(manifest)
+        _warm_file_names(manifest)
+
+        vector_store = store
+        assistant = current
+    return assistant
+
+def _ensure_vector_store(manifest):
+    vector_store_id = manifest.get("vector_store_id")
+    if vector_store_id:
+        try:
+            return client.beta.vector_stores.retrieve(vector_store_id)
+        except NotFoundError:
+            # Se crea uno nuevo
+            log_event("vector_store_missing", level="warning",
+                      vector_store_id=vector_store_id)
 
     # Crear un vector store para almacenar los archivos PDF
-    vector_store = client.beta.vector_stores.create(name="PDF Knowledge Base")
+    store = client.beta.vector_stores.create(name="PDF Knowledge Base")
+    manifest["vector_store_id"] = store.id
+    manifest["files"] = {}
+    manifest["uploads"] = {}
+    return store
 
-    # Ruta de los archivos PDF a cargar
-    pdf_paths = ["pdf-test.pdf", "pdf-test-1.pdf", "pdf-test-2.pdf"]
+def _ensure_assistant(manifest, vector_store_id):
+    config_hash = text_sha256(ASSISTANT_NAME + ASSISTANT_MODEL + ASSISTANT_INSTRUCTIONS)
+    tool_resources = {"file_search": {"vector_store_ids": [vector_store_id]}}
 
-    # Preparar los archivos para subirlos al vector store
-    file_streams = []
-    for pdf_path in pdf_paths:
-        if os.path.exists(pdf_path):
-            file_streams.append(open(pdf_path, "rb"))
+    assistant_id = manifest.get("assistant_id")
+    if assistant_id:
+        try:
+            current = client.beta.assistants.retrieve(assistant_id)
+        except NotFoundError:
+            # Se crea uno nuevo
+            log_event("assistant_missing", level="warning",
+                      assistant_id=assistant_id)
         else:
-            print(f"Error: {pdf_path} no encontrado.")
+            if (manifest.get("assistant_config") != config_hash
+                    or manifest.get("assistant_vector_store_id") != vector_store_id):
+                # Actualizar el asistente existente en vez de crear otro
+                current = client.beta.assistants.update(
+                    assistant_id=assistant_id,
+                    name=ASSISTANT_NAME,
+                    instructions=ASSISTANT_INSTRUCTIONS,
+                    model=ASSISTANT_MODEL,
+                    tool_resources=tool_resources
+                )
+                log_event("assistant_updated", sample_rate=1,
+                          assistant_id=assistant_id,
+                          vector_store_id=vector_store_id)
+            manifest["assistant_config"] = config_hash
+            manifest["assistant_vector_store_id"] = vector_store_id
+            return current
 
-    if file_streams:
-        # Subir los archivos y esperar a que se procesen
-        file_batch = client.beta.vector_stores.file_batches.upload_and_poll(
-            vector_store_id=vector_store.id,
-            files=file_streams
-        )
-        print("Archivos subidos al vector store.")
+    # Create a new assistant
+    current = client.beta.assistants.create(
+        name=ASSISTANT_NAME,
+        instructions=ASSISTANT_INSTRUCTIONS,
+        model=ASSISTANT_MODEL,
+        tools=[{"type": "file_search"}],
+        tool_resources=tool_resources
+    )
+    manifest["assistant_id"] = current.id
+    manifest["assistant_config"] = config_hash
+    manifest["assistant_vector_store_id"] = vector_store_id
+    return current
 
-        # Actualizar el asistente para usar el nuevo vector store
-        assistant = client.beta.assistants.update(
-            assistant_id=assistant.id,
-            tool_resources={"file_search": {"vector_store_ids": [vector_store.id]}}
-        )
-        print(f"Asistente actualizado con vector store ID {vector_store.id}")
-    else:
-        print("No hay archivos para subir.")
+def _sync_files(manifest, vector_store_id, pdf_paths):
+    # Sólo se suben los archivos nuevos o cuyo contenido cambió
+    files = manifest.setdefault("files", {})
+    uploaded = {}
+    for pdf_path in pdf_paths:
+        if not os.path.exists(pdf_path):
+            log_event("course_pdf_missing", level="error", path=pdf_path)
+            continue
+
+        digest = file_sha256(pdf_path)
+        entry = files.get(pdf_path)
+        if entry and entry["sha256"] == digest:
+            continue
+
+        with open(pdf_path, "rb") as f:
+            uploaded[pdf_path] = (client.files.create(file=f, purpose="assistants").id, digest)
+
+        # Retirar la versión anterior del archivo
+        if entry:
+            try:
+                client.beta.vector_stores.files.delete(
+                    vector_store_id=vector_store_id,
+                    file_id=entry["file_id"]
+                )
+                client.files.delete(entry["file_id"])
+            except NotFoundError:
+                pass
+
+    if not uploaded:
+        log_event("vector_store_up_to_date", sample_rate=1)
+        return
+
+    # Adjuntar los archivos y esperar a que se procesen
+    client.beta.vector_stores.file_batches.create_and_poll(
+        vector_store_id=vector_store_id,
+        file_ids=[file_id for file_id, digest in uploaded.values()]
+    )
+    for pdf_path, (file_id, digest) in uploaded.items():
+        files[pdf_path] = {"file_id": file_id, "sha256": digest}
+    log_event("vector_store_files_uploaded", sample_rate=1,
+              files=len(uploaded))
+
+def _warm_file_names(manifest):
+    for pdf_path, entry in manifest.get("files", {}).items():
+        file_names.set(entry["file_id"], os.path.basename(pdf_path))
+
+def get_assistant():
+    return assistant if assistant is not None else initialize_assistant()
+
+def is_ready():
+    return assistant is not None
+
+
+# Máximo de mensajes que acepta threads.create al sembrar un hilo
+MAX_SEED_MESSAGES = 32
+
+def _create_thread(user_id, initial_history=None):
+    # Sembrar el hilo con todo el historial en una sola llamada
+    messages = [{
+        'role': message['role'],
+        'content': message['content']
+    } for message in (initial_history or [])[-MAX_SEED_MESSAGES:]
+      if message['content']]
+    with timed('thread_create'):
+        if messages:
+            thread = client.beta.threads.create(messages=messages)
+        else:
+            thread = client.beta.threads.create()
+    registry.set(user_id, thread.id)
+    return thread.id
+
+def _get_thread_id(user_id, context=None):
+    # Reutilizar el hilo del usuario; sólo se hidrata con la ventana de
+    # contexto cuando todavía no tiene uno
+    thread_id = registry.get(user_id)
+    if thread_id is None:
+        history = context['messages'] if context else None
+        thread_id = _create_thread(user_id, history)
+    return thread_id
 
+def _run_options(context, user_message=None):
+    # Limitar lo que ve el modelo a la ventana reciente (más el mensaje actual)
+    # y pasar el resumen de los turnos anteriores como instrucciones
+    options = {}
+    instructions = []
+    if context:
+        options['truncation_strategy'] = {
+            'type': 'last_messages',
+            'last_messages': len(context['messages']) + 1
+        }
+        if context['summary']:
+            instructions.append(
+                "Resumen de la conversación anterior con el colaborador:\n"
+                + context['summary'])
+    # Pasajes relevantes del índice local, con su cita, como contexto reducido
+    if LOCAL_CONTEXT_PASSAGES and user_message:
+        passages = lexical_index.search(user_message, k=LOCAL_CONTEXT_PASSAGES)
+        if passages:
+            instructions.append(
+                "Pasajes de los materiales del curso relacionados con la "
+                "pregunta:\n" + format_passages(passages))
+    if instructions:
+        options['additional_instructions'] = "\n\n".join(instructions)
+    return options
 
-def initialize_conversation(initial_history=None):
-    global thread
-    thread = client.beta.threads.create()
-    if initial_history:
-        for message in initial_history:
+def _add_user_message(user_id, user_message, context=None):
+    thread_id = _get_thread_id(user_id, context)
+    try:
+        with timed('message_create'):
+            client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role="user",
+                content=user_message
+            )
+    except NotFoundError:
+        # El hilo guardado ya no existe en el servidor: volver a sembrarlo
+        log_event("thread_missing", level="warning", user_id=user_id,
+                  thread_id=thread_id)
+        registry.clear(user_id)
+        thread_id = _get_thread_id(user_id, context)
+        with timed('message_create'):
             client.beta.threads.messages.create(
-                thread_id=thread.id,
-                role=message['role'],
-                content=message['content']
+                thread_id=thread_id,
+                role="user",
+                content=user_message
             )
+    return thread_id
+
+def _retrieve_file_name(file_id):
+    try:
+        name = client.files.retrieve(file_id).filename
+    except Exception as e:
+        log_event("file_lookup_failed", level="warning", file_id=file_id,
+                  error=str(e))
+        return None
+    file_names.set(file_id, name)
+    return name
 
-def get_chatbot_response(user_message: str) -> str:
-    global thread
+def _file_names(file_ids):
+    # Nombres desde la caché; los que faltan se consultan en paralelo
+    names = {}
+    missing = []
+    for file_id in dict.fromkeys(file_ids):
+        name = file_names.get(file_id)
+        if name is None:
+            missing.append(file_id)
+        else:
+            names[file_id] = name
+    if len(missing) == 1:
+        names[missing[0]] = _retrieve_file_name(missing[0])
+    elif missing:
+        for file_id, name in zip(missing, _lookup_executor.map(_retrieve_file_name, missing)):
+            names[file_id] = name
+    return names
 
-    if thread is None:
-        thread = client.beta.threads.create()
+def _replace_annotations(text, annotations):
+    # Sustituye cada anotación por su referencia [n] en una sola pasada
+    if all(getattr(a, 'start_index', None) is not None for a in annotations):
+        pieces = []
+        position = 0
+        for index, annotation in sorted(enumerate(annotations),
+                                        key=lambda item: item[1].start_index):
+            if annotation.start_index < position:
+                continue
+            pieces.append(text[position:annotation.start_index])
+            pieces.append(f' [{index + 1}]')
+            position = annotation.end_index
+        pieces.append(text[position:])
+        return ''.join(pieces)
 
-    # Añadir el mensaje del usuario al hilo
-    client.beta.threads.messages.create(
-        thread_id=thread.id,
-        role="user",
-        content=user_message
-    )
+    references = {}
+    for index, annotation in enumerate(annotations):
+        references.setdefault(annotation.text, f' [{index + 1}]')
+    pattern = re.compile('|'.join(re.escape(t) for t in sorted(references, key=len, reverse=True)))
+    return pattern.sub(lambda match: references[match.group(0)], text)
 
-    # Crear una ejecución (run) del asistente
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
-        assistant_id=assistant.id
-    )
+def format_assistant_message(message) -> str:
+    message_content = message.content[0].text
+
+    # Extraer anotaciones del mensaje
+    annotations = [a for a in message_content.annotations if a.text]
+    if not annotations:
+        return message_content.value + '\n'
 
-    # Esperar a que la ejecución se complete
-    while run.status != "completed":
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+    # Reemplazar el texto de cada anotación con una referencia al pie de página
+    text = _replace_annotations(message_content.value, annotations)
 
-    # Obtener la respuesta del asistente
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
+    # Resolver los nombres de todos los archivos citados de una vez
+    file_ids = []
+    for annotation in annotations:
+        cited = getattr(annotation, 'file_citation', None) or getattr(annotation, 'file_path', None)
+        if cited:
+            file_ids.append(cited.file_id)
+    names = _file_names(file_ids)
+
+    # Recolectar las citas basadas en los atributos de las anotaciones
+    citations = []
+    for index, annotation in enumerate(annotations):
+        if (file_citation := getattr(annotation, 'file_citation', None)):
+            # Solo mostrar el nombre del archivo ya que 'quote' no está disponible
+            filename = names.get(file_citation.file_id) or file_citation.file_id
+            citations.append(f'[{index + 1}] Referencia desde el archivo {filename}')
+        elif (file_path := getattr(annotation, 'file_path', None)):
+            filename = names.get(file_path.file_id) or file_path.file_id
+            citations.append(f'[{index + 1}] Click <here> to download {filename}')
+            # Nota: La funcionalidad de descarga no está implementada aquí por brevedad
+
+    # Agregar las citas al final del mensaje
+    return text + '\n' + '\n'.join(citations)
+
+def _hold_for_run(lock):
+    # Con varios workers el lock del hilo caduca a los SHARED_LOCK_TTL
+    # segundos; antes de cada ejecución se alarga hasta su límite de tiempo
+    # para que otro worker no lo tome mientras sigue en curso
+    shared_state.extend(lock, RUN_TIMEOUT_SECONDS + RUN_LOCK_MARGIN)
+
+def _abandon_thread(user_id, thread_id):
+    # La conversación se reinició con la ejecución en curso: si el hilo se
+    # creó después del reinicio lleva la pregunta sin respuesta, se descarta
+    if registry.get(user_id) == thread_id:
+        registry.clear(user_id)
+
+def get_chatbot_response(user_id, user_message: str, context=None,
+                         abandoned=None) -> str:
+    # Los envíos de un mismo usuario se serializan sobre su hilo; usuarios
+    # distintos se atienden en paralelo. Si abandoned() pasa a ser True (la
+    # conversación se reinició) la ejecución se cancela con RunCancelledError.
+    lock = registry.lock(user_id)
+    with lock:
+        # Añadir el mensaje del usuario al hilo
+        thread_id = _add_user_message(user_id, user_message, context)
+
+        # Crear una ejecución (run) del asistente
+        _hold_for_run(lock)
+        with timed('run_create'):
+            run = client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=get_assistant().id,
+                **_run_options(context, user_message)
+            )
+
+        # Esperar a que la ejecución se complete (con backoff y límite de tiempo)
+        try:
+            run = wait_for_run(client, thread_id, run, abandoned=abandoned)
+        except RunCancelledError:
+            _abandon_thread(user_id, thread_id)
+            raise
+        except RunError as e:
+            log_event("assistant_run_failed", level="error", user_id=user_id,
+                      status=e.status, error=str(e))
+            return ERROR_RESPONSE
+
+        # Obtener sólo el mensaje más reciente del asistente generado por este run
+        with timed('message_list'):
+            messages = client.beta.threads.messages.list(
+                thread_id=thread_id,
+                run_id=run.id,
+                order="desc",
+                limit=1
+            )
 
-    # Filtrar los mensajes para obtener los del asistente
     assistant_messages = [msg for msg in messages.data if msg.role == 'assistant']
 
-    # Ordenar los mensajes por tiempo de creación
-    assistant_messages.sort(key=lambda x: x.created_at)
+    if assistant_messages:
+        with timed('citations'):
+            return format_assistant_message(assistant_messages[0])
+    else:
+        return NO_RESPONSE
+
+def _stream_run(tracker, thread_id, user_message, on_delta, context=None):
+    # Crea la ejecución en modo streaming, reenvía cada delta de texto y
+    # devuelve los mensajes generados. Los estados de la ejecución que trae el
+    # stream (failed, expired, requires_action...) pasan por el tracker.
+    started = time.perf_counter()
+    first_token = True
+    try:
+        # Ninguna lectura espera más de lo que le queda a la ejecución
+        with client.beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=get_assistant().id,
+            timeout=tracker.remaining(),
+            **_run_options(context, user_message)
+        ) as stream:
+            for event in stream:
+                if getattr(event.data, 'object', None) == 'thread.run':
+                    tracker.update(event.data)
+                    continue
+                tracker.check_deadline()
+                if event.event != 'thread.message.delta':
+                    continue
+                for block in event.data.delta.content or []:
+                    if block.type == 'text' and block.text and block.text.value:
+                        if first_token:
+                            observe_stage('first_token',
+                                          time.perf_counter() - started)
+                            first_token = False
+                        on_delta(block.text.value)
+            if tracker.outcome is None:
+                tracker.fail(f"El stream terminó sin que terminara el run "
+                             f"{getattr(tracker.run, 'id', None)}")
+            try:
+                return stream.get_final_messages()
+            except RuntimeError:
+                # El run terminó sin mensajes
+                return []
+    except (APITimeoutError, httpx.TimeoutException):
+        tracker.timed_out()
 
+# Igual que get_chatbot_response, pero llama a on_delta(texto) con cada
+# fragmento generado. Las citas se resuelven al final sobre el mensaje completo.
+def stream_chatbot_response(user_id, user_message: str, on_delta,
+                            context=None, abandoned=None) -> str:
+    lock = registry.lock(user_id)
+    with lock:
+        thread_id = _add_user_message(user_id, user_message, context)
+
+        # Mismo límite de tiempo, estados terminales y métricas que la espera
+        # por sondeo
+        _hold_for_run(lock)
+        tracker = RunTracker(client, thread_id, stage='run_stream',
+                             abandoned=abandoned)
+        try:
+            final_messages = _stream_run(tracker, thread_id, user_message,
+                                         on_delta, context)
+        except RunCancelledError:
+            _abandon_thread(user_id, thread_id)
+            raise
+        except RunError as e:
+            log_event("assistant_run_failed", level="error", user_id=user_id,
+                      status=e.status, error=str(e))
+            return ERROR_RESPONSE
+
+    assistant_messages = [msg for msg in final_messages if msg.role == 'assistant']
     if assistant_messages:
-        last_assistant_message = assistant_messages[-1]  # Último mensaje del asistente
-        message_content = last_assistant_message.content[0].text
-
-        # Extraer anotaciones del mensaje
-        annotations = message_content.annotations
-        citations = []
-
-        # Iterar sobre las anotaciones y agregar las citas como footnotes
-        for index, annotation in enumerate(annotations):
-            # Reemplazar el texto con una referencia al pie de página
-            message_content.value = message_content.value.replace(annotation.text, f' [{index + 1}]')
-
-            # Recolectar las citas basadas en los atributos de las anotaciones
-            if (file_citation := getattr(annotation, 'file_citation', None)):
-                try:
-                    # Obtener el archivo usando 'file_id'
-                    cited_file = client.files.retrieve(file_citation.file_id)
-                    # Solo mostrar el nombre del archivo ya que 'quote' no está disponible
-                    citations.append(f'[{index + 1}] Referencia desde el archivo {cited_file.filename}')
-                except AttributeError as e:
-                    print(f"Error: {e}. Atributos de file_citation: {dir(file_citation)}")
-            elif (file_path := getattr(annotation, 'file_path', None)):
-                cited_file = client.files.retrieve(file_path.file_id)
-                citations.append(f'[{index + 1}] Click <here> to download {cited_file.filename}')
-                # Nota: La funcionalidad de descarga no está implementada aquí por brevedad
-
-        # Agregar las citas al final del mensaje
-        formatted_response = message_content.value + '\n' + '\n'.join(citations)
-        return formatted_response
+        with timed('citations'):
+            return format_assistant_message(assistant_messages[-1])
     else:
-        return "No se encontró respuesta del asistente."
+        return NO_RESPONSE
+
+def append_exchange(user_id, user_message, bot_response):
+    # Registrar en el hilo una pregunta respondida sin ejecutar el asistente
+    # (p. ej. desde la caché), para que las preguntas siguientes la vean
+    with registry.lock(user_id):
+        thread_id = registry.get(user_id)
+        if thread_id is None:
+            return
+        for role, content in (("user", user_message), ("assistant", bot_response)):
+            client.beta.threads.messages.create(
+                thread_id=thread_id,
+                role=role,
+                content=content
+            )
 
-def reset_conversation():
-    global thread
-    thread = None
-    initialize_conversation()
+def reset_conversation(user_id):
+    # El siguiente mensaje creará un hilo nuevo. No espera al lock del hilo:
+    # la ejecución en curso, si la hay, ve el reinicio y se cancela
+    registry.reset(user_id)
 
 # Añade esta función para obtener el vector_store_id
 def get_vector_store_id():
-    global vector_store
+    initialize_assistant()
     return vector_store.id
 
-def upload_pdf(file_url, vector_store_id):
-    try:
-        file_streams = []
-        pdf_path = f"static{file_url}"
-        print(pdf_path)
-        if os.path.exists(pdf_path):
-            file_streams.append(open(pdf_path, "rb"))
-        else:
-            print(f"Error: {file_url} no encontrado.")
+def _ingested_file_id(manifest, sha256):
+    # Busca el contenido entre las subidas y los PDFs cargados al arrancar
+    file_id = manifest.get("uploads", {}).get(sha256)
+    if file_id:
+        return file_id
+    for entry in manifest.get("files", {}).values():
+        if entry["sha256"] == sha256:
+            return entry["file_id"]
+    return None
 
-        if file_streams:
-            # Subir el archivo al vector store y esperar a que se procese
-            file = client.beta.vector_stores.files.create_and_poll(
-                vector_store_id=vector_store_id,
-                files=file_streams
-            )
-            print(f"Archivo subido exitosamente al vector store: {file.id}")
-        return True
+def ingest_pdf(pdf_path, vector_store_id, sha256=None, name=None):
+    # Devuelve el id remoto del archivo; cada contenido (sha256) se ingiere en
+    # el vector store una sola vez. Lanza una excepción si la ingesta falla.
+    # `name` es el nombre original con el que se cita y se indexa; el archivo
+    # en disco se llama por su hash.
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"{pdf_path} no encontrado.")
+    name = name or os.path.basename(pdf_path)
+
+    sha256 = sha256 or file_sha256(pdf_path)
+    file_id = _ingested_file_id(load_manifest(), sha256)
+    if file_id:
+        log_event("pdf_already_ingested", file_id=file_id, name=name)
+        return file_id
+
+    # Subir el archivo al vector store y esperar a que se procese
+    with open(pdf_path, "rb") as f:
+        file = client.beta.vector_stores.files.upload_and_poll(
+            vector_store_id=vector_store_id,
+            file=(name, f)
+        )
+    if file.status != "completed":
+        raise RuntimeError(f"El vector store no pudo procesar el archivo {file.id}: "
+                           f"{getattr(file, 'last_error', None)}")
+    log_event("pdf_ingested", file_id=file.id, name=name)
+    file_names.set(file.id, name)
+
+    # Mantener el índice local al día; un fallo aquí no invalida la ingesta
+    try:
+        lexical_index.add_pdf(pdf_path, name=name, sha256=sha256,
+                              replace=False)
     except Exception as e:
-        print(f"Error al subir el archivo: {str(e)}")
-        return False
+        log_event("lexical_index_failed", level="error", path=pdf_path,
+                  error=str(e))
 
-# Initialize the assistant when the module is imported
-initialize_assistant()
\ No newline at end of file
+    with manifest_lock():
+        manifest = load_manifest()
+        manifest.setdefault("uploads", {})[sha256] = file.id
+        save_manifest(manifest)
+    return file.id
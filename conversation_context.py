@@ -0,0 +1,187 @@
+import os
+import re
+from collections import OrderedDict, deque
+from threading import Lock
+
+from message_store import load_bodies, texts
+from models import db, ChatMessage, ConversationSummary
+from shared_state import shared_state
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken es opcional
+    _encoding = None
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 3000))
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("SUMMARY_TOKEN_BUDGET", 600))
+CONTEXT_CACHE_SIZE = int(os.environ.get("CONTEXT_CACHE_SIZE", 1024))
+SUMMARY_LINE_CHARS = 200
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # Aproximación: ~4 caracteres por token
+    return len(text) // 4 + 1
+
+
+def _summarize_turn(role, content):
+    # Resumen extractivo: la primera oración del mensaje, recortada
+    text = " ".join((content or "").split())
+    sentence = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+    if len(sentence) > SUMMARY_LINE_CHARS:
+        sentence = sentence[:SUMMARY_LINE_CHARS].rstrip() + "…"
+    speaker = "Usuario" if role == "user" else "Asistente"
+    return f"{speaker}: {sentence}"
+
+
+class _Context:
+    __slots__ = ("summary", "summarized_id", "last_seen_id", "turns", "tokens",
+                 "version")
+
+    def __init__(self, summary="", summarized_id=0):
+        self.summary = summary
+        self.summarized_id = summarized_id
+        self.last_seen_id = summarized_id
+        # (message_id, role, content, tokens), del más antiguo al más reciente
+        self.turns = deque()
+        self.tokens = 0
+        # Versión del estado compartido con la que se cargó
+        self.version = None
+
+
+class ContextManager:
+    # Mantiene por usuario una ventana de los turnos más recientes dentro de
+    # un presupuesto de tokens; los turnos más antiguos se pliegan en un
+    # resumen que se guarda en ConversationSummary y se actualiza de forma
+    # incremental a medida que llegan turnos nuevos. Con varios workers la
+    # ventana en memoria se recarga de la base de datos cuando otro worker
+    # guardó turnos del mismo usuario.
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET,
+                 summary_budget=SUMMARY_TOKEN_BUDGET,
+                 max_size=CONTEXT_CACHE_SIZE):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.max_size = max_size
+        self._contexts = OrderedDict()
+        self._lock = Lock()
+
+    def _get(self, user_id):
+        version = shared_state.version(f"context:{user_id}")
+        with self._lock:
+            ctx = self._contexts.get(user_id)
+            if ctx is not None and version is not None and \
+                    ctx.version == version:
+                self._contexts.move_to_end(user_id)
+                return ctx
+
+        ctx = self._load(user_id)
+        ctx.version = version
+        with self._lock:
+            self._contexts[user_id] = ctx
+            while len(self._contexts) > self.max_size:
+                self._contexts.popitem(last=False)
+        return ctx
+
+    def _load(self, user_id):
+        # Sólo se leen los mensajes que todavía no están en el resumen
+        row = db.session.get(ConversationSummary, user_id)
+        ctx = _Context(row.content or "", row.last_message_id or 0) if row \
+            else _Context()
+        # Tras un reinicio el resumen arranca en la marca de borrado, así
+        # que los mensajes ocultos no se leen. Los turnos que ya pasaron al
+        # archivo sin resumirse se dan por vencidos.
+        messages = ChatMessage.query.with_entities(
+            ChatMessage.id, ChatMessage.is_user, ChatMessage.content,
+            ChatMessage.content_html, ChatMessage.body_id).filter(
+                ChatMessage.user_id == user_id,
+                ChatMessage.id > ctx.summarized_id).order_by(ChatMessage.id).all()
+        bodies = load_bodies(messages)
+        for msg in messages:
+            self._append(ctx, msg.id, 'user' if msg.is_user else 'assistant',
+                         texts(msg, bodies)[0])
+        self._compact(user_id, ctx)
+        return ctx
+
+    def _append(self, ctx, message_id, role, content):
+        if message_id <= ctx.last_seen_id:
+            return
+        tokens = estimate_tokens(content)
+        ctx.turns.append((message_id, role, content, tokens))
+        ctx.tokens += tokens
+        ctx.last_seen_id = message_id
+
+    def _compact(self, user_id, ctx):
+        folded = []
+        while ctx.tokens > self.token_budget and len(ctx.turns) > 1:
+            message_id, role, content, tokens = ctx.turns.popleft()
+            ctx.tokens -= tokens
+            ctx.summarized_id = message_id
+            if content:
+                folded.append(_summarize_turn(role, content))
+        if not folded:
+            return
+
+        # Resumen rodante: se añaden las líneas nuevas y se descartan las más
+        # antiguas hasta quedar dentro del presupuesto del resumen
+        lines = ctx.summary.splitlines() + folded
+        while len(lines) > 1 and \
+                estimate_tokens("\n".join(lines)) > self.summary_budget:
+            lines.pop(0)
+        ctx.summary = "\n".join(lines)
+
+        row = db.session.get(ConversationSummary, user_id)
+        if row is None:
+            row = ConversationSummary(user_id=user_id)
+            db.session.add(row)
+        row.content = ctx.summary
+        row.last_message_id = ctx.summarized_id
+        db.session.commit()
+
+    def snapshot(self, user_id, before_id=None):
+        # Resumen y ventana de mensajes previos a before_id
+        ctx = self._get(user_id)
+        messages = [{
+            'role': role,
+            'content': content
+        } for message_id, role, content, tokens in ctx.turns
+          if content and (before_id is None or message_id < before_id)]
+        return {'summary': ctx.summary, 'messages': messages}
+
+    def record(self, user_id, messages):
+        # Añade mensajes ya guardados (ChatMessage) y compacta si hace falta
+        ctx = self._get(user_id)
+        bodies = load_bodies(messages)
+        for msg in messages:
+            self._append(ctx, msg.id, 'user' if msg.is_user else 'assistant',
+                         texts(msg, bodies)[0])
+        self._compact(user_id, ctx)
+        version = shared_state.bump(f"context:{user_id}")
+        # Si otro worker también guardó turnos la ventana está incompleta y
+        # se recarga en el próximo acceso
+        if shared_state.enabled and (ctx.version is None or version is None
+                                     or version != ctx.version + 1):
+            ctx.version = None
+        else:
+            ctx.version = version
+
+    def clear(self, user_id, cleared_id=0):
+        # cleared_id: marca de reinicio (message_store); el contexto vuelve a
+        # empezar después de ella aunque los mensajes aún no se hayan borrado
+        with self._lock:
+            self._contexts.pop(user_id, None)
+        row = db.session.get(ConversationSummary, user_id)
+        if row is None:
+            row = ConversationSummary(user_id=user_id)
+            db.session.add(row)
+        row.content = ''
+        row.last_message_id = cleared_id
+        db.session.commit()
+        shared_state.bump(f"context:{user_id}")
+
+
+contexts = ContextManager()
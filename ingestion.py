@@ -0,0 +1,178 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Gauge, ingestion_jobs_total, ingestion_seconds
+from models import db, IngestionJob
+from chatbot import ingest_pdf, get_vector_store_id
+from shared_state import shared_state
+from structured_log import log_event
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 2))
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 100))
+INGEST_MAX_ATTEMPTS = int(os.environ.get("INGEST_MAX_ATTEMPTS", 3))
+INGEST_RETRY_DELAY = float(os.environ.get("INGEST_RETRY_DELAY", 5))
+# Con varios workers sólo el primero que arranca en este intervalo reanuda
+INGEST_RESUME_INTERVAL = float(os.environ.get("INGEST_RESUME_INTERVAL", 60))
+
+PENDING_STATES = ("queued", "processing")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def job_to_dict(job):
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'attempts': job.attempts,
+        'error': job.error,
+        'file_url': job.file_url,
+        'filename': job.filename,
+        'file_id': job.file_id,
+    }
+
+
+class IngestionQueue:
+    # Cola de ingesta de PDFs al vector store. Los trabajos se guardan en
+    # IngestionJob para sobrevivir a reinicios y se procesan en un pool
+    # acotado de workers; cada cambio de estado se notifica con notify(job).
+
+    def __init__(self, max_workers=INGEST_WORKERS, max_pending=INGEST_QUEUE_SIZE):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.app = None
+        self.notify = None
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app, notify=None):
+        self.app = app
+        self.notify = notify
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix="ingestion")
+
+    def submit(self, user_id, file_path, file_url, sha256, filename=None):
+        # filename: nombre original del archivo, el que ven las citas y las
+        # búsquedas
+        job = IngestionJob(id=uuid.uuid4().hex,
+                           user_id=user_id,
+                           file_path=file_path,
+                           file_url=file_url,
+                           filename=filename,
+                           sha256=sha256,
+                           status='queued',
+                           attempts=0)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError("Ingestion queue is full")
+            self._pending += 1
+        try:
+            db.session.add(job)
+            db.session.commit()
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        self._executor.submit(self._process, job.id)
+        return job
+
+    def resume(self):
+        # Reencolar los trabajos que quedaron pendientes antes de un reinicio.
+        # La ingesta es idempotente por hash, así que un trabajo que otro
+        # worker vivo estaba procesando como mucho se repite.
+        if not shared_state.claim("ingestion_resume", INGEST_RESUME_INTERVAL):
+            return
+        with self.app.app_context():
+            jobs = IngestionJob.query.filter(
+                IngestionJob.status.in_(PENDING_STATES)).all()
+            for job in jobs:
+                job.status = 'queued'
+            db.session.commit()
+            job_ids = [job.id for job in jobs]
+
+        for job_id in job_ids:
+            with self._lock:
+                self._pending += 1
+            self._executor.submit(self._process, job_id)
+        if job_ids:
+            log_event("ingestion_resumed", sample_rate=1, jobs=len(job_ids))
+
+    def _retry_later(self, job_id, delay):
+        timer = threading.Timer(delay, self._executor.submit,
+                                args=(self._process, job_id))
+        timer.daemon = True
+        timer.start()
+
+    def _process(self, job_id):
+        retry = False
+        attempts = 0
+        with self.app.app_context():
+            try:
+                # Se reclama con un UPDATE condicional para que dos workers
+                # nunca procesen el mismo trabajo a la vez
+                claimed = IngestionJob.query.filter(
+                    IngestionJob.id == job_id,
+                    IngestionJob.status == 'queued').update(
+                        {'status': 'processing',
+                         'attempts': IngestionJob.attempts + 1},
+                        synchronize_session=False)
+                db.session.commit()
+                if not claimed:
+                    return
+                job = db.session.get(IngestionJob, job_id)
+                attempts = job.attempts
+                self._notify(job)
+
+                try:
+                    with ingestion_seconds.time():
+                        job.file_id = ingest_pdf(job.file_path,
+                                                 get_vector_store_id(),
+                                                 sha256=job.sha256,
+                                                 name=job.filename)
+                    job.status = 'completed'
+                    job.error = None
+                except Exception as e:
+                    log_event("ingestion_failed", level="error",
+                              job_id=job.id, attempt=job.attempts,
+                              error=str(e))
+                    job.error = str(e)[:500]
+                    if job.attempts < INGEST_MAX_ATTEMPTS:
+                        job.status = 'queued'
+                        retry = True
+                    else:
+                        job.status = 'failed'
+                ingestion_jobs_total.inc(
+                    status='retried' if retry else job.status)
+                db.session.commit()
+                self._notify(job)
+            finally:
+                db.session.remove()
+                if not retry:
+                    with self._lock:
+                        self._pending -= 1
+
+        if retry:
+            # Backoff lineal entre intentos
+            self._retry_later(job_id, INGEST_RETRY_DELAY * attempts)
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def _notify(self, job):
+        if self.notify is not None:
+            try:
+                self.notify(job)
+            except Exception as e:
+                log_event("ingestion_notify_failed", level="warning",
+                          job_id=job.id, error=str(e))
+
+
+ingestion_queue = IngestionQueue()
+
+Gauge("ingestion_queue_pending", "Trabajos de ingesta en cola o en proceso",
+      ingestion_queue.pending)
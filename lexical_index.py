@@ -0,0 +1,318 @@
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import Counter
+from threading import Lock
+
+from assistant_manifest import file_sha256
+from offload import run_blocking
+from shared_state import shared_state
+from structured_log import log_event
+
+try:
+    import numpy as np
+except ImportError:  # numpy es opcional: sin él no hay índice local
+    np = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf es opcional: sin él no se extrae texto
+    PdfReader = None
+
+LEXICAL_INDEX_PATH = os.environ.get("LEXICAL_INDEX_PATH", "lexical_index.npz")
+# Tamaño de los pasajes en palabras; los pasajes se solapan a la mitad para
+# no cortar una idea entre dos de ellos
+PASSAGE_WORDS = int(os.environ.get("LEXICAL_PASSAGE_WORDS", 120))
+BM25_K1 = float(os.environ.get("BM25_K1", 1.2))
+BM25_B = float(os.environ.get("BM25_B", 0.75))
+SNIPPET_CHARS = 300
+
+_STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun cada
+como con contra cual cuales cuando de del desde donde dos el ella ellas ello
+ellos en entre era eran es esa esas ese eso esos esta estan estar estas este
+esto estos fue fueron ha han hasta hay la las le les lo los mas me mi mis muy
+ni no nos o otra otras otro otros para pero poco por porque que quien quienes
+se sea ser si sin sobre son su sus tambien te tiene tienen todo todos tu tus
+un una unas uno unos y ya
+""".split())
+
+
+def tokenize(text):
+    # Minúsculas, sin acentos y sin palabras vacías
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in re.findall(r"\w+", text)
+            if t not in _STOPWORDS and len(t) > 1]
+
+
+def extract_pages(pdf_path):
+    reader = PdfReader(pdf_path)
+    for number, page in enumerate(reader.pages, start=1):
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            log_event("pdf_page_extract_failed", level="warning",
+                      path=pdf_path, page=number, error=str(e))
+            continue
+        if text.strip():
+            yield number, text
+
+
+def _pdf_passages(pdf_path, name):
+    return [(name, page, passage)
+            for page, text in extract_pages(pdf_path)
+            for passage in _passages(text)]
+
+
+def _passages(text):
+    words = text.split()
+    step = max(PASSAGE_WORDS // 2, 1)
+    for start in range(0, max(len(words) - step, 1), step):
+        yield " ".join(words[start:start + PASSAGE_WORDS])
+
+
+class LexicalIndex:
+    # Índice invertido BM25 sobre los pasajes de los PDF del curso. Las
+    # listas de postings se guardan en formato CSR con arrays de NumPy:
+    # offsets[t]:offsets[t + 1] delimita en doc_ids/tfs las apariciones del
+    # término t. Los archivos nuevos se acumulan en memoria y se fusionan en
+    # los arrays en una sola pasada; los pasajes de un archivo reemplazado
+    # se marcan como borrados y desaparecen de los postings en esa fusión.
+
+    def __init__(self, path=LEXICAL_INDEX_PATH, k1=BM25_K1, b=BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = Lock()
+        self._reset()
+
+    def _reset(self):
+        self._vocab = {}
+        self._passages = []
+        # sha256 -> {'name', 'start', 'end'} (rango de pasajes del archivo)
+        self._files = {}
+        self._offsets = np.zeros(1, dtype=np.int64) if np else None
+        self._doc_ids = np.empty(0, dtype=np.int32) if np else None
+        self._tfs = np.empty(0, dtype=np.float32) if np else None
+        self._doc_lengths = np.empty(0, dtype=np.float32) if np else None
+        self._alive = np.empty(0, dtype=bool) if np else None
+        self._pending = []
+        self._loaded = False
+        self._loaded_mtime = None
+
+    @property
+    def available(self):
+        return np is not None and PdfReader is not None
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _ensure_loaded(self):
+        # Con varios workers otro proceso pudo guardar una versión más nueva
+        # del archivo: se vuelve a cargar si cambió desde la última lectura
+        mtime = self._mtime()
+        if self._loaded:
+            if mtime == self._loaded_mtime:
+                return
+            self._reset()
+        self._loaded = True
+        self._loaded_mtime = mtime
+        if mtime is None:
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                meta = json.loads(str(data["meta"]))
+                self._offsets = data["offsets"]
+                self._doc_ids = data["doc_ids"]
+                self._tfs = data["tfs"]
+                self._doc_lengths = data["doc_lengths"]
+                self._alive = data["alive"]
+            self._vocab = {term: i for i, term in enumerate(meta["vocab"])}
+            self._passages = [tuple(p) for p in meta["passages"]]
+            self._files = meta["files"]
+        except Exception as e:
+            # Se reconstruye
+            log_event("lexical_index_invalid", level="warning", path=self.path,
+                      error=str(e))
+            self._reset()
+            self._loaded = True
+            self._loaded_mtime = mtime
+
+    def _save(self):
+        meta = {
+            "vocab": sorted(self._vocab, key=self._vocab.get),
+            "passages": self._passages,
+            "files": self._files,
+        }
+        # Escritura atómica, igual que el manifiesto
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez_compressed(tmp_path,
+                            meta=np.array(json.dumps(meta)),
+                            offsets=self._offsets,
+                            doc_ids=self._doc_ids,
+                            tfs=self._tfs,
+                            doc_lengths=self._doc_lengths,
+                            alive=self._alive)
+        os.replace(tmp_path, self.path)
+        self._loaded_mtime = self._mtime()
+
+    def add_pdf(self, pdf_path, name=None, sha256=None, replace=True):
+        # Devuelve el número de pasajes indexados (0 si ya estaba indexado).
+        # `name` es el que se muestra en los resultados; con replace=False un
+        # archivo con ese nombre ya indexado no se retira (dos subidas
+        # distintas pueden llamarse igual).
+        if not self.available:
+            return 0
+        sha256 = sha256 or file_sha256(pdf_path)
+        name = name or os.path.basename(pdf_path)
+        with self._lock:
+            self._ensure_loaded()
+            if sha256 in self._files:
+                return 0
+
+        # La extracción de texto es lo lento; se hace fuera del candado y,
+        # con eventlet, fuera del hub
+        started = time.monotonic()
+        passages = run_blocking(_pdf_passages, pdf_path, name)
+
+        # Entre workers la fusión y el guardado se serializan y parten siempre
+        # de la última versión guardada, para no perder lo que indexó otro
+        with shared_state.lock("lexical_index", local=self._lock):
+            self._ensure_loaded()
+            if sha256 in self._files:
+                return 0
+            # Un archivo con el mismo nombre y otro contenido lo reemplaza
+            for old_sha, entry in list(self._files.items()):
+                if replace and entry["name"] == name:
+                    self._alive[entry["start"]:entry["end"]] = False
+                    del self._files[old_sha]
+
+            start = len(self._passages)
+            lengths = []
+            for doc_id, passage in enumerate(passages, start=start):
+                counts = Counter(tokenize(passage[2]))
+                for term, tf in counts.items():
+                    term_id = self._vocab.setdefault(term, len(self._vocab))
+                    self._pending.append((term_id, doc_id, tf))
+                lengths.append(sum(counts.values()))
+                self._passages.append(passage)
+            self._files[sha256] = {"name": name, "start": start,
+                                   "end": len(self._passages)}
+            self._doc_lengths = np.concatenate(
+                [self._doc_lengths, np.asarray(lengths, dtype=np.float32)])
+            self._alive = np.concatenate(
+                [self._alive, np.ones(len(lengths), dtype=bool)])
+            self._merge()
+            self._save()
+
+        log_event("lexical_index_added", sample_rate=1, name=name,
+                  passages=len(passages),
+                  seconds=round(time.monotonic() - started, 2))
+        return len(passages)
+
+    def add_pdfs(self, pdf_paths, names=None):
+        # names: ruta -> nombre original de las subidas, que no se reemplazan
+        # entre sí por nombre
+        names = names or {}
+        total = 0
+        for pdf_path in pdf_paths:
+            if not os.path.exists(pdf_path):
+                continue
+            try:
+                if pdf_path in names:
+                    total += self.add_pdf(pdf_path, name=names[pdf_path],
+                                          replace=False)
+                else:
+                    total += self.add_pdf(pdf_path)
+            except Exception as e:
+                log_event("lexical_index_failed", level="error", path=pdf_path,
+                          error=str(e))
+        return total
+
+    def _merge(self):
+        # Fusiona los postings pendientes con los existentes y descarta los
+        # de pasajes borrados; el orden (término, pasaje) se mantiene
+        terms = np.repeat(np.arange(len(self._offsets) - 1, dtype=np.int32),
+                          np.diff(self._offsets))
+        doc_ids = self._doc_ids
+        tfs = self._tfs
+        if self._pending:
+            pending = np.asarray(self._pending, dtype=np.int64)
+            terms = np.concatenate([terms, pending[:, 0].astype(np.int32)])
+            doc_ids = np.concatenate([doc_ids, pending[:, 1].astype(np.int32)])
+            tfs = np.concatenate([tfs, pending[:, 2].astype(np.float32)])
+            self._pending = []
+
+        keep = self._alive[doc_ids]
+        terms, doc_ids, tfs = terms[keep], doc_ids[keep], tfs[keep]
+        order = np.lexsort((doc_ids, terms))
+        self._doc_ids = doc_ids[order]
+        self._tfs = tfs[order]
+        counts = np.bincount(terms, minlength=len(self._vocab))
+        self._offsets = np.concatenate(
+            [np.zeros(1, dtype=np.int64), np.cumsum(counts, dtype=np.int64)])
+
+    def search(self, query, k=5):
+        # Devuelve los k pasajes con mayor puntuación BM25, con su cita
+        if not self.available:
+            return []
+        with self._lock:
+            self._ensure_loaded()
+            alive = int(self._alive.sum())
+            term_ids = {self._vocab[t] for t in tokenize(query) if t in self._vocab}
+            if not alive or not term_ids:
+                return []
+
+            lengths = self._doc_lengths
+            avg_length = float(lengths[self._alive].mean()) or 1.0
+            norm = self.k1 * (1 - self.b + self.b * lengths / avg_length)
+            scores = np.zeros(len(self._passages), dtype=np.float32)
+            for term_id in term_ids:
+                start, end = self._offsets[term_id], self._offsets[term_id + 1]
+                if start == end:
+                    continue
+                docs = self._doc_ids[start:end]
+                tfs = self._tfs[start:end]
+                df = end - start
+                idf = np.log(1 + (alive - df + 0.5) / (df + 0.5))
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+            k = min(k, int(np.count_nonzero(scores)))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [{
+                'file': self._passages[i][0],
+                'page': self._passages[i][1],
+                'text': self._passages[i][2][:SNIPPET_CHARS],
+                'score': round(float(scores[i]), 4),
+            } for i in top]
+
+    def stats(self):
+        if not self.available:
+            return {'available': False}
+        with self._lock:
+            self._ensure_loaded()
+            return {
+                'available': True,
+                'files': len(self._files),
+                'passages': int(self._alive.sum()),
+                'terms': len(self._vocab),
+                'postings': int(len(self._doc_ids)),
+            }
+
+
+def format_passages(passages):
+    # Texto para instrucciones o respuestas: cada pasaje con su cita
+    return "\n\n".join(
+        f"[{p['file']}, pág. {p['page']}] {p['text']}" for p in passages)
+
+
+lexical_index = LexicalIndex()
@@ -0,0 +1,228 @@
+import re
+
+from markupsafe import escape
+
+# Los mensajes se convierten de markdown a HTML una sola vez, al guardarlos,
+# y el HTML se guarda junto al texto (ChatMessage.content_html): /history lo
+# devuelve tal cual y el cliente no convierte nada al cargar el historial.
+#
+# El HTML es seguro por construcción: todo el texto se escapa antes de darle
+# formato y sólo se generan las etiquetas de este módulo; los enlaces sólo
+# admiten http(s), mailto y rutas del propio sitio. Cubre el markdown que
+# producen las respuestas (párrafos, títulos, listas, citas, código, negrita,
+# cursiva y enlaces) y convierte las referencias [n] de las citas en notas al
+# pie. Los mensajes anteriores se completan con
+# persistence.backfill_rendered_html.
+
+SAFE_URL_SCHEMES = ("http:", "https:", "mailto:")
+
+_FENCE = re.compile(r"^\s{0,3}(```|~~~)\s*([\w+-]*)\s*$")
+_HEADING = re.compile(r"^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$")
+_RULE = re.compile(r"^\s{0,3}([-*_])(\s*\1){2,}\s*$")
+_LIST_ITEM = re.compile(r"^(\s*)([-*+]|(\d{1,9})[.)])\s+(.*)$")
+_QUOTE = re.compile(r"^\s{0,3}>\s?(.*)$")
+# Líneas finales de citas tal como las arma format_assistant_message
+_CITATION_LINE = re.compile(r"^\[(\d+)\]\s+(.+)$")
+
+_CODE_SPAN = re.compile(r"(`+)(.+?)\1", re.S)
+_LINK = re.compile(r"\[([^\]\n]+)\]\(\s*([^()\s]+)\s*\)")
+_STRONG = re.compile(r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1", re.S)
+_EM_STAR = re.compile(r"(?<![\w*])\*(?=[^\s*])(.+?)(?<=[^\s*])\*(?![\w*])", re.S)
+_EM_UNDERSCORE = re.compile(r"(?<![\w_])_(?=[^\s_])(.+?)(?<=[^\s_])_(?![\w_])", re.S)
+_CITATION_REF = re.compile(r" ?\[(\d+)\]")
+_PLACEHOLDER = re.compile("\x00(\\d+)\x00")
+
+
+def _safe_url(url):
+    # Sin caracteres de control ni espacios que el navegador ignoraría al
+    # leer el esquema (p. ej. "java\tscript:")
+    compact = re.sub(r"[\x00-\x20\x7f]", "", url).lower()
+    if compact.startswith("/") and not compact.startswith(("//", "/\\")):
+        return True
+    if compact.startswith(("#", "?")):
+        return True
+    return compact.startswith(SAFE_URL_SCHEMES)
+
+
+class _Inline:
+    # Formato en línea. Lo ya convertido a HTML se aparta en marcadores
+    # \x00n\x00 para que los pasos siguientes no lo toquen.
+
+    def __init__(self, citations):
+        self.citations = citations
+        self.kept = []
+
+    def _keep(self, html):
+        self.kept.append(html)
+        return f"\x00{len(self.kept) - 1}\x00"
+
+    def _code(self, match):
+        return self._keep(f"<code>{escape(match.group(2).strip())}</code>")
+
+    def _link(self, match):
+        label, url = match.group(1), match.group(2)
+        if "\x00" in url:
+            # La URL contiene código ya apartado: no es un enlace
+            return match.group(0)
+        if not _safe_url(url):
+            return label
+        return (self._keep(f'<a href="{escape(url)}" target="_blank" '
+                           f'rel="noopener noreferrer">')
+                + label + self._keep("</a>"))
+
+    def _citation(self, match):
+        number = int(match.group(1))
+        if number not in self.citations:
+            return match.group(0)
+        return self._keep(f'<sup class="citation" '
+                          f'title="{escape(self.citations[number])}">'
+                          f'[{number}]</sup>')
+
+    def render(self, text):
+        text = text.replace("\x00", "")
+        text = _CODE_SPAN.sub(self._code, text)
+        text = _LINK.sub(self._link, text)
+        if self.citations:
+            text = _CITATION_REF.sub(self._citation, text)
+        text = str(escape(text))
+        text = _STRONG.sub(r"<strong>\2</strong>", text)
+        text = _EM_STAR.sub(r"<em>\1</em>", text)
+        text = _EM_UNDERSCORE.sub(r"<em>\1</em>", text)
+        # Dos espacios al final de una línea fuerzan un salto, como en markdown
+        text = re.sub(r" {2,}\n", "<br />\n", text)
+        return _PLACEHOLDER.sub(lambda m: self.kept[int(m.group(1))], text)
+
+
+def _split_citations(lines):
+    # Separa el bloque final de líneas "[n] ..." del cuerpo del mensaje
+    end = len(lines)
+    while end and not lines[end - 1].strip():
+        end -= 1
+    start = end
+    while start and _CITATION_LINE.match(lines[start - 1].strip()):
+        start -= 1
+    if start == end:
+        return lines, {}
+    citations = {}
+    for line in lines[start:end]:
+        match = _CITATION_LINE.match(line.strip())
+        citations.setdefault(int(match.group(1)), match.group(2))
+    return lines[:start], citations
+
+
+def _render_list(items, inline):
+    # items: (sangría, etiqueta, inicio, texto); la sangría decide el anidado
+    html = []
+    stack = []
+    for indent, tag, start, text in items:
+        while stack and (indent < stack[-1][0] or
+                         (indent == stack[-1][0] and tag != stack[-1][1])):
+            html.append(f"</li></{stack.pop()[1]}>")
+        if stack and indent == stack[-1][0]:
+            html.append("</li><li>")
+        else:
+            attributes = f' start="{start}"' if tag == "ol" and start != 1 else ""
+            html.append(f"<{tag}{attributes}><li>")
+            stack.append((indent, tag))
+        html.append(inline.render(text))
+    while stack:
+        html.append(f"</li></{stack.pop()[1]}>")
+    return "".join(html)
+
+
+def _is_block_start(line):
+    return bool(_FENCE.match(line) or _HEADING.match(line) or
+                _RULE.match(line) or _LIST_ITEM.match(line) or
+                _QUOTE.match(line))
+
+
+def _render_blocks(lines, inline):
+    html = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.strip():
+            i += 1
+            continue
+
+        fence = _FENCE.match(line)
+        if fence:
+            code = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith(fence.group(1)):
+                code.append(lines[i])
+                i += 1
+            i += 1
+            language = fence.group(2)
+            attributes = f' class="language-{escape(language)}"' if language else ""
+            html.append(f"<pre><code{attributes}>"
+                        f"{escape(chr(10).join(code))}</code></pre>")
+            continue
+
+        heading = _HEADING.match(line)
+        if heading:
+            level = len(heading.group(1))
+            html.append(f"<h{level}>{inline.render(heading.group(2))}</h{level}>")
+            i += 1
+            continue
+
+        if _RULE.match(line):
+            html.append("<hr />")
+            i += 1
+            continue
+
+        if _QUOTE.match(line):
+            quoted = []
+            while i < len(lines) and _QUOTE.match(lines[i]):
+                quoted.append(_QUOTE.match(lines[i]).group(1))
+                i += 1
+            html.append(f"<blockquote>{_render_blocks(quoted, inline)}</blockquote>")
+            continue
+
+        if _LIST_ITEM.match(line):
+            items = []
+            while i < len(lines):
+                item = _LIST_ITEM.match(lines[i])
+                if item:
+                    indent = len(item.group(1).expandtabs(4))
+                    tag = "ol" if item.group(3) else "ul"
+                    start = int(item.group(3)) if item.group(3) else 1
+                    items.append((indent, tag, start, item.group(4)))
+                elif lines[i].strip() and not _is_block_start(lines[i]) and \
+                        (lines[i][:1].isspace() or
+                         (i and lines[i - 1].strip())):
+                    # Continuación del elemento anterior
+                    indent, tag, start, text = items[-1]
+                    items[-1] = (indent, tag, start, f"{text}\n{lines[i].strip()}")
+                elif not lines[i].strip() and i + 1 < len(lines) and \
+                        _LIST_ITEM.match(lines[i + 1]):
+                    pass
+                else:
+                    break
+                i += 1
+            html.append(_render_list(items, inline))
+            continue
+
+        paragraph = []
+        while i < len(lines) and lines[i].strip() and \
+                (not paragraph or not _is_block_start(lines[i])):
+            paragraph.append(lines[i].lstrip())
+            i += 1
+        html.append(f"<p>{inline.render(chr(10).join(paragraph))}</p>")
+    return "\n".join(html)
+
+
+def render_message(content):
+    # Markdown del mensaje -> HTML saneado, con las citas como notas al pie
+    if not content:
+        return ""
+    lines = content.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    lines, citations = _split_citations(lines)
+    inline = _Inline(citations)
+    html = _render_blocks(lines, inline)
+    if citations:
+        notes = "".join(f'<li value="{number}">{escape(text)}</li>'
+                        for number, text in sorted(citations.items()))
+        html += f'\n<ol class="citations">{notes}</ol>'
+    return html
+
@@ -0,0 +1,324 @@
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, text
+
+from message_render import render_message
+from models import db, ChatMessage, ChatMessageArchive, MessageBody, User
+from shared_state import shared_state
+from structured_log import log_event
+
+try:
+    import zstandard
+except ImportError:  # zstandard es opcional: sin él se comprime con zlib
+    zstandard = None
+
+# Almacenamiento del historial en dos niveles:
+# - chat_message (caliente) guarda los mensajes recientes. Los cortos van en
+#   línea; en los largos texto y HTML se comprimen y se guardan aparte, en
+#   message_body, y la fila sólo lleva body_id.
+# - chat_message_archive recibe, con sus ids, los mensajes más antiguos que
+#   MESSAGE_HOT_DAYS; /history los lee al paginar más allá de la tabla
+#   caliente. Con MESSAGE_ARCHIVE_DAYS se borran también del archivo.
+# Reiniciar la conversación sólo mueve la marca User.history_cleared_id al
+# último id existente: lo anterior deja de verse al instante y se borra de
+# ambas tablas en segundo plano, por lotes.
+MESSAGE_INLINE_LIMIT = min(int(os.environ.get("MESSAGE_INLINE_LIMIT", 500)), 500)
+MESSAGE_INLINE_HTML_LIMIT = int(os.environ.get("MESSAGE_INLINE_HTML_LIMIT", 2000))
+MESSAGE_CODEC = os.environ.get("MESSAGE_CODEC",
+                               "zstd" if zstandard is not None else "zlib")
+MESSAGE_HOT_DAYS = float(os.environ.get("MESSAGE_HOT_DAYS", 30))
+# 0 conserva el archivo para siempre
+MESSAGE_ARCHIVE_DAYS = float(os.environ.get("MESSAGE_ARCHIVE_DAYS", 0))
+MESSAGE_MAINTENANCE_INTERVAL = float(os.environ.get("MESSAGE_MAINTENANCE_INTERVAL", 300))
+MESSAGE_MAINTENANCE_BATCH = int(os.environ.get("MESSAGE_MAINTENANCE_BATCH", 1000))
+# Pausa entre lotes para no acaparar la base de datos
+MESSAGE_MAINTENANCE_PAUSE = float(os.environ.get("MESSAGE_MAINTENANCE_PAUSE", 0.05))
+# stats() cuenta como mucho estos usuarios pendientes de purga
+STATS_PENDING_LIMIT = 1000
+
+if MESSAGE_CODEC == "zstd" and zstandard is None:
+    log_event("message_codec_unavailable", level="warning", codec="zstd",
+              fallback="zlib")
+    MESSAGE_CODEC = "zlib"
+
+# Columnas que se copian tal cual de la tabla caliente al archivo
+ARCHIVED_COLUMNS = ("id", "content", "content_html", "body_id", "timestamp",
+                    "is_user", "user_id", "feedback", "there_is_feedback")
+
+
+def compress(text, codec=MESSAGE_CODEC):
+    data = text.encode("utf-8")
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def decompress(data, codec):
+    if data is None:
+        return None
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Message body compressed with zstd but the "
+                               "zstandard package is not installed")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = zlib.decompress(data)
+    return data.decode("utf-8")
+
+
+def _split(content):
+    # (content, content_html, MessageBody o None) para una fila nueva
+    content = content or ""
+    html = render_message(content)
+    if len(content) <= MESSAGE_INLINE_LIMIT and \
+            len(html) <= MESSAGE_INLINE_HTML_LIMIT:
+        return content, html, None
+    body = MessageBody(codec=MESSAGE_CODEC, content=compress(content),
+                       content_html=compress(html))
+    return None, None, body
+
+
+def new_message(user_id, content, is_user, timestamp=None):
+    # ChatMessage listo para db.session.add; el cuerpo se inserta con él
+    content, html, body = _split(content)
+    return ChatMessage(content=content, content_html=html, body=body,
+                       is_user=is_user, user_id=user_id,
+                       timestamp=timestamp or datetime.utcnow())
+
+
+def insert_messages(rows):
+    # Inserción masiva de dicts con content, is_user, user_id y timestamp,
+    # dentro de la transacción de quien llama
+    values = []
+    for row in rows:
+        content, html, body = _split(row["content"])
+        body_id = None
+        if body is not None:
+            body_id = db.session.execute(insert(MessageBody.__table__).values(
+                codec=body.codec, content=body.content,
+                content_html=body.content_html)).inserted_primary_key[0]
+        values.append(dict(row, content=content, content_html=html,
+                           body_id=body_id))
+    if values:
+        db.session.execute(insert(ChatMessage.__table__), values)
+
+
+def load_bodies(rows):
+    # Descomprime de una vez los cuerpos de las filas (con body_id) que lo
+    # necesitan: body_id -> (content, content_html)
+    body_ids = {row.body_id for row in rows if row.body_id}
+    if not body_ids:
+        return {}
+    bodies = db.session.query(MessageBody).filter(
+        MessageBody.id.in_(body_ids)).all()
+    return {body.id: (decompress(body.content, body.codec),
+                      decompress(body.content_html, body.codec))
+            for body in bodies}
+
+
+def texts(row, bodies):
+    # (content, content_html) de una fila, esté en línea o aparte
+    if row.body_id:
+        return bodies.get(row.body_id, ("", None))
+    return row.content, row.content_html
+
+
+def visible(model, user_id, cleared_id=None):
+    # Filtro de los mensajes de user_id que siguen visibles tras un reinicio.
+    # Sin la marca (cleared_id) se lee de User con una subconsulta.
+    if cleared_id is None:
+        cleared_id = select(User.history_cleared_id).where(
+            User.id == user_id).scalar_subquery()
+    return (model.user_id == user_id) & (model.id > cleared_id)
+
+
+class MessageMaintenance:
+    # Trabajo de fondo: borra lo ocultado por los reinicios, archiva lo que
+    # supera MESSAGE_HOT_DAYS y caduca el archivo. Con varios workers cada
+    # pasada la hace sólo uno.
+
+    def __init__(self, interval=MESSAGE_MAINTENANCE_INTERVAL,
+                 batch_size=MESSAGE_MAINTENANCE_BATCH,
+                 hot_days=MESSAGE_HOT_DAYS, archive_days=MESSAGE_ARCHIVE_DAYS,
+                 pause=MESSAGE_MAINTENANCE_PAUSE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.hot_days = hot_days
+        self.archive_days = archive_days
+        self.pause = pause
+        self.app = None
+        self.last_run = None
+        self.totals = {"purged": 0, "archived": 0, "expired": 0}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run,
+                                        name="message-maintenance",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def reset(self, user_id):
+        # Oculta todo el historial actual de user_id; devuelve la marca. Se
+        # usa el id máximo de ambas tablas (búsquedas por clave primaria) en
+        # lugar del del usuario: cualquier mensaje suyo ya guardado queda por
+        # debajo y los nuevos, con ids mayores, por encima.
+        cleared_id = max(
+            db.session.query(func.max(ChatMessage.id)).scalar() or 0,
+            db.session.query(func.max(ChatMessageArchive.id)).scalar() or 0)
+        User.query.filter(User.id == user_id,
+                          User.history_cleared_id < cleared_id).update(
+            {User.history_cleared_id: cleared_id}, synchronize_session=False)
+        db.session.commit()
+        self._wakeup.set()
+        return cleared_id
+
+    def _delete_batch(self, model, condition):
+        # Borra un lote de filas de model y sus cuerpos; devuelve cuántas
+        rows = db.session.query(model.id, model.body_id).filter(
+            condition).order_by(model.id).limit(self.batch_size).all()
+        if not rows:
+            return 0
+        db.session.execute(delete(model).where(
+            model.id.in_([row.id for row in rows])))
+        body_ids = [row.body_id for row in rows if row.body_id]
+        if body_ids:
+            db.session.execute(delete(MessageBody).where(
+                MessageBody.id.in_(body_ids)))
+        db.session.commit()
+        return len(rows)
+
+    def purge_reset(self):
+        purged = 0
+        users = User.query.with_entities(
+            User.id, User.history_cleared_id).filter(
+                User.history_cleared_id > User.history_purged_id).all()
+        for user_id, cleared_id in users:
+            for model in (ChatMessage, ChatMessageArchive):
+                condition = (model.user_id == user_id) & (model.id <= cleared_id)
+                while (deleted := self._delete_batch(model, condition)):
+                    purged += deleted
+                    time.sleep(self.pause)
+            User.query.filter_by(id=user_id).update(
+                {User.history_purged_id: cleared_id}, synchronize_session=False)
+            db.session.commit()
+        return purged
+
+    def archive(self):
+        # Mueve por lotes los mensajes antiguos de la tabla caliente al
+        # archivo, en la misma transacción que los borra de ella
+        if self.hot_days <= 0:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(days=self.hot_days)
+        hot = ChatMessage.__table__
+        archived = 0
+        while True:
+            ids = [row.id for row in db.session.query(ChatMessage.id).filter(
+                ChatMessage.timestamp < cutoff).order_by(
+                    ChatMessage.timestamp).limit(self.batch_size)]
+            if not ids:
+                break
+            columns = [hot.c[name] for name in ARCHIVED_COLUMNS]
+            db.session.execute(
+                insert(ChatMessageArchive.__table__).from_select(
+                    list(ARCHIVED_COLUMNS),
+                    select(*columns).where(hot.c.id.in_(ids))))
+            db.session.execute(delete(hot).where(hot.c.id.in_(ids)))
+            db.session.commit()
+            archived += len(ids)
+            time.sleep(self.pause)
+        return archived
+
+    def expire_archive(self):
+        if self.archive_days <= 0:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(days=self.archive_days)
+        expired = 0
+        while (deleted := self._delete_batch(
+                ChatMessageArchive, ChatMessageArchive.timestamp < cutoff)):
+            expired += deleted
+            time.sleep(self.pause)
+        return expired
+
+    def run_once(self):
+        with self.app.app_context():
+            try:
+                counts = {"purged": self.purge_reset(),
+                          "archived": self.archive(),
+                          "expired": self.expire_archive()}
+            except Exception as e:
+                db.session.rollback()
+                log_event("message_maintenance_failed", level="error",
+                          error=str(e))
+                return None
+        for name, count in counts.items():
+            self.totals[name] += count
+        self.last_run = datetime.utcnow()
+        if any(counts.values()):
+            log_event("message_maintenance", sample_rate=1, **counts)
+        return counts
+
+    def _run(self):
+        while not self._stopped.is_set():
+            woken = self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            # Tras un reinicio el worker que lo atendió purga sin esperar; la
+            # pasada periódica la hace un solo worker por intervalo
+            if woken or shared_state.claim("message_maintenance",
+                                           self.interval):
+                self.run_once()
+
+    def _estimated_rows(self, model):
+        # Sin COUNT(*) sobre tablas grandes: en PostgreSQL la estimación del
+        # planificador (pg_class.reltuples, al día tras cada ANALYZE); en
+        # otras bases el id máximo, una cota superior que se lee del índice
+        if db.engine.dialect.name == "postgresql":
+            estimate = db.session.execute(
+                text("SELECT reltuples::bigint FROM pg_class "
+                     "WHERE oid = to_regclass(:table)"),
+                {"table": model.__tablename__}).scalar()
+            return max(estimate or 0, 0)
+        return db.session.query(func.max(model.id)).scalar() or 0
+
+    def stats(self):
+        # Valores aproximados y baratos de obtener, aptos para consultarse a
+        # menudo
+        with self.app.app_context():
+            hot = self._estimated_rows(ChatMessage)
+            archived = self._estimated_rows(ChatMessageArchive)
+            bodies = self._estimated_rows(MessageBody)
+            pending = db.session.query(func.count()).select_from(
+                db.session.query(User.id).filter(
+                    User.history_cleared_id > User.history_purged_id).limit(
+                        STATS_PENDING_LIMIT).subquery()).scalar()
+        return {
+            "codec": MESSAGE_CODEC,
+            "inline_limit": MESSAGE_INLINE_LIMIT,
+            "inline_html_limit": MESSAGE_INLINE_HTML_LIMIT,
+            "hot_days": self.hot_days,
+            "archive_days": self.archive_days,
+            "hot_rows_estimate": hot,
+            "archived_rows_estimate": archived,
+            "bodies_estimate": bodies,
+            # Con STATS_PENDING_LIMIT o más se muestra el límite
+            "users_pending_purge": pending,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+            "totals": dict(self.totals),
+        }
+
+
+message_maintenance = MessageMaintenance()
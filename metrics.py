@@ -0,0 +1,210 @@
+import threading
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from structured_log import log_event
+
+# Métricas en memoria del proceso, expuestas en formato de texto de
+# Prometheus en /metrics. Con varios workers cada uno publica las suyas.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120)
+
+_metrics = []
+_metrics_lock = Lock()
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        with _metrics_lock:
+            _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items()) or \
+                ([((), 0)] if not self.labelnames else [])
+        return [f"{self.name}{_format_labels(self.labelnames, key)} "
+                f"{_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # clave de etiquetas -> [conteo por bucket..., suma, total]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, list(data)) for key, data in self._values.items())
+        lines = []
+        for key, data in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key,
+                                        ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {data[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(float(data[-2]))}")
+            lines.append(f"{self.name}_count{labels} {data[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    # El valor se lee al renderizar llamando a fn(), que devuelve un número
+    # o un dict {tupla de etiquetas: número}
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+
+    def _samples(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            log_event("metric_read_failed", level="error", metric=self.name,
+                      error=str(e))
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_format_labels(self.labelnames, key)} "
+                f"{_format_value(v)}" for key, v in sorted(value.items())]
+
+
+def render_metrics():
+    with _metrics_lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Etapas de un turno de chat
+chat_stage_seconds = Histogram(
+    "chat_stage_seconds", "Duración de cada etapa de un turno de chat",
+    ["stage"])
+chat_turn_seconds = Histogram(
+    "chat_turn_seconds", "Duración total de un turno de chat", ["path"])
+run_polls = Histogram(
+    "assistant_run_polls", "Consultas de estado por ejecución del asistente",
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55))
+run_outcomes = Counter(
+    "assistant_runs_total", "Ejecuciones del asistente por resultado",
+    ["outcome"])
+
+# Subidas e ingesta
+uploads_total = Counter(
+    "uploads_total", "Archivos subidos por extensión", ["extension"])
+upload_bytes_total = Counter(
+    "upload_bytes_total", "Bytes recibidos en subidas")
+ingestion_jobs_total = Counter(
+    "ingestion_jobs_total", "Intentos de ingesta por resultado", ["status"])
+ingestion_seconds = Histogram(
+    "ingestion_seconds", "Duración de cada intento de ingesta de un PDF")
+
+# Tiempos por etapa del turno en curso, para el log muestreado del turno
+_trace = threading.local()
+
+
+def begin_turn():
+    _trace.stages = {}
+
+
+def end_turn():
+    stages = getattr(_trace, "stages", None)
+    _trace.stages = None
+    return {k: round(v, 4) for k, v in (stages or {}).items()}
+
+
+def observe_stage(stage, seconds):
+    chat_stage_seconds.observe(seconds, stage=stage)
+    stages = getattr(_trace, "stages", None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
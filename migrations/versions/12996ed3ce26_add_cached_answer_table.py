@@ -0,0 +1,36 @@
+"""Add cached_answer table
+
+Revision ID: 12996ed3ce26
+Revises: 657e3c26d52a
+Create Date: 2026-10-18 15:02:17.664120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '12996ed3ce26'
+down_revision = '657e3c26d52a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cached_answer',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('kb_version', sa.String(length=64), nullable=True),
+    sa.Column('question', sa.Text(), nullable=True),
+    sa.Column('answer', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('cached_answer', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_cached_answer_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('cached_answer', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_cached_answer_created_at'))
+
+    op.drop_table('cached_answer')
@@ -0,0 +1,26 @@
+"""Add thread_id column to User
+
+Revision ID: 256c3326e75f
+Revises: 446501d81cb7
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '256c3326e75f'
+down_revision = '446501d81cb7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('thread_id', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('thread_id')
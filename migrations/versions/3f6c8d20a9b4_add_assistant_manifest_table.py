@@ -0,0 +1,32 @@
+"""Add assistant_manifest table
+
+Revision ID: 3f6c8d20a9b4
+Revises: e7a41d9b2c58
+Create Date: 2026-10-18 23:58:42.107315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6c8d20a9b4'
+down_revision = 'e7a41d9b2c58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The first worker to start copies assistant_manifest.json into the
+    # table (see assistant_manifest.load_manifest)
+    op.create_table('assistant_manifest',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=True),
+    sa.Column('kb_version', sa.String(length=64), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('assistant_manifest')
@@ -0,0 +1,40 @@
+"""Add upload_session table
+
+Revision ID: 4b8e1f07c2d9
+Revises: 12996ed3ce26
+Create Date: 2026-10-18 18:41:05.218337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b8e1f07c2d9'
+down_revision = '12996ed3ce26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('upload_session',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('filename', sa.String(length=255), nullable=True),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('upload_session', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_upload_session_updated_at'), ['updated_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_upload_session_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('upload_session', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_upload_session_user_id'))
+        batch_op.drop_index(batch_op.f('ix_upload_session_updated_at'))
+
+    op.drop_table('upload_session')
@@ -0,0 +1,26 @@
+"""Add (user_id, timestamp, id) index to chat_message
+
+Revision ID: 657e3c26d52a
+Revises: 7649ed35cb90
+Create Date: 2026-10-18 13:41:52.207316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '657e3c26d52a'
+down_revision = '7649ed35cb90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.create_index('ix_chat_message_user_id_timestamp_id', ['user_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_message_user_id_timestamp_id')
@@ -0,0 +1,43 @@
+"""Add ingestion_job table
+
+Revision ID: 7649ed35cb90
+Revises: dc370dac214b
+Create Date: 2026-10-18 12:20:05.118634
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7649ed35cb90'
+down_revision = 'dc370dac214b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ingestion_job',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('file_path', sa.String(length=255), nullable=True),
+    sa.Column('file_url', sa.String(length=255), nullable=True),
+    sa.Column('sha256', sa.String(length=64), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(length=500), nullable=True),
+    sa.Column('file_id', sa.String(length=64), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('ingestion_job', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ingestion_job_status'), ['status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ingestion_job', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ingestion_job_status'))
+
+    op.drop_table('ingestion_job')
@@ -0,0 +1,27 @@
+"""Add content_html to ChatMessage
+
+Revision ID: 8d3a5c61e0f4
+Revises: 4b8e1f07c2d9
+Create Date: 2026-10-18 20:12:47.530912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3a5c61e0f4'
+down_revision = '4b8e1f07c2d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing rows stay NULL until persistence.backfill_rendered_html runs
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_html', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.drop_column('content_html')
@@ -0,0 +1,71 @@
+"""Add message_body, chat_message_archive and reset watermarks
+
+Revision ID: c51e9a2f7b36
+Revises: 8d3a5c61e0f4
+Create Date: 2026-10-18 21:36:19.804215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c51e9a2f7b36'
+down_revision = '8d3a5c61e0f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('message_body',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('codec', sa.String(length=8), nullable=True),
+    sa.Column('content', sa.LargeBinary(), nullable=True),
+    sa.Column('content_html', sa.LargeBinary(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('chat_message_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('content', sa.String(length=500), nullable=True),
+    sa.Column('content_html', sa.Text(), nullable=True),
+    sa.Column('body_id', sa.Integer(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('is_user', sa.Boolean(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('feedback', sa.Boolean(), nullable=True),
+    sa.Column('there_is_feedback', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['body_id'], ['message_body.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('chat_message_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_chat_message_archive_timestamp'), ['timestamp'], unique=False)
+        batch_op.create_index('ix_chat_message_archive_user_id_timestamp_id', ['user_id', 'timestamp', 'id'], unique=False)
+
+    # On SQLite the table is rebuilt for the foreign key; rebuild it with
+    # AUTOINCREMENT so ids are never reused
+    with op.batch_alter_table('chat_message', schema=None,
+                              table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.add_column(sa.Column('body_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_chat_message_body_id_message_body', 'message_body', ['body_id'], ['id'])
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('history_cleared_id', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('history_purged_id', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('history_purged_id')
+        batch_op.drop_column('history_cleared_id')
+
+    with op.batch_alter_table('chat_message', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_chat_message_body_id_message_body', type_='foreignkey')
+        batch_op.drop_column('body_id')
+
+    with op.batch_alter_table('chat_message_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_chat_message_archive_user_id_timestamp_id')
+        batch_op.drop_index(batch_op.f('ix_chat_message_archive_timestamp'))
+
+    op.drop_table('chat_message_archive')
+    op.drop_table('message_body')
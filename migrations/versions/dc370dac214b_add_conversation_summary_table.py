@@ -0,0 +1,31 @@
+"""Add conversation_summary table
+
+Revision ID: dc370dac214b
+Revises: 256c3326e75f
+Create Date: 2026-10-18 11:03:27.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dc370dac214b'
+down_revision = '256c3326e75f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversation_summary',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.Text(), nullable=True),
+    sa.Column('last_message_id', sa.Integer(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('conversation_summary')
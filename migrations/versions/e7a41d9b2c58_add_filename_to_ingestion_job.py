@@ -0,0 +1,28 @@
+"""Add filename to IngestionJob
+
+Revision ID: e7a41d9b2c58
+Revises: c51e9a2f7b36
+Create Date: 2026-10-18 23:41:09.218374
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a41d9b2c58'
+down_revision = 'c51e9a2f7b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Jobs queued before this revision keep NULL and are indexed under the
+    # stored <sha256>.pdf name
+    with op.batch_alter_table('ingestion_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('filename', sa.String(length=255), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('ingestion_job', schema=None) as batch_op:
+        batch_op.drop_column('filename')
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import BigInteger, Column, Integer, String, Boolean, ForeignKey, DateTime, LargeBinary, Text
 from sqlalchemy.orm import relationship
 from flask_login import UserMixin
 from flask_sqlalchemy import SQLAlchemy
@@ -11,13 +11,100 @@ class User(UserMixin, db.Model):
     username = Column(String(64), unique=True, nullable=False)
     email = Column(String(120), unique=True, nullable=False)
     password_hash = Column(String(128))
+    thread_id = Column(String(64), nullable=True)  # Remote assistant thread
+    # Reset watermark: messages with id <= history_cleared_id are hidden and
+    # deleted in the background up to history_purged_id (see message_store.py)
+    history_cleared_id = Column(Integer, nullable=False, default=0, server_default='0')
+    history_purged_id = Column(Integer, nullable=False, default=0, server_default='0')
     messages = relationship('ChatMessage', backref='user', lazy='dynamic')
 
 class ChatMessage(db.Model):
+    __table_args__ = (
+        # Covers the per-user history queries: WHERE user_id ORDER BY timestamp, id
+        db.Index('ix_chat_message_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+        # Ids must never be reused: archived rows keep theirs and the reset
+        # watermark compares ids (SQLite reuses rowids without this)
+        {'sqlite_autoincrement': True},
+    )
+
     id = Column(Integer, primary_key=True)
+    # Short messages are stored inline; long ones leave content and
+    # content_html empty and point to a compressed MessageBody
     content = Column(String(500))
+    content_html = Column(Text, nullable=True)  # Sanitized HTML of content
+    body_id = Column(Integer, ForeignKey('message_body.id'), nullable=True)
+    body = relationship('MessageBody')
     timestamp = Column(DateTime, index=True, default=datetime.utcnow)
     is_user = Column(Boolean, default=False)
     user_id = Column(Integer, ForeignKey('user.id'))
     feedback = Column(Boolean, nullable=True)  # New column for feedback
     there_is_feedback = Column(Boolean, nullable=True)  # New column for feedback
+
+class MessageBody(db.Model):
+    # Compressed text and HTML of a long message, shared by both tiers
+    id = Column(Integer, primary_key=True)
+    codec = Column(String(8))  # zlib or zstd
+    content = Column(LargeBinary)
+    content_html = Column(LargeBinary, nullable=True)
+
+class ChatMessageArchive(db.Model):
+    # Messages older than the hot retention window, moved out of chat_message
+    # with their ids; /history reads them when paging past the hot rows
+    __table_args__ = (
+        db.Index('ix_chat_message_archive_user_id_timestamp_id', 'user_id', 'timestamp', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    content = Column(String(500))
+    content_html = Column(Text, nullable=True)
+    body_id = Column(Integer, ForeignKey('message_body.id'), nullable=True)
+    timestamp = Column(DateTime, index=True)
+    is_user = Column(Boolean, default=False)
+    user_id = Column(Integer, ForeignKey('user.id'))
+    feedback = Column(Boolean, nullable=True)
+    there_is_feedback = Column(Boolean, nullable=True)
+
+class ConversationSummary(db.Model):
+    user_id = Column(Integer, ForeignKey('user.id'), primary_key=True)
+    content = Column(Text, default='')
+    last_message_id = Column(Integer, default=0)  # Last ChatMessage folded in
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class IngestionJob(db.Model):
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'))
+    file_path = Column(String(255))
+    file_url = Column(String(255))
+    filename = Column(String(255), nullable=True)  # Original name, for search results and citations
+    sha256 = Column(String(64))
+    status = Column(String(16), default='queued', index=True)  # queued, processing, completed, failed
+    attempts = Column(Integer, default=0)
+    error = Column(String(500), nullable=True)
+    file_id = Column(String(64), nullable=True)  # Remote vector store file
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CachedAnswer(db.Model):
+    key = Column(String(64), primary_key=True)  # sha256(kb_version + question)
+    kb_version = Column(String(64))
+    question = Column(Text)
+    answer = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class AssistantManifest(db.Model):
+    # Single row (id=1) shared by every worker: assistant and vector store ids
+    # and the hash of every ingested file, as JSON (see assistant_manifest.py)
+    id = Column(Integer, primary_key=True)
+    content = Column(Text)
+    kb_version = Column(String(64), nullable=True)  # Derived from content
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class UploadSession(db.Model):
+    # Chunked upload in progress; the bytes received so far are in a partial
+    # file named after the id
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey('user.id'), index=True)
+    filename = Column(String(255))
+    size = Column(BigInteger)  # Declared total size in bytes
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
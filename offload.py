@@ -0,0 +1,21 @@
+try:
+    from eventlet import patcher, tpool
+except ImportError:  # eventlet es opcional: sin él los hilos ya son reales
+    patcher = tpool = None
+
+# Trabajo de CPU largo (extraer el texto de un PDF, el sha256 de un archivo
+# grande) fuera del hub de eventlet. Con monkey_patch los hilos, incluidos
+# los del pool de ingesta, son greenlets: mientras uno calcula, ninguna otra
+# conexión avanza. Con eventlet activo la función se ejecuta en eventlet.tpool
+# (hilos reales del sistema, EVENTLET_THREADPOOL_SIZE) y el greenlet espera
+# sin bloquear; sin eventlet se llama directamente.
+
+
+def green():
+    return patcher is not None and patcher.is_monkey_patched("thread")
+
+
+def run_blocking(func, *args, **kwargs):
+    if green():
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
@@ -0,0 +1,294 @@
+import os
+import random
+import re
+import time
+from threading import Lock
+
+import httpx
+
+from metrics import Counter, Gauge, Histogram
+from structured_log import log_event
+
+# Transporte HTTP compartido por todas las llamadas a OpenAI: un único pool de
+# conexiones keep-alive para todos los hilos/greenlets, timeouts según el tipo
+# de llamada, reintentos con backoff exponencial y jitter ante 429/5xx, y un
+# circuit breaker que corta las llamadas mientras el servicio está degradado.
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 50))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get("OPENAI_MAX_KEEPALIVE", 20))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 30))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5))
+OPENAI_POOL_TIMEOUT = float(os.environ.get("OPENAI_POOL_TIMEOUT", 10))
+
+# Timeout de lectura por tipo de llamada; en streaming es el tiempo máximo
+# entre dos fragmentos, no la duración total
+CALL_TIMEOUTS = {
+    "default": float(os.environ.get("OPENAI_TIMEOUT_DEFAULT", 30)),
+    "run_poll": float(os.environ.get("OPENAI_TIMEOUT_POLL", 10)),
+    "stream": float(os.environ.get("OPENAI_TIMEOUT_STREAM", 60)),
+    "upload": float(os.environ.get("OPENAI_TIMEOUT_UPLOAD", 300)),
+}
+
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 3))
+OPENAI_RETRY_BASE_DELAY = float(os.environ.get("OPENAI_RETRY_BASE_DELAY", 0.5))
+OPENAI_RETRY_MAX_DELAY = float(os.environ.get("OPENAI_RETRY_MAX_DELAY", 8))
+OPENAI_BREAKER_THRESHOLD = int(os.environ.get("OPENAI_BREAKER_THRESHOLD", 5))
+OPENAI_BREAKER_COOLDOWN = float(os.environ.get("OPENAI_BREAKER_COOLDOWN", 30))
+
+UNAVAILABLE_MESSAGE = ("El asistente no está disponible en este momento por "
+                       "alta demanda. Intenta de nuevo en unos minutos.")
+
+openai_requests_total = Counter(
+    "openai_requests_total", "Llamadas HTTP a OpenAI por tipo y resultado",
+    ["call", "outcome"])
+openai_retries_total = Counter(
+    "openai_retries_total", "Reintentos de llamadas a OpenAI", ["call"])
+openai_request_seconds = Histogram(
+    "openai_request_seconds",
+    "Duración de las llamadas a OpenAI (hasta recibir las cabeceras)", ["call"])
+
+
+class CircuitOpenError(httpx.TransportError):
+    pass
+
+
+def upstream_unavailable(exc):
+    # True si la excepción (o su causa, ya envuelta por el SDK) viene del
+    # circuit breaker abierto
+    while exc is not None:
+        if isinstance(exc, CircuitOpenError):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class CircuitBreaker:
+    # closed: las llamadas pasan. Tras `threshold` fallos seguidos pasa a
+    # open y rechaza todo durante `cooldown` segundos; luego half_open deja
+    # pasar una sola llamada de prueba: si funciona se cierra, si no se
+    # vuelve a abrir.
+
+    def __init__(self, threshold=OPENAI_BREAKER_THRESHOLD,
+                 cooldown=OPENAI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def is_open(self):
+        with self._lock:
+            return self.state == "open" and \
+                time.monotonic() - self.opened_at < self.cooldown
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    log_event("openai_breaker_open", level="warning",
+                              failures=self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            retry_in = None
+            if self.state == "open":
+                retry_in = max(self.cooldown - (time.monotonic() - self.opened_at), 0)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "threshold": self.threshold,
+                "cooldown": self.cooldown,
+                "times_opened": self.times_opened,
+                "retry_in": retry_in,
+            }
+
+
+_RUN_PATH = re.compile(r"/threads/[^/]+/runs/[^/]+$")
+_UPLOAD_PATH = re.compile(r"/files$|/file_batches$")
+
+
+def call_type(request):
+    path = request.url.path
+    if request.method == "GET" and _RUN_PATH.search(path):
+        return "run_poll"
+    if request.method == "POST":
+        if _UPLOAD_PATH.search(path):
+            return "upload"
+        if path.endswith("/runs"):
+            try:
+                body = request.content
+            except httpx.RequestNotRead:
+                body = b""
+            if re.search(rb'"stream":\s*true', body):
+                return "stream"
+    return "default"
+
+
+def _retry_after(response):
+    # Respetar la espera que indique el servidor (en ms o en segundos)
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return None
+
+
+class ResilientTransport(httpx.BaseTransport):
+
+    def __init__(self, breaker=None, max_retries=OPENAI_MAX_RETRIES,
+                 base_delay=OPENAI_RETRY_BASE_DELAY,
+                 max_delay=OPENAI_RETRY_MAX_DELAY):
+        self.breaker = breaker or CircuitBreaker()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                   max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                                   keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY)
+        self._transport = httpx.HTTPTransport(limits=self.limits)
+
+    def _backoff(self, attempt, response=None):
+        delay = min(self.base_delay * 2 ** attempt, self.max_delay)
+        # Full jitter para no sincronizar los reintentos de varios workers
+        delay = random.uniform(0, delay)
+        server_delay = _retry_after(response) if response is not None else None
+        if server_delay is not None:
+            delay = min(max(delay, server_delay), self.max_delay)
+        return delay
+
+    def handle_request(self, request):
+        call = call_type(request)
+        if not self.breaker.allow():
+            openai_requests_total.inc(call=call, outcome="rejected")
+            raise CircuitOpenError("OpenAI no disponible (circuit breaker abierto)",
+                                   request=request)
+
+        timeout = CALL_TIMEOUTS[call]
+        # Un timeout menor pedido en la llamada (p. ej. lo que le queda a una
+        # ejecución en streaming) tiene prioridad
+        requested = request.extensions.get("timeout", {}).get("read")
+        if requested is not None:
+            timeout = min(timeout, requested)
+        request.extensions = dict(request.extensions, timeout={
+            "connect": OPENAI_CONNECT_TIMEOUT,
+            "read": timeout,
+            "write": timeout,
+            "pool": OPENAI_POOL_TIMEOUT,
+        })
+
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                response = self._transport.handle_request(request)
+            except Exception as e:
+                openai_request_seconds.observe(time.perf_counter() - started,
+                                               call=call)
+                # Sin respuesta: sólo se reintenta si la petición no pudo
+                # llegar al servidor, o si es una lectura
+                retryable = isinstance(e, httpx.TransportError) and (
+                    request.method == "GET" or isinstance(
+                        e, (httpx.ConnectError, httpx.ConnectTimeout,
+                            httpx.PoolTimeout)))
+                if retryable and attempt < self.max_retries:
+                    openai_retries_total.inc(call=call)
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+                openai_requests_total.inc(call=call, outcome="error")
+                self.breaker.record_failure()
+                raise
+            openai_request_seconds.observe(time.perf_counter() - started,
+                                           call=call)
+
+            status = response.status_code
+            if status == 429 or status >= 500:
+                if attempt < self.max_retries:
+                    delay = self._backoff(attempt, response)
+                    response.close()
+                    openai_retries_total.inc(call=call)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                openai_requests_total.inc(call=call, outcome=str(status))
+                self.breaker.record_failure()
+                return response
+
+            openai_requests_total.inc(
+                call=call, outcome="ok" if status < 400 else str(status))
+            self.breaker.record_success()
+            return response
+
+    def close(self):
+        self._transport.close()
+
+    def pool_stats(self):
+        connections = list(getattr(self._transport._pool, "connections", []))
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "connections": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+        }
+
+    def stats(self):
+        return {
+            "pool": self.pool_stats(),
+            "breaker": self.breaker.stats(),
+            "timeouts": dict(CALL_TIMEOUTS, connect=OPENAI_CONNECT_TIMEOUT,
+                             pool=OPENAI_POOL_TIMEOUT),
+            "max_retries": self.max_retries,
+        }
+
+
+transport = ResilientTransport()
+
+
+def build_http_client():
+    # Los reintentos los hace el transporte; el SDK se crea con max_retries=0
+    return httpx.Client(transport=transport,
+                        timeout=httpx.Timeout(CALL_TIMEOUTS["default"],
+                                              connect=OPENAI_CONNECT_TIMEOUT))
+
+
+_BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+Gauge("openai_circuit_breaker_state",
+      "Estado del circuit breaker de OpenAI (0 cerrado, 1 semiabierto, 2 abierto)",
+      lambda: _BREAKER_STATES[transport.breaker.stats()["state"]])
+Gauge("openai_pool_connections", "Conexiones del pool HTTP de OpenAI",
+      lambda: {(state,): count for state, count in transport.pool_stats().items()
+               if state in ("idle", "active")},
+      ["state"])
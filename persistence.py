@@ -0,0 +1,186 @@
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from message_render import render_message
+from message_store import insert_messages, new_message
+from models import db, ChatMessage, ChatMessageArchive
+from structured_log import log_event
+
+# Durability:
+# - save_turn writes a user message and the assistant reply in ONE
+#   transaction: either both rows are committed or neither is.
+# - The write-behind buffer (WRITE_BEHIND=true) acknowledges feedback and
+#   upload notices before they reach the database and flushes them in bulk
+#   every WRITE_BEHIND_INTERVAL seconds. Anything still buffered when the
+#   process is killed hard (SIGKILL, OOM, power loss) is lost; on a normal
+#   shutdown the buffer is flushed by an atexit hook.
+# - Chat turns are never buffered: the reply sent to the client carries the
+#   stored ids (for feedback and the /history cursor), so save_turn must
+#   commit before the emit. Each turn still costs a single commit.
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', 'false').lower() == 'true'
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 0.5))
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get('WRITE_BEHIND_MAX_BATCH', 1000))
+# Rendered HTML backfill for rows stored before content_html existed
+RENDER_BACKFILL_BATCH = int(os.environ.get('RENDER_BACKFILL_BATCH', 500))
+RENDER_BACKFILL_PAUSE = float(os.environ.get('RENDER_BACKFILL_PAUSE', 0.05))
+
+
+def save_turn(user_id, user_content, bot_content, user_timestamp=None):
+    user_message = new_message(user_id, user_content, is_user=True,
+                               timestamp=user_timestamp)
+    bot_message = new_message(user_id, bot_content, is_user=False)
+    db.session.add_all([user_message, bot_message])
+    db.session.commit()
+    return user_message, bot_message
+
+
+def _feedback_update(model):
+    return model.__table__.update().where(
+        model.__table__.c.id == bindparam('message_id'),
+        model.__table__.c.user_id == bindparam('owner_id')).values(
+            feedback=bindparam('is_like'), there_is_feedback=True)
+
+
+# Archived messages keep their ids, so each id is in exactly one of the
+# tables and the update is applied to both
+_feedback_updates = [_feedback_update(model)
+                     for model in (ChatMessage, ChatMessageArchive)]
+
+
+_html_update = ChatMessage.__table__.update().where(
+    ChatMessage.__table__.c.id == bindparam('message_id')).values(
+        content_html=bindparam('html'))
+
+
+def backfill_rendered_html(app, batch_size=RENDER_BACKFILL_BATCH,
+                           pause=RENDER_BACKFILL_PAUSE, rerender=False):
+    # New rows get content_html on insert (see message_store.new_message);
+    # this renders the older inline ones in id order, one short transaction
+    # per batch. rerender=True regenerates every inline row, e.g. after a
+    # change to message_render; out-of-line bodies already carry their HTML.
+    # Returns the number of rows updated.
+    total = 0
+    last_id = 0
+    with app.app_context():
+        while True:
+            query = db.session.query(ChatMessage.id, ChatMessage.content).filter(
+                ChatMessage.id > last_id, ChatMessage.body_id.is_(None))
+            if not rerender:
+                query = query.filter(ChatMessage.content_html.is_(None))
+            rows = query.order_by(ChatMessage.id).limit(batch_size).all()
+            if not rows:
+                break
+            db.session.execute(_html_update, [
+                {'message_id': message_id, 'html': render_message(content)}
+                for message_id, content in rows])
+            db.session.commit()
+            total += len(rows)
+            last_id = rows[-1][0]
+            time.sleep(pause)
+    if total:
+        log_event('render_backfill_done', sample_rate=1, messages=total)
+    return total
+
+
+class WriteBehindBuffer:
+    # Acumula inserciones de mensajes y actualizaciones de feedback en memoria
+    # y las escribe en una sola transacción por intervalo.
+
+    def __init__(self, interval=WRITE_BEHIND_INTERVAL,
+                 max_batch=WRITE_BEHIND_MAX_BATCH):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.app = None
+        self._messages = []
+        self._feedback = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self._thread = threading.Thread(target=self._run,
+                                        name='write-behind',
+                                        daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def add_message(self, user_id, content, is_user=True):
+        with self._lock:
+            self._messages.append({
+                'content': content,
+                'is_user': is_user,
+                'user_id': user_id,
+                'timestamp': datetime.utcnow(),
+            })
+            full = len(self._messages) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def add_feedback(self, user_id, message_id, is_like):
+        # Si llegan varios votos para el mismo mensaje, gana el último. La
+        # clave lleva al usuario: el voto de otro (que el UPDATE ignora) no
+        # pisa el del dueño.
+        with self._lock:
+            self._feedback[(user_id, message_id)] = {
+                'message_id': message_id,
+                'owner_id': user_id,
+                'is_like': is_like,
+            }
+            full = len(self._feedback) >= self.max_batch
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._messages) + len(self._feedback)
+
+    def flush(self):
+        with self._lock:
+            messages, self._messages = self._messages, []
+            feedback, self._feedback = list(self._feedback.values()), {}
+        if not messages and not feedback:
+            return 0
+
+        with self.app.app_context():
+            try:
+                if messages:
+                    insert_messages(messages)
+                if feedback:
+                    for update in _feedback_updates:
+                        db.session.execute(update, feedback)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                log_event('write_behind_flush_failed', level='error',
+                          error=str(e))
+                # Devolver lo no escrito al buffer para el siguiente intento
+                with self._lock:
+                    self._messages[:0] = messages
+                    for item in feedback:
+                        self._feedback.setdefault(
+                            (item['owner_id'], item['message_id']), item)
+                return 0
+        return len(messages) + len(feedback)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+
+write_behind = WriteBehindBuffer()
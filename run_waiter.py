@@ -0,0 +1,167 @@
+import os
+import random
+import time
+from collections import deque
+from threading import Lock
+
+from metrics import observe_stage, run_polls, run_outcomes
+from structured_log import log_event
+
+# Estados en los que una ejecución (run) ya no va a cambiar
+TERMINAL_STATES = {"completed", "failed", "cancelled", "expired", "incomplete"}
+
+RUN_TIMEOUT_SECONDS = float(os.environ.get("RUN_TIMEOUT_SECONDS", 120))
+POLL_INITIAL_DELAY = float(os.environ.get("RUN_POLL_INITIAL_DELAY", 0.25))
+POLL_MAX_DELAY = float(os.environ.get("RUN_POLL_MAX_DELAY", 2.0))
+POLL_BACKOFF = 1.5
+
+
+class RunError(Exception):
+    def __init__(self, run, message=None):
+        self.run = run
+        self.status = getattr(run, "status", None)
+        super().__init__(message or f"Run {run.id} terminó con estado {self.status}")
+
+
+class RunTimeoutError(RunError):
+    pass
+
+
+class RunCancelledError(RunError):
+    # Se canceló porque ya no hace falta (p. ej. se reinició la conversación)
+    pass
+
+
+_stats_lock = Lock()
+poll_stats = {
+    "runs": 0,
+    "polls": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "cancelled": 0,
+}
+# Últimas ejecuciones: (run_id, estado, número de consultas, segundos)
+recent_runs = deque(maxlen=100)
+
+
+def _record(run, polls, elapsed, outcome, stage="run_poll"):
+    with _stats_lock:
+        poll_stats["runs"] += 1
+        poll_stats["polls"] += polls
+        poll_stats[outcome] += 1
+        recent_runs.append((getattr(run, "id", None), getattr(run, "status", None),
+                            polls, round(elapsed, 3)))
+    observe_stage(stage, elapsed)
+    run_polls.observe(polls)
+    run_outcomes.inc(outcome=outcome)
+
+
+def get_poll_stats():
+    with _stats_lock:
+        stats = dict(poll_stats)
+        stats["avg_polls_per_run"] = (stats["polls"] / stats["runs"]
+                                      if stats["runs"] else 0.0)
+        stats["recent_runs"] = list(recent_runs)
+    return stats
+
+
+class RunTracker:
+    # Política común a las dos formas de seguir una ejecución, consultando su
+    # estado (wait_for_run) o leyendo su stream: límite de tiempo desde que
+    # empieza, cancelación si requiere acciones o se pasa del límite, error
+    # en los estados terminales distintos de completed y registro del
+    # resultado en las mismas métricas (la duración, en la etapa `stage`).
+    # Si `abandoned()` devuelve True la ejecución se cancela.
+
+    def __init__(self, client, thread_id, timeout=None, stage="run_poll",
+                 abandoned=None):
+        self.client = client
+        self.thread_id = thread_id
+        self.stage = stage
+        self.abandoned = abandoned
+        self.timeout = RUN_TIMEOUT_SECONDS if timeout is None else timeout
+        self.started = time.monotonic()
+        self.deadline = self.started + self.timeout
+        self.polls = 0
+        self.run = None
+        self.outcome = None
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def update(self, run):
+        # Revisa un estado observado de la ejecución: True si terminó bien,
+        # False si sigue en curso; RunError si terminó mal o se pasó del límite
+        self.run = run
+        if run.status == "completed":
+            self._finish("completed")
+            return True
+        if run.status == "requires_action":
+            # El asistente sólo usa file_search, no hay herramientas que ejecutar
+            self.fail(f"Run {run.id} requiere acciones no soportadas")
+        if run.status in TERMINAL_STATES:
+            self._finish("failed")
+            raise RunError(run, f"Run {run.id} terminó con estado {run.status}: "
+                           f"{getattr(run, 'last_error', None)}")
+        self.check_deadline()
+        return False
+
+    def check_deadline(self):
+        if self.outcome is not None:
+            # Ya terminó; sólo quedan los últimos eventos del stream
+            return
+        if self.remaining() <= 0:
+            self.timed_out()
+        if self.abandoned is not None and self.abandoned():
+            self._cancel()
+            self._finish("cancelled")
+            raise RunCancelledError(self.run, f"Run {getattr(self.run, 'id', None)} "
+                                    f"cancelado: ya no hace falta")
+
+    def timed_out(self):
+        self._cancel()
+        self._finish("timeouts")
+        raise RunTimeoutError(self.run, f"Run {getattr(self.run, 'id', None)} "
+                              f"no terminó en {self.timeout} segundos")
+
+    def fail(self, message):
+        # La ejecución no puede seguir (p. ej. el stream se cortó antes de que
+        # terminara): se cancela y cuenta como fallida
+        self._cancel()
+        self._finish("failed")
+        raise RunError(self.run, message)
+
+    def _finish(self, outcome):
+        self.outcome = outcome
+        _record(self.run, self.polls, time.monotonic() - self.started, outcome,
+                self.stage)
+
+    def _cancel(self):
+        if self.run is None:
+            return
+        try:
+            self.client.beta.threads.runs.cancel(thread_id=self.thread_id,
+                                                 run_id=self.run.id)
+        except Exception as e:
+            log_event("run_cancel_failed", level="warning", run_id=self.run.id,
+                      error=str(e))
+
+
+def wait_for_run(client, thread_id, run, timeout=None, abandoned=None):
+    # Espera a que la ejecución llegue a un estado terminal consultando con
+    # backoff exponencial y jitter, hasta un límite de tiempo por petición.
+    tracker = RunTracker(client, thread_id, timeout, abandoned=abandoned)
+    delay = POLL_INITIAL_DELAY
+
+    while not tracker.update(run):
+        # Jitter para no sincronizar las consultas de varios usuarios
+        time.sleep(min(delay / 2 + random.uniform(0, delay / 2),
+                       tracker.remaining()))
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id,
+                                                run_id=run.id)
+        tracker.polls += 1
+
+    return run
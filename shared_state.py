@@ -0,0 +1,223 @@
+import os
+import time
+import uuid
+from threading import Lock
+
+from structured_log import log_event
+
+try:
+    import redis
+except ImportError:  # redis es opcional: sólo hace falta con varios workers
+    redis = None
+
+# Estado compartido entre workers. Con un Redis configurado (SHARED_STATE_URL,
+# o la cola de mensajes de Socket.IO si es redis://) los locks por usuario y
+# las versiones de las cachés locales viven ahí, y cualquier worker puede
+# atender a cualquier usuario. Sin él todo queda en el proceso, como con un
+# solo worker.
+SHARED_STATE_PREFIX = os.environ.get("SHARED_STATE_PREFIX", "chatbot:")
+# Caducidad de un lock por si el worker que lo tiene muere. Quien lo retenga
+# durante algo más largo (p. ej. el lock del hilo durante una ejecución del
+# asistente) lo alarga con extend() hasta su propio límite de tiempo.
+SHARED_LOCK_TTL = float(os.environ.get("SHARED_LOCK_TTL", 300))
+SHARED_LOCK_MAX_POLL = 0.5
+
+
+def _shared_state_url():
+    url = os.environ.get("SHARED_STATE_URL")
+    if url:
+        return url
+    queue = os.environ.get("SOCKETIO_MESSAGE_QUEUE", "")
+    return queue if queue.startswith(("redis://", "rediss://", "unix://")) \
+        else None
+
+
+class SharedLock:
+    # Lock entre workers: SET NX con caducidad y liberación sólo si el token
+    # sigue siendo nuestro. El lock local evita que los hilos de un mismo
+    # proceso compitan por Redis. Si Redis falla se sigue sólo con el local.
+
+    def __init__(self, state, name, local, ttl=SHARED_LOCK_TTL):
+        self.state = state
+        self.key = state.key(f"lock:{name}")
+        self.local = local
+        self.ttl = ttl
+        self._token = None
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.monotonic()
+        if not self.local.acquire(blocking, timeout):
+            return False
+        token = uuid.uuid4().hex
+        delay = 0.01
+        try:
+            while True:
+                if self.state.client.set(self.key, token, nx=True,
+                                         px=int(self.ttl * 1000)):
+                    self._token = token
+                    return True
+                waited = time.monotonic() - started
+                if not blocking or (timeout >= 0 and waited >= timeout):
+                    self.local.release()
+                    return False
+                time.sleep(delay)
+                delay = min(delay * 2, SHARED_LOCK_MAX_POLL)
+        except redis.RedisError as e:
+            log_event("shared_lock_failed", level="error", key=self.key,
+                      error=str(e))
+            return True
+        except BaseException:
+            self.local.release()
+            raise
+
+    def extend(self, seconds):
+        # Garantiza que el lock, si sigue siendo nuestro, dure al menos
+        # `seconds` más
+        if self._token is None:
+            return False
+        return self.state.expire_if_equal(self.key, self._token, seconds)
+
+    def release(self):
+        token, self._token = self._token, None
+        try:
+            if token is not None:
+                self.state.delete_if_equal(self.key, token)
+        finally:
+            self.local.release()
+
+    def locked(self):
+        return self.local.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class SharedState:
+
+    def __init__(self, url=None):
+        self.url = url
+        self.client = None
+        if url and redis is None:
+            # El estado queda en el proceso
+            log_event("shared_state_unavailable", level="warning",
+                      reason="redis package not installed")
+        elif url:
+            self.client = redis.Redis.from_url(url, socket_timeout=5,
+                                               socket_connect_timeout=5)
+
+    @property
+    def enabled(self):
+        return self.client is not None
+
+    def key(self, name):
+        return f"{SHARED_STATE_PREFIX}{name}"
+
+    def lock(self, name, local=None, ttl=SHARED_LOCK_TTL):
+        local = local if local is not None else Lock()
+        if not self.enabled:
+            return local
+        return SharedLock(self, name, local, ttl)
+
+    def delete_if_equal(self, key, value):
+        # Borra la clave sólo si aún vale `value` (WATCH/MULTI, sin Lua)
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.watch(key)
+                if pipe.get(key) != value.encode():
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+                return True
+        except redis.WatchError:
+            return False
+        except redis.RedisError as e:
+            log_event("shared_lock_release_failed", level="error", key=key,
+                      error=str(e))
+            return False
+
+    def expire_if_equal(self, key, value, seconds):
+        # Alarga la caducidad de la clave a `seconds` si aún vale `value` y le
+        # queda menos (WATCH/MULTI, como delete_if_equal)
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.watch(key)
+                if pipe.get(key) != value.encode():
+                    pipe.unwatch()
+                    return False
+                if pipe.pttl(key) >= seconds * 1000:
+                    pipe.unwatch()
+                    return True
+                pipe.multi()
+                pipe.pexpire(key, int(seconds * 1000))
+                pipe.execute()
+                return True
+        except redis.WatchError:
+            return False
+        except redis.RedisError as e:
+            log_event("shared_lock_renew_failed", level="error", key=key,
+                      error=str(e))
+            return False
+
+    def extend(self, lock, seconds):
+        # Alarga un lock devuelto por lock(); los locks sólo locales no caducan
+        if isinstance(lock, SharedLock):
+            return lock.extend(seconds)
+        return True
+
+    def version(self, name):
+        # Versión de un dato cacheado en los workers; 0 si nunca cambió y
+        # None si no se puede saber (la caché local debe descartarse)
+        if not self.enabled:
+            return 0
+        try:
+            value = self.client.get(self.key(f"version:{name}"))
+            return int(value) if value else 0
+        except redis.RedisError as e:
+            log_event("shared_version_failed", level="warning", name=name,
+                      error=str(e))
+            return None
+
+    def bump(self, name):
+        # Marca el dato como cambiado para los demás workers
+        if not self.enabled:
+            return 0
+        try:
+            return self.client.incr(self.key(f"version:{name}"))
+        except redis.RedisError as e:
+            log_event("shared_bump_failed", level="error", name=name,
+                      error=str(e))
+            return None
+
+    def claim(self, name, ttl):
+        # True sólo para el primer worker que lo pide en `ttl` segundos; para
+        # tareas de arranque que no deben repetirse en cada worker
+        if not self.enabled:
+            return True
+        try:
+            return bool(self.client.set(self.key(f"claim:{name}"), os.getpid(),
+                                        nx=True, ex=max(int(ttl), 1)))
+        except redis.RedisError as e:
+            log_event("shared_claim_failed", level="warning", name=name,
+                      error=str(e))
+            return True
+
+    def stats(self):
+        stats = {"enabled": self.enabled, "prefix": SHARED_STATE_PREFIX,
+                 "lock_ttl": SHARED_LOCK_TTL}
+        if self.enabled:
+            try:
+                started = time.perf_counter()
+                self.client.ping()
+                stats["ping_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            except redis.RedisError as e:
+                stats["error"] = str(e)
+        return stats
+
+
+shared_state = SharedState(_shared_state_url())
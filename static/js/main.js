@@ -7,21 +7,36 @@ document.addEventListener('DOMContentLoaded', () => {
     const fileInput = document.getElementById('fileInput');
     const resetButton = document.getElementById('resetButton');
     const typingIndicator = document.getElementById('typingIndicator');
+    const queueStatus = document.getElementById('queueStatus');
     const converter = new showdown.Converter();
     let messageCounter = 0;
+    let streamingDiv = null;
+    let streamingText = '';
+    const pendingUploads = new Set();
+    // Messages typed here, oldest first, until the server reports their ids
+    const unsavedMessages = [];
+    const uploadStatuses = new Map();
 
     if (!chatMessages || !userInput || !sendButton || !fileInput || !resetButton || !typingIndicator) {
         console.log('One or more elements not found. User might not be logged in.');
         return;
     }
 
-    function addMessage(content, isUser, messageId = null, feedback = null, thereIsFeedback) {
-        console.log(`Adding message: ${content}, isUser: ${isUser}, messageId: ${messageId}, feedback: ${feedback}, thereIsFeedback: ${thereIsFeedback}`);
+    // Feedback icons are rendered to SVG once instead of running
+    // feather.replace() over the whole document for every message
+    const feedbackIcons = {
+        like: feather.icons['thumbs-up'].toSvg(),
+        dislike: feather.icons['thumbs-down'].toSvg(),
+    };
+
+    // Builds a message element. `html` is the sanitized markup rendered by
+    // the server when the message was stored; without it (messages typed
+    // here, rows not backfilled yet) the markdown is converted locally.
+    function createMessageElement(content, isUser, messageId = null, feedback = null, thereIsFeedback, html = null) {
         const messageDiv = document.createElement('div');
         messageDiv.classList.add('message');
         messageDiv.classList.add(isUser ? 'user-message' : 'bot-message');
-        const html = converter.makeHtml(content);
-        messageDiv.innerHTML = html;
+        messageDiv.innerHTML = html !== null && html !== undefined ? html : converter.makeHtml(content);
         
         if (!messageId) {
             messageId = `temp-${messageCounter++}`;
@@ -33,17 +48,27 @@ document.addEventListener('DOMContentLoaded', () => {
             feedbackDiv.classList.add('message-feedback');
             feedbackDiv.innerHTML = `
                 <button class="feedback-btn like${(feedback === true && thereIsFeedback) ? ' active' : ''}" data-message-id="${messageId}">
-                    <i data-feather="thumbs-up"></i>
+                    ${feedbackIcons.like}
                 </button>
                 <button class="feedback-btn dislike${(feedback === false && thereIsFeedback) ? ' active' : ''}" data-message-id="${messageId}">
-                    <i data-feather="thumbs-down"></i>
+                    ${feedbackIcons.dislike}
                 </button>
             `;
             messageDiv.appendChild(feedbackDiv);
         }
+        return messageDiv;
+    }
+
+    function addMessage(content, isUser, messageId = null, feedback = null, thereIsFeedback, prepend = false, html = null) {
+        console.log(`Adding message: ${content}, isUser: ${isUser}, messageId: ${messageId}, feedback: ${feedback}, thereIsFeedback: ${thereIsFeedback}`);
+        const messageDiv = createMessageElement(content, isUser, messageId, feedback, thereIsFeedback, html);
         
-        chatMessages.appendChild(messageDiv);
-        scrollToBottom();
+        if (prepend) {
+            chatMessages.insertBefore(messageDiv, chatMessages.firstChild);
+        } else {
+            chatMessages.appendChild(messageDiv);
+            scrollToBottom();
+        }
 
         messageDiv.style.opacity = '0';
         messageDiv.style.transform = 'translateY(20px)';
@@ -51,8 +76,32 @@ document.addEventListener('DOMContentLoaded', () => {
             messageDiv.style.opacity = '1';
             messageDiv.style.transform = 'translateY(0)';
         }, 50);
+        return messageDiv;
+    }
+
+    // Gives a message rendered with a temporary id the id it was stored with,
+    // so loading the history again does not add it a second time
+    function setMessageId(messageDiv, messageId) {
+        if (messageDiv && messageId) {
+            messageDiv.setAttribute('id', `msg-${messageId}`);
+        }
+    }
 
-        feather.replace();
+    // History pages are inserted with a single DOM operation and without the
+    // per-message entry animation
+    function addHistory(messages, prepend = false) {
+        const fragment = document.createDocumentFragment();
+        messages.forEach(msg => {
+            if (!document.getElementById(`msg-${msg.message_id}`)) {
+                fragment.appendChild(createMessageElement(msg.content, msg.is_user, msg.message_id, msg.feedback, msg.thereIsFeedback, msg.html));
+            }
+        });
+        if (prepend) {
+            chatMessages.insertBefore(fragment, chatMessages.firstChild);
+        } else {
+            chatMessages.appendChild(fragment);
+            scrollToBottom();
+        }
     }
 
     function scrollToBottom() {
@@ -68,13 +117,38 @@ document.addEventListener('DOMContentLoaded', () => {
     function hideTypingIndicator() {
         console.log('Hiding typing indicator');
         typingIndicator.style.display = 'none';
+        hideQueueStatus();
+    }
+
+    function showQueueStatus(text) {
+        if (queueStatus) {
+            queueStatus.textContent = text;
+            queueStatus.style.display = 'block';
+        }
+    }
+
+    function hideQueueStatus() {
+        if (queueStatus) {
+            queueStatus.style.display = 'none';
+        }
+    }
+
+    // Disable sending until the server accepts new questions again
+    function pauseSending(seconds) {
+        userInput.disabled = true;
+        sendButton.disabled = true;
+        setTimeout(() => {
+            userInput.disabled = false;
+            sendButton.disabled = false;
+            userInput.focus();
+        }, Math.max(seconds || 0, 1) * 1000);
     }
 
     function sendMessage() {
         const message = userInput.value.trim();
         if (message) {
             console.log('Sending message:', message);
-            addMessage(message, true);
+            unsavedMessages.push(addMessage(message, true));
             userInput.value = '';
             showTypingIndicator();
 
@@ -82,15 +156,81 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    socket.on('receive_message_chunk', (data) => {
+        if (!streamingDiv) {
+            hideTypingIndicator();
+            streamingDiv = document.createElement('div');
+            streamingDiv.classList.add('message', 'bot-message');
+            chatMessages.appendChild(streamingDiv);
+            streamingText = '';
+        }
+        streamingText += data.delta;
+        streamingDiv.innerHTML = converter.makeHtml(streamingText);
+        scrollToBottom();
+    });
+
+    socket.on('queue_position', (data) => {
+        console.log('Queue position:', data);
+        let text = `Tu pregunta está en la cola (posición ${data.position} de ${data.queue_length})`;
+        if (data.eta_seconds) {
+            text += `, tiempo estimado ~${Math.ceil(data.eta_seconds)} s`;
+        }
+        showQueueStatus(text + '.');
+    });
+
+    socket.on('backpressure', (data) => {
+        console.log('Backpressure:', data);
+        hideTypingIndicator();
+        // The rejected question was not stored
+        unsavedMessages.shift();
+        addMessage(data.message, false);
+        pauseSending(data.retry_after);
+    });
+
     socket.on('receive_message', (data) => {
         console.log('Received message:', data);
         hideTypingIndicator();
-        addMessage(data.message, data.is_user, data.message_id);
+        if (streamingDiv) {
+            // Replace the partial text with the final answer (with citations)
+            streamingDiv.remove();
+            streamingDiv = null;
+            streamingText = '';
+        }
+        // Every question gets one answer, in order
+        setMessageId(unsavedMessages.shift(), data.user_message_id);
+        if (data.after) {
+            historyAfter = data.after;
+        }
+        addMessage(data.message, data.is_user, data.message_id, null, undefined, false, data.html);
+    });
+
+    function showUploadResult(jobId, status) {
+        if (status === 'completed') {
+            pendingUploads.delete(jobId);
+            addMessage("PDF uploaded successfully. You can now ask questions about its content.", false);
+        } else if (status === 'failed') {
+            pendingUploads.delete(jobId);
+            addMessage('An error occurred while processing the PDF. Please try again.', false);
+        }
+    }
+
+    socket.on('upload_progress', (data) => {
+        console.log('Upload progress:', data);
+        // The job can finish before the /upload response arrives
+        uploadStatuses.set(data.job_id, data.status);
+        if (pendingUploads.has(data.job_id)) {
+            showUploadResult(data.job_id, data.status);
+        }
     });
 
     socket.on('conversation_reset', () => {
         console.log('Conversation reset');
         chatMessages.innerHTML = '';
+        unsavedMessages.length = 0;
+        // A reply in progress was dropped by the server
+        hideTypingIndicator();
+        streamingDiv = null;
+        streamingText = '';
         addMessage("¡Hola! Soy tu compañero de estudios para los cursos de Mazda en Lapzo. Estoy aquí para ayudarte a resolver cualquier duda sobre el contenido de los cursos de manera rápida y clara. Si alguna pregunta es muy compleja, la escalaré a un instructor o administrador. ¡Comencemos!", false);
     });
 
@@ -122,43 +262,178 @@ document.addEventListener('DOMContentLoaded', () => {
         socket.emit('reset_conversation');
     });
 
+    // Chunked, resumable uploads: the server keeps every byte it received,
+    // so after a failure the upload continues from the offset it reports
+    const UPLOAD_MAX_RETRIES = 5;
+
+    async function uploadRequest(url, options = {}) {
+        const response = await fetch(url, options);
+        const data = await response.json().catch(() => ({}));
+        if (!response.ok) {
+            const error = new Error(data.error || `HTTP ${response.status}`);
+            error.status = response.status;
+            error.retryAfter = Number(response.headers.get('Retry-After')) || 0;
+            throw error;
+        }
+        return data;
+    }
+
+    function uploadKey(file) {
+        return `upload:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    async function startUploadSession(file) {
+        // Pick up an upload of the same file interrupted earlier, e.g. by
+        // closing the page
+        const savedId = localStorage.getItem(uploadKey(file));
+        if (savedId) {
+            try {
+                return await uploadRequest(`/upload/sessions/${savedId}`);
+            } catch (error) {
+                localStorage.removeItem(uploadKey(file));
+            }
+        }
+        const session = await uploadRequest('/upload/sessions', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({filename: file.name, size: file.size}),
+        });
+        localStorage.setItem(uploadKey(file), session.upload_id);
+        return session;
+    }
+
+    function isRetryable(error) {
+        // Network errors, conflicts on the offset, rate limits and server errors
+        return !error.status || error.status === 409 || error.status === 429 ||
+            error.status >= 500;
+    }
+
+    async function uploadFile(file) {
+        let session = await startUploadSession(file);
+        const sessionUrl = `/upload/sessions/${session.upload_id}`;
+        let retries = 0;
+        let resync = false;
+        while (resync || session.offset < file.size) {
+            try {
+                if (resync) {
+                    session = await uploadRequest(sessionUrl);
+                    resync = false;
+                    continue;
+                }
+                const end = Math.min(session.offset + session.chunk_size, file.size);
+                session = await uploadRequest(sessionUrl, {
+                    method: 'PUT',
+                    headers: {'Content-Range': `bytes ${session.offset}-${end - 1}/${file.size}`},
+                    body: file.slice(session.offset, end),
+                });
+                retries = 0;
+                showQueueStatus(`Uploading ${file.name}... ${Math.floor(100 * session.offset / file.size)}%`);
+            } catch (error) {
+                if (!isRetryable(error) || retries >= UPLOAD_MAX_RETRIES) {
+                    throw error;
+                }
+                retries += 1;
+                const delay = Math.max(error.retryAfter * 1000, 500 * 2 ** retries);
+                console.log(`Upload chunk failed (${error.message}), retrying in ${delay} ms`);
+                await new Promise(resolve => setTimeout(resolve, delay));
+                resync = true;
+            }
+        }
+        const result = await uploadRequest(`${sessionUrl}/finalize`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: '{}',
+        });
+        localStorage.removeItem(uploadKey(file));
+        return result;
+    }
+
     fileInput.addEventListener('change', (e) => {
         const file = e.target.files[0];
         if (file) {
             console.log('File selected:', file.name);
-            const formData = new FormData();
-            formData.append('file', file);
             showTypingIndicator();
-            fetch('/upload', {
-                method: 'POST',
-                body: formData,
-            })
-            .then(response => response.json())
+            uploadFile(file)
             .then(data => {
                 console.log('File upload response:', data);
                 hideTypingIndicator();
-                addMessage(`File uploaded: ${data.file_url}`, true);
-                if (file.name.toLowerCase().endsWith('.pdf')) {
-                    addMessage("PDF uploaded successfully. You can now ask questions about its content.", false);
+                addMessage(`File uploaded: ${data.file_url}`, true, data.message_id);
+                if (data.job_id) {
+                    // Indexing continues in the background; see upload_progress
+                    pendingUploads.add(data.job_id);
+                    addMessage("Processing PDF... I'll let you know when it's ready.", false);
+                    showUploadResult(data.job_id, uploadStatuses.get(data.job_id));
                 }
             })
             .catch(error => {
                 console.error('Error uploading file:', error);
                 hideTypingIndicator();
-                addMessage('An error occurred while uploading the file. Please try again.', false);
+                addMessage(error.status ? error.message : 'An error occurred while uploading the file. Please try again.', false);
+            })
+            .finally(() => {
+                fileInput.value = '';
             });
         }
     });
 
-    fetch('/history')
-        .then(response => response.json())
-        .then(history => {
-            history.forEach(msg => addMessage(msg.content, msg.is_user, msg.message_id, msg.feedback, msg.thereIsFeedback));
+    // Cursors returned by /history: 'before' pages back, 'after' is the newest
+    // message already rendered (also advanced by each answer received live)
+    let historyBefore = null;
+    let historyAfter = null;
+    let loadingHistory = false;
+
+    function loadHistory(params = {}) {
+        const query = new URLSearchParams(params).toString();
+        return fetch(`/history${query ? `?${query}` : ''}`)
+            .then(response => response.json());
+    }
+
+    loadHistory()
+        .then(page => {
+            addHistory(page.messages);
+            historyBefore = page.before;
+            historyAfter = page.after;
         })
         .catch(error => {
             console.error('Error loading chat history:', error);
         });
 
+    chatMessages.addEventListener('scroll', () => {
+        if (chatMessages.scrollTop > 0 || !historyBefore || loadingHistory) {
+            return;
+        }
+        loadingHistory = true;
+        const previousHeight = chatMessages.scrollHeight;
+        loadHistory({ before: historyBefore })
+            .then(page => {
+                addHistory(page.messages, true);
+                historyBefore = page.before;
+                // Keep the viewport on the message the user was reading
+                chatMessages.scrollTop = chatMessages.scrollHeight - previousHeight;
+            })
+            .catch(error => {
+                console.error('Error loading older messages:', error);
+            })
+            .finally(() => {
+                loadingHistory = false;
+            });
+    });
+
+    // After a reconnect, only fetch what arrived while we were away
+    socket.on('connect', () => {
+        if (!historyAfter) {
+            return;
+        }
+        loadHistory({ after: historyAfter })
+            .then(page => {
+                addHistory(page.messages);
+                historyAfter = page.after;
+            })
+            .catch(error => {
+                console.error('Error loading new messages:', error);
+            });
+    });
+
     document.addEventListener('click', function(e) {
         if (e.target.closest('.feedback-btn')) {
             const button = e.target.closest('.feedback-btn');
@@ -0,0 +1,167 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import abort, current_app, request, send_file
+
+from structured_log import log_event
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él sólo hay variantes gzip
+    brotli = None
+
+# Los archivos de static/ se sirven con el hash de su contenido en la URL
+# (css/style.3f2a9c1b7d4e.css) y se cachean como inmutables: un cambio en el
+# archivo cambia la URL. Al arrancar se copian al directorio de build con ese
+# nombre, junto con sus variantes .gz/.br; lo ya construido se reutiliza, así
+# que varios workers o reinicios no repiten el trabajo y las URLs de una
+# versión anterior siguen funcionando durante un despliegue.
+STATIC_BUILD_DIR = os.environ.get("STATIC_BUILD_DIR", "static_build")
+ASSET_MAX_AGE = int(os.environ.get("ASSET_MAX_AGE", 365 * 24 * 3600))
+ASSET_HASH_LENGTH = 12
+COMPRESSIBLE_EXTENSIONS = {".js", ".css", ".svg", ".json", ".txt", ".html",
+                           ".map"}
+# Por debajo de este tamaño comprimir no compensa
+COMPRESS_MIN_SIZE = 1024
+# Preferencia de codificación cuando el cliente acepta varias
+ENCODINGS = ("br", "gzip")
+
+
+class _Asset:
+    __slots__ = ("hashed_name", "digest", "mimetype", "variants")
+
+    def __init__(self, hashed_name, digest, mimetype):
+        self.hashed_name = hashed_name
+        self.digest = digest
+        self.mimetype = mimetype
+        # codificación ("" = sin comprimir) -> ruta en el directorio de build
+        self.variants = {}
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class StaticAssets:
+
+    def __init__(self, build_dir=STATIC_BUILD_DIR, max_age=ASSET_MAX_AGE):
+        self.build_dir = build_dir
+        self.max_age = max_age
+        self.static_folder = None
+        self.exclude = ()
+        # nombre original -> _Asset, y nombre con hash -> _Asset
+        self._assets = {}
+        self._by_hashed_name = {}
+
+    def init_app(self, app, exclude=()):
+        # exclude: subcarpetas de static/ que no son assets (p. ej. uploads)
+        self.static_folder = app.static_folder
+        self.build_dir = os.path.abspath(self.build_dir)
+        self.exclude = tuple(exclude)
+        self.build()
+        app.url_defaults(self._url_defaults)
+        app.view_functions["static"] = self.serve
+
+    def _excluded(self, name):
+        return name.split("/", 1)[0] in self.exclude
+
+    def build(self):
+        assets = {}
+        built = 0
+        for root, dirs, files in os.walk(self.static_folder):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.static_folder).replace(os.sep, "/")
+                if self._excluded(name) or filename.startswith("."):
+                    continue
+                asset, wrote = self._build_asset(name, path)
+                assets[name] = asset
+                built += wrote
+        self._assets = assets
+        self._by_hashed_name = {a.hashed_name: a for a in assets.values()}
+        log_event("static_assets_built", sample_rate=1, assets=len(assets),
+                  variants_built=built, build_dir=self.build_dir)
+
+    def _build_asset(self, name, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:ASSET_HASH_LENGTH]
+        stem, extension = os.path.splitext(name)
+        asset = _Asset(f"{stem}.{digest}{extension}", digest,
+                       mimetypes.guess_type(name)[0] or "application/octet-stream")
+
+        target = os.path.join(self.build_dir, asset.hashed_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        variants = {"": (target, lambda: data)}
+        if extension in COMPRESSIBLE_EXTENSIONS and len(data) >= COMPRESS_MIN_SIZE:
+            variants["gzip"] = (f"{target}.gz",
+                                lambda: gzip.compress(data, 9, mtime=0))
+            if brotli is not None:
+                variants["br"] = (f"{target}.br",
+                                  lambda: brotli.compress(data, quality=11))
+
+        wrote = 0
+        for encoding, (variant_path, encode) in variants.items():
+            if not os.path.exists(variant_path):
+                encoded = encode()
+                # Una variante que apenas reduce el tamaño no se sirve
+                if encoding and len(encoded) > len(data) * 0.9:
+                    continue
+                _write_atomic(variant_path, encoded)
+                wrote += 1
+            asset.variants[encoding] = variant_path
+        return asset, wrote
+
+    def url(self, filename):
+        asset = self._assets.get(filename)
+        return asset.hashed_name if asset is not None else None
+
+    def _url_defaults(self, endpoint, values):
+        # url_for('static', filename='css/style.css') genera la URL con hash
+        if endpoint == "static":
+            hashed_name = self.url(values.get("filename"))
+            if hashed_name is not None:
+                values["filename"] = hashed_name
+
+    def _negotiate(self, asset):
+        for encoding in ENCODINGS:
+            if encoding in asset.variants and \
+                    request.accept_encodings[encoding] > 0:
+                return encoding
+        return ""
+
+    def serve(self, filename):
+        asset = self._by_hashed_name.get(filename)
+        if asset is None:
+            if self._excluded(filename):
+                abort(404)
+            # URL sin hash (p. ej. un enlace antiguo): sin caché larga
+            return current_app.send_static_file(filename)
+
+        encoding = self._negotiate(asset)
+        etag = f"{asset.digest}-{encoding}" if encoding else asset.digest
+        response = send_file(asset.variants[encoding], mimetype=asset.mimetype,
+                             etag=etag, max_age=self.max_age, conditional=True)
+        if encoding:
+            response.content_encoding = encoding
+        response.vary.add("Accept-Encoding")
+        response.cache_control.immutable = True
+        return response
+
+    def stats(self):
+        return {
+            "build_dir": self.build_dir,
+            "brotli": brotli is not None,
+            "assets": {name: {"url": asset.hashed_name,
+                              "encodings": sorted(e or "identity"
+                                                  for e in asset.variants)}
+                       for name, asset in sorted(self._assets.items())},
+        }
+
+
+static_assets = StaticAssets()
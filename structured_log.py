@@ -0,0 +1,19 @@
+import json
+import os
+import random
+import time
+
+# Logs estructurados (una línea JSON por evento) con muestreo: los eventos
+# informativos se escriben con probabilidad LOG_SAMPLE_RATE para no saturar
+# la salida en producción; los errores y advertencias siempre se escriben.
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.1))
+_ALWAYS = {"warning", "error"}
+
+
+def log_event(event, level="info", sample_rate=None, **fields):
+    rate = LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+    if level not in _ALWAYS and random.random() >= rate:
+        return
+    record = {"ts": round(time.time(), 3), "level": level, "event": event}
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
@@ -0,0 +1,84 @@
+"""Shared fixtures: the app runs offline against the fake Assistants API
+(benchmarks/fake_openai.py) with SQLite and every file in a temp directory.
+
+    python -m pytest -q
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import fake_openai  # noqa: E402
+
+WORKDIR = tempfile.mkdtemp(prefix='chatbot-tests-')
+FAKE_API = fake_openai.FakeAssistants(run_latency=0.05, token_delay=0.0,
+                                      reply_tokens=5, seed=1)
+_server, _base_url = fake_openai.start_server(FAKE_API)
+
+# The app reads its configuration at import time
+os.environ.update({
+    'OPENAI_BASE_URL': _base_url,
+    'OPENAI_API_KEY': 'fake',
+    'DATABASE_URL': f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+    'SOCKETIO_ASYNC_MODE': 'threading',
+    'ASSISTANT_MANIFEST': os.path.join(WORKDIR, 'assistant_manifest.json'),
+    'LEXICAL_INDEX_PATH': os.path.join(WORKDIR, 'lexical_index.npz'),
+    'STATIC_BUILD_DIR': os.path.join(WORKDIR, 'static_build'),
+    'LOG_SAMPLE_RATE': '0',
+})
+
+_usernames = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def chat_app():
+    os.chdir(ROOT)
+    import app as chat_app
+    from models import db
+
+    chat_app.app.config['TESTING'] = True
+    chat_app.app.config['UPLOAD_FOLDER'] = os.path.join(WORKDIR, 'uploads')
+    os.makedirs(chat_app.app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with chat_app.app.app_context():
+        db.create_all()
+    return chat_app
+
+
+@pytest.fixture
+def fake_api():
+    # The fake Assistants API; settings changed by a test are restored
+    saved = dict(vars(FAKE_API))
+    yield FAKE_API
+    for name in ('run_latency', 'token_delay', 'reply_tokens',
+                 'failure_rate', 'error_rate'):
+        setattr(FAKE_API, name, saved[name])
+
+
+@pytest.fixture
+def app_context(chat_app):
+    with chat_app.app.app_context():
+        yield chat_app.app
+
+
+@pytest.fixture
+def client(chat_app):
+    # A test client logged in as a new user
+    client = chat_app.app.test_client()
+    username = f'learner{next(_usernames)}'
+    client.post('/register', data={'username': username,
+                                   'email': f'{username}@example.com',
+                                   'password': 'secret'})
+    response = client.post('/login', data={'username': username,
+                                           'password': 'secret'})
+    assert response.status_code == 302
+    client.username = username
+    with chat_app.app.app_context():
+        client.user_id = chat_app.User.query.filter_by(
+            username=username).first().id
+    return client
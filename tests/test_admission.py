@@ -0,0 +1,107 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+def controller(**options):
+    settings = dict(user_rate=100, user_burst=100, global_rate=20,
+                    global_burst=1, max_queue=10, max_wait=5)
+    settings.update(options)
+    return AdmissionController(**settings)
+
+
+def wait_for_queue(gate, length):
+    deadline = time.monotonic() + 5
+    while gate.queue_length() != length:
+        assert time.monotonic() < deadline, 'queue never reached its length'
+        time.sleep(0.005)
+
+
+def test_token_bucket_refills_at_its_rate(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(admission, 'time',
+                        SimpleNamespace(monotonic=lambda: clock.now))
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+    assert bucket.wait_time() == pytest.approx(0.5)
+
+    clock.now += 0.5
+    assert bucket.take()
+    assert not bucket.take()
+    # Never refills beyond its capacity
+    clock.now += 60
+    assert [bucket.take() for _ in range(4)] == [True, True, True, False]
+
+
+def test_user_over_their_rate_is_rejected_without_a_global_token():
+    gate = controller(user_rate=1 / 60, user_burst=2, global_burst=10)
+    gate.admit(1)
+    gate.admit(1)
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.admit(1)
+    assert rejected.value.reason == 'user_rate'
+    assert rejected.value.retry_after > 0
+    # Other users are not affected
+    assert gate.admit(2) == 0.0
+    assert gate.stats()['global_tokens'] < 8
+
+
+def test_queued_requests_are_admitted_in_order():
+    gate = controller(global_rate=5)
+    gate.admit(0)
+    admitted = []
+    positions = {}
+    threads = []
+    for user_id in range(1, 5):
+        def run(user_id=user_id):
+            gate.admit(user_id, on_position=lambda position, length, eta:
+                       positions.setdefault(user_id, position))
+            admitted.append(user_id)
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        # The next request arrives once this one is queued (or admitted)
+        deadline = time.monotonic() + 5
+        while user_id not in positions and user_id not in admitted:
+            assert time.monotonic() < deadline, 'request never queued'
+            time.sleep(0.005)
+    for thread in threads:
+        thread.join(5)
+
+    assert admitted == [1, 2, 3, 4]
+    # Each request joined the queue behind the ones still waiting
+    assert all(positions[user_id] <= user_id for user_id in positions)
+    assert gate.queue_length() == 0
+
+
+def test_full_queue_rejects_and_refunds_the_user_token():
+    gate = controller(global_rate=1, max_queue=1, user_rate=1 / 60,
+                      user_burst=1)
+    gate.admit(0)
+    waiting = threading.Thread(target=gate.admit, args=(1,))
+    waiting.start()
+    wait_for_queue(gate, 1)
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.admit(2)
+    assert rejected.value.reason == 'queue_full'
+    assert rejected.value.retry_after > 0
+    # The rejection did not spend the user's only token
+    assert gate._users[2].tokens == 1
+    waiting.join(5)
+
+
+def test_request_waiting_too_long_is_rejected_and_leaves_the_queue():
+    gate = controller(global_rate=0.01, max_wait=0.1)
+    gate.admit(0)
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as rejected:
+        gate.admit(1)
+    assert rejected.value.reason == 'timeout'
+    assert 0.1 <= time.monotonic() - started < 1
+    assert gate.queue_length() == 0
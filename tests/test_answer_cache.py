@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from answer_cache import AnswerCache, normalize_question
+from models import db, CachedAnswer
+
+QUESTION = '¿Qué es una función de orden superior?'
+EMPTY = {'messages': [], 'summary': None}
+HISTORY = {'messages': [{'is_user': True, 'content': 'Hablemos de Python'}],
+           'summary': None}
+
+
+@pytest.fixture
+def cache(app_context):
+    yield AnswerCache(max_size=2, ttl=60, persist=False)
+
+
+@pytest.fixture
+def persisted(app_context):
+    CachedAnswer.query.delete()
+    db.session.commit()
+    yield AnswerCache(max_size=2, ttl=60, persist=True)
+    CachedAnswer.query.delete()
+    db.session.commit()
+
+
+def test_normalize_question_ignores_case_accents_and_punctuation():
+    assert normalize_question('  ¿QUÉ es una   Función?') == \
+        'que es una funcion'
+
+
+def test_hit_for_the_same_question_and_version(cache):
+    cache.put(QUESTION, 'v1', 'respuesta', context=EMPTY)
+    assert cache.get('que es una funcion de orden superior', 'v1',
+                     'send_message') == 'respuesta'
+    # A new knowledge base version changes the key
+    assert cache.get(QUESTION, 'v2', 'send_message') is None
+    assert cache.stats()['endpoints']['send_message'] == {
+        'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_turns_with_context_are_not_shared_between_users(cache):
+    # A learner with history gets an answer about their conversation
+    cache.put(QUESTION, 'v1', 'respuesta sobre Python', context=HISTORY)
+    assert cache.get(QUESTION, 'v1', 'send_message', context=EMPTY) is None
+
+    # ...and never reads an answer cached for a fresh conversation
+    cache.put(QUESTION, 'v1', 'respuesta general', context=EMPTY)
+    assert cache.get(QUESTION, 'v1', 'send_message',
+                     context=HISTORY) is None
+    summary = {'messages': [], 'summary': 'Hablamos de Python'}
+    assert cache.get(QUESTION, 'v1', 'send_message',
+                     context=summary) is None
+
+
+def test_short_questions_and_unknown_versions_are_not_cached(cache):
+    cache.put('¿y eso?', 'v1', 'respuesta')
+    cache.put(QUESTION, None, 'respuesta')
+    assert cache.get('¿y eso?', 'v1', 'send_message') is None
+    assert cache.get(QUESTION, None, 'send_message') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_least_recently_used_answer_is_evicted(cache):
+    questions = [f'pregunta número {n} del curso' for n in range(3)]
+    cache.put(questions[0], 'v1', 'cero')
+    cache.put(questions[1], 'v1', 'uno')
+    cache.get(questions[0], 'v1', 'send_message')
+    cache.put(questions[2], 'v1', 'dos')
+    assert cache.get(questions[1], 'v1', 'send_message') is None
+    assert cache.get(questions[0], 'v1', 'send_message') == 'cero'
+
+
+def test_persisted_answer_survives_a_restart(persisted):
+    persisted.put(QUESTION, 'v1', 'respuesta')
+    restarted = AnswerCache(ttl=60, persist=True)
+    assert restarted.get(QUESTION, 'v1', 'send_message') == 'respuesta'
+
+
+def test_expired_persisted_answer_is_not_served(persisted):
+    persisted.put(QUESTION, 'v1', 'respuesta')
+    CachedAnswer.query.update(
+        {'created_at': datetime.utcnow() - timedelta(seconds=120)})
+    db.session.commit()
+    restarted = AnswerCache(ttl=60, persist=True)
+    assert restarted.get(QUESTION, 'v1', 'send_message') is None
+
+
+def test_prune_deletes_stale_versions_and_expired_rows(persisted):
+    persisted.put(QUESTION, 'v1', 'antigua')
+    persisted.put('pregunta caducada sobre el curso', 'v2', 'caducada')
+    persisted.put('pregunta vigente sobre el curso', 'v2', 'vigente')
+    CachedAnswer.query.filter_by(answer='caducada').update(
+        {'created_at': datetime.utcnow() - timedelta(seconds=120)})
+    db.session.commit()
+
+    assert persisted.prune('v2') == 2
+    assert [row.answer for row in CachedAnswer.query.all()] == ['vigente']
+
+
+def test_put_prunes_at_most_once_per_interval(persisted):
+    persisted.put(QUESTION, 'v1', 'antigua')
+    persisted.put('pregunta vigente sobre el curso', 'v2', 'vigente')
+    # The first put above already claimed this interval
+    assert CachedAnswer.query.count() == 2
+
+    persisted._next_prune = 0.0
+    persisted.put('otra pregunta vigente del curso', 'v2', 'otra')
+    assert sorted(row.answer for row in CachedAnswer.query.all()) == \
+        ['otra', 'vigente']
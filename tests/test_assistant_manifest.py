@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+import assistant_manifest
+from models import db, AssistantManifest
+
+
+@pytest.fixture
+def manifest(chat_app):
+    # Restores whatever the other tests stored
+    saved = assistant_manifest.load_manifest()
+    yield assistant_manifest
+    assistant_manifest.save_manifest(saved)
+
+
+def test_manifest_round_trips_through_the_database(manifest):
+    data = {'vector_store_id': 'vs_shared', 'files': {},
+            'uploads': {'a' * 64: 'file_1'}}
+    manifest.save_manifest(data)
+    assert manifest.load_manifest() == data
+    assert manifest.current_knowledge_base_version() == \
+        manifest.knowledge_base_version(data)
+
+
+def test_version_saved_by_another_worker_is_seen(app_context, manifest,
+                                                 monkeypatch):
+    manifest.save_manifest({'vector_store_id': 'vs_shared', 'files': {}})
+    # Another worker (its own process, no shared state here) adds an upload
+    changed = {'vector_store_id': 'vs_shared', 'files': {},
+               'uploads': {'b' * 64: 'file_2'}}
+    db.session.merge(AssistantManifest(
+        id=1, content=json.dumps(changed),
+        kb_version=manifest.knowledge_base_version(changed)))
+    db.session.commit()
+    monkeypatch.setattr(manifest, 'KB_VERSION_TTL', 0)
+    assert manifest.current_knowledge_base_version() == \
+        manifest.knowledge_base_version(changed)
+
+
+def test_legacy_manifest_file_is_imported(app_context, manifest, tmp_path,
+                                          monkeypatch):
+    legacy = {'vector_store_id': 'vs_legacy', 'files': {}}
+    path = tmp_path / 'assistant_manifest.json'
+    path.write_text(json.dumps(legacy))
+    monkeypatch.setattr(manifest, 'MANIFEST_PATH', str(path))
+    db.session.query(AssistantManifest).delete()
+    db.session.commit()
+    assert manifest.load_manifest() == legacy
@@ -0,0 +1,27 @@
+import pytest
+
+DEBUG_ENDPOINTS = ['/debug_admission', '/debug_uploads', '/debug_message_store',
+                   '/debug_static_assets', '/debug_workers',
+                   '/debug_openai_transport', '/debug_lexical_index',
+                   '/debug_users', '/debug_user_cache', '/debug_answer_cache',
+                   '/debug_auth']
+
+
+@pytest.mark.parametrize('path', DEBUG_ENDPOINTS)
+def test_debug_endpoints_need_a_login(chat_app, path):
+    response = chat_app.app.test_client().get(path)
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+
+
+@pytest.mark.parametrize('path', DEBUG_ENDPOINTS)
+def test_debug_endpoints_are_hidden_from_learners(client, path):
+    assert client.get(path).status_code == 404
+
+
+def test_message_store_stats_for_operators(chat_app, client, monkeypatch):
+    monkeypatch.setitem(chat_app.app.config, 'ADMIN_USERNAMES',
+                        {client.username})
+    stats = client.get('/debug_message_store').get_json()
+    assert {'hot_rows_estimate', 'archived_rows_estimate', 'bodies_estimate',
+            'users_pending_purge'} <= set(stats)
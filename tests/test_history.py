@@ -0,0 +1,114 @@
+import base64
+import time
+from datetime import datetime
+
+import pytest
+
+
+def send(chat_app, client, text):
+    # Sends a message over Socket.IO and waits for the answer
+    socket = chat_app.socketio.test_client(chat_app.app,
+                                           flask_test_client=client)
+    socket.emit('send_message', {'message': text})
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        for event in socket.get_received():
+            if event['name'] == 'receive_message':
+                socket.disconnect()
+                return event['args'][0]
+        time.sleep(0.02)
+    raise AssertionError('no answer received')
+
+
+def test_cursor_round_trip(chat_app):
+    class Message:
+        timestamp = datetime(2026, 10, 18, 12, 30, 15, 123456)
+        id = 42
+
+    cursor = chat_app.encode_cursor(Message)
+    assert chat_app.decode_cursor(cursor) == (Message.timestamp, 42)
+
+
+@pytest.mark.parametrize('params', [
+    {'after': 'not base64!'},
+    {'before': base64.urlsafe_b64encode(b'no separator').decode()},
+    {'before': base64.urlsafe_b64encode(b'2026-10-18T12:00:00|abc').decode()},
+    {'after': base64.urlsafe_b64encode(b'\xff\xfe|1').decode()},
+    {'limit': 'many'},
+    {'limit': '0'},
+])
+def test_history_rejects_bad_pagination(client, params):
+    response = client.get('/history', query_string=params)
+    assert response.status_code == 400
+
+
+def test_history_pages_by_cursor(chat_app, client):
+    send(chat_app, client, 'primera pregunta')
+    first = client.get('/history').get_json()
+    assert [m['is_user'] for m in first['messages']] == [True, False]
+
+    send(chat_app, client, 'segunda pregunta')
+    newer = client.get('/history', query_string={
+        'after': first['after']}).get_json()
+    assert [m['content'] for m in newer['messages']][0] == 'segunda pregunta'
+    assert len(newer['messages']) == 2
+
+    page = client.get('/history', query_string={'limit': 1}).get_json()
+    assert page['has_more']
+    older = client.get('/history', query_string={
+        'before': page['before'], 'limit': 1}).get_json()
+    assert older['messages'][0]['content'] == 'segunda pregunta'
+
+
+def test_live_answer_carries_ids_and_cursor(chat_app, client):
+    answer = send(chat_app, client, 'pregunta en vivo')
+    history = client.get('/history').get_json()
+    user_message, bot_message = history['messages']
+    assert answer['user_message_id'] == user_message['message_id']
+    assert answer['message_id'] == bot_message['message_id']
+    # Nothing is newer than the cursor the answer carried
+    newer = client.get('/history', query_string={
+        'after': answer['after']}).get_json()
+    assert newer['messages'] == []
+
+
+def test_reset_hides_history_for_the_cached_user(chat_app, client):
+    send(chat_app, client, 'pregunta antes del reinicio')
+    # The user (and its reset watermark) is now in the user cache
+    assert len(client.get('/history').get_json()['messages']) == 2
+
+    socket = chat_app.socketio.test_client(chat_app.app,
+                                           flask_test_client=client)
+    socket.emit('reset_conversation')
+    assert any(event['name'] == 'conversation_reset'
+               for event in socket.get_received())
+    socket.disconnect()
+    assert client.get('/history').get_json()['messages'] == []
+
+
+def test_reset_does_not_wait_for_a_reply_in_progress(chat_app, client,
+                                                     fake_api):
+    fake_api.run_latency = 3.0
+    socket = chat_app.socketio.test_client(chat_app.app,
+                                           flask_test_client=client)
+    socket.emit('send_message', {'message': 'pregunta larga'})
+    # Wait until the run exists, i.e. the thread lock is held
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline and not any(
+            run['status'] in ('queued', 'in_progress')
+            for run in fake_api.runs.values()):
+        time.sleep(0.02)
+
+    started = time.monotonic()
+    socket.emit('reset_conversation')
+    assert time.monotonic() - started < 1
+    assert any(event['name'] == 'conversation_reset'
+               for event in socket.get_received())
+
+    # The run is cancelled and its turn is neither sent nor stored
+    time.sleep(fake_api.run_latency + 0.5)
+    assert not any(event['name'] in ('receive_message', 'receive_message_chunk')
+                   for event in socket.get_received())
+    socket.disconnect()
+    assert client.get('/history').get_json()['messages'] == []
+    assert any(run['status'] == 'cancelled' for run in fake_api.runs.values())
@@ -0,0 +1,42 @@
+import io
+import os
+import time
+
+import chatbot
+from conftest import FAKE_API, ROOT
+
+
+def uploaded_pdf():
+    # A course PDF with different bytes, so it is not already ingested
+    with open(os.path.join(ROOT, 'pdf-test.pdf'), 'rb') as f:
+        return f.read() + b'\n% copia de prueba\n'
+
+
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/upload/{job_id}').get_json()
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError('ingestion did not finish')
+
+
+def test_uploads_are_indexed_and_cited_by_original_name(client):
+    response = client.post('/upload', data={
+        'file': (io.BytesIO(uploaded_pdf()), 'Reconocimiento facial.pdf'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()['job_id'])
+    assert job['status'] == 'completed'
+    assert job['filename'] == 'Reconocimiento facial.pdf'
+
+    # Local search results
+    passages = client.get('/search', query_string={
+        'q': 'reconocimiento facial'}).get_json()['passages']
+    assert 'Reconocimiento facial.pdf' in {p['file'] for p in passages}
+
+    # Citations resolve to the name the file was sent to OpenAI with
+    assert FAKE_API.files[job['file_id']]['filename'] == \
+        'Reconocimiento facial.pdf'
+    assert chatbot.file_names.get(job['file_id']) == 'Reconocimiento facial.pdf'
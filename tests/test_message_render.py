@@ -0,0 +1,73 @@
+import re
+
+import pytest
+
+from message_render import render_message
+
+
+def tags(html):
+    return set(re.findall(r'<\s*/?\s*([a-zA-Z0-9]+)', html))
+
+
+ALLOWED_TAGS = {'p', 'br', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'ul', 'ol',
+                'li', 'blockquote', 'pre', 'code', 'strong', 'em', 'a', 'sup'}
+
+
+@pytest.mark.parametrize('content', [
+    '<script>alert(1)</script>',
+    '<img src=x onerror=alert(1)>',
+    '**<b onmouseover=alert(1)>negrita</b>**',
+    '# <iframe src="//evil"></iframe>',
+    '- <svg onload=alert(1)>',
+    '> <style>body{}</style>',
+    '`<script>` y <script>',
+    '```html\n<script>alert(1)</script>\n```',
+    '[x](http://a.com/"onmouseover="alert(1))',
+    'Texto [1]\n\n[1] <script>alert(1)</script>',
+])
+def test_markup_in_messages_is_escaped(content):
+    html = render_message(content)
+    assert tags(html) <= ALLOWED_TAGS
+    assert not re.search(r'<[^>]*\son\w+\s*=', html)
+
+
+@pytest.mark.parametrize('url', [
+    'javascript:alert(1)',
+    'JaVaScRiPt:alert(1)',
+    'java\tscript:alert(1)',
+    ' javascript:alert(1)',
+    'data:text/html;base64,PHNjcmlwdD4=',
+    'vbscript:msgbox(1)',
+    '//evil.example.com',
+    '/\\evil.example.com',
+])
+def test_unsafe_link_targets_are_dropped(url):
+    html = render_message(f'[haz clic]({url})')
+    assert '<a' not in html
+    assert 'haz clic' in html
+
+
+@pytest.mark.parametrize('url', [
+    'https://example.com/a?b=1&c=2',
+    'mailto:soporte@example.com',
+    '/uploads/manual.pdf',
+])
+def test_safe_links_are_kept(url):
+    html = render_message(f'[enlace]({url})')
+    assert '<a href="' in html
+    assert 'rel="noopener noreferrer"' in html
+
+
+def test_attribute_values_are_quoted_safely():
+    html = render_message('```x" onmouseover="alert(1)\ncodigo\n```')
+    assert not re.search(r'<[^>]*\son\w+\s*=', html)
+    html = render_message('Ver [1]\n\n[1] "manual" <b>')
+    assert 'title="&#34;manual&#34; &lt;b&gt;"' in html
+
+
+def test_formatting_still_renders():
+    html = render_message('# Título\n\nTexto con **negrita**, *cursiva* y `código`.')
+    assert '<h1>Título</h1>' in html
+    assert '<strong>negrita</strong>' in html
+    assert '<em>cursiva</em>' in html
+    assert '<code>código</code>' in html
@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+
+import offload
+
+
+def test_runs_inline_without_eventlet():
+    assert not offload.green()
+    assert offload.run_blocking(sum, [1, 2, 3]) == 6
+
+
+def test_uses_the_thread_pool_when_monkey_patched(monkeypatch):
+    calls = []
+
+    def execute(func, *args, **kwargs):
+        calls.append(func)
+        return func(*args, **kwargs)
+
+    monkeypatch.setattr(offload, 'patcher', SimpleNamespace(
+        is_monkey_patched=lambda module: module == 'thread'))
+    monkeypatch.setattr(offload, 'tpool', SimpleNamespace(execute=execute))
+    assert offload.run_blocking(max, 3, 7) == 7
+    assert calls == [max]
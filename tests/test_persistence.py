@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import pytest
+
+import persistence
+from message_store import new_message
+from models import db, ChatMessage, ChatMessageArchive
+from persistence import WriteBehindBuffer, save_turn
+
+
+@pytest.fixture
+def buffer(chat_app):
+    # Flushed by hand; init_app would start the background thread
+    buffer = WriteBehindBuffer()
+    buffer.app = chat_app.app
+    return buffer
+
+
+def messages(user_id):
+    return ChatMessage.query.filter_by(user_id=user_id).order_by(
+        ChatMessage.id).all()
+
+
+def test_save_turn_commits_both_messages(app_context, client):
+    user_message, bot_message = save_turn(client.user_id, 'pregunta',
+                                          'respuesta')
+    assert user_message.id < bot_message.id
+    assert [(m.content, m.is_user) for m in messages(client.user_id)] == \
+        [('pregunta', True), ('respuesta', False)]
+
+
+def test_flush_writes_messages_and_feedback(app_context, client, buffer):
+    message = new_message(client.user_id, 'respuesta', is_user=False)
+    db.session.add(message)
+    db.session.commit()
+
+    buffer.add_message(client.user_id, 'File uploaded: /uploads/a.pdf')
+    buffer.add_feedback(client.user_id, message.id, True)
+    # The last vote for a message wins
+    buffer.add_feedback(client.user_id, message.id, False)
+    assert buffer.pending() == 2
+    assert buffer.flush() == 2
+    assert buffer.pending() == 0
+
+    db.session.expire_all()
+    rows = messages(client.user_id)
+    assert rows[0].feedback is False and rows[0].there_is_feedback
+    assert rows[1].content == 'File uploaded: /uploads/a.pdf'
+
+
+def test_feedback_reaches_archived_messages(app_context, client, buffer):
+    db.session.add(ChatMessageArchive(id=10 ** 6 + client.user_id,
+                                      content='antigua', is_user=False,
+                                      user_id=client.user_id,
+                                      timestamp=datetime(2020, 1, 1)))
+    db.session.commit()
+    buffer.add_feedback(client.user_id, 10 ** 6 + client.user_id, True)
+    # Someone else's vote on the same id is ignored
+    buffer.add_feedback(client.user_id + 1000, 10 ** 6 + client.user_id, False)
+    buffer.flush()
+
+    db.session.expire_all()
+    row = db.session.get(ChatMessageArchive, 10 ** 6 + client.user_id)
+    assert row.feedback is True and row.there_is_feedback
+
+
+def test_failed_flush_requeues_everything(app_context, client, buffer,
+                                          monkeypatch):
+    message = new_message(client.user_id, 'respuesta', is_user=False)
+    db.session.add(message)
+    db.session.commit()
+    buffer.add_message(client.user_id, 'File uploaded: /uploads/b.pdf')
+    buffer.add_feedback(client.user_id, message.id, True)
+
+    def broken(rows):
+        raise RuntimeError('database is down')
+
+    monkeypatch.setattr(persistence, 'insert_messages', broken)
+    assert buffer.flush() == 0
+    assert buffer.pending() == 2
+    db.session.expire_all()
+    assert len(messages(client.user_id)) == 1
+    assert messages(client.user_id)[0].there_is_feedback is None
+
+    # A vote that arrived after the failed flush is kept over the requeued one
+    buffer.add_feedback(client.user_id, message.id, False)
+    monkeypatch.undo()
+    assert buffer.flush() == 2
+    db.session.expire_all()
+    rows = messages(client.user_id)
+    assert rows[0].feedback is False
+    assert rows[1].content == 'File uploaded: /uploads/b.pdf'
@@ -0,0 +1,103 @@
+from types import SimpleNamespace
+
+import pytest
+
+import run_waiter
+from run_waiter import RunError, RunTimeoutError, wait_for_run
+
+
+class StubRuns:
+    # runs.retrieve returns the given statuses in order, then the last one
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.cancelled = []
+        self.retrieved = 0
+
+    def retrieve(self, thread_id, run_id):
+        self.retrieved += 1
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return run(status, run_id)
+
+    def cancel(self, thread_id, run_id):
+        self.cancelled.append(run_id)
+
+
+def run(status, run_id='run_1'):
+    return SimpleNamespace(id=run_id, status=status, last_error=None)
+
+
+def stub_client(statuses):
+    runs = StubRuns(statuses)
+    return SimpleNamespace(beta=SimpleNamespace(
+        threads=SimpleNamespace(runs=runs))), runs
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(run_waiter, 'POLL_INITIAL_DELAY', 0.001)
+    monkeypatch.setattr(run_waiter, 'POLL_MAX_DELAY', 0.002)
+
+
+def outcomes():
+    stats = run_waiter.get_poll_stats()
+    return {key: stats[key] for key in ('completed', 'failed', 'timeouts')}
+
+
+def test_returns_completed_run():
+    client, runs = stub_client(['in_progress', 'completed'])
+    before = outcomes()
+    result = wait_for_run(client, 'thread_1', run('queued'), timeout=5)
+    assert result.status == 'completed'
+    assert runs.retrieved == 2
+    assert outcomes()['completed'] == before['completed'] + 1
+
+
+@pytest.mark.parametrize('status', ['failed', 'cancelled', 'expired',
+                                    'incomplete'])
+def test_terminal_failures_raise(status):
+    client, runs = stub_client([status])
+    before = outcomes()
+    with pytest.raises(RunError) as error:
+        wait_for_run(client, 'thread_1', run('queued'), timeout=5)
+    assert error.value.status == status
+    assert not isinstance(error.value, RunTimeoutError)
+    assert outcomes()['failed'] == before['failed'] + 1
+
+
+def test_requires_action_cancels_the_run():
+    client, runs = stub_client(['requires_action'])
+    before = outcomes()
+    with pytest.raises(RunError):
+        wait_for_run(client, 'thread_1', run('queued'), timeout=5)
+    assert runs.cancelled == ['run_1']
+    assert outcomes()['failed'] == before['failed'] + 1
+
+
+def test_deadline_cancels_the_run():
+    client, runs = stub_client(['in_progress'])
+    before = outcomes()
+    with pytest.raises(RunTimeoutError):
+        wait_for_run(client, 'thread_1', run('queued'), timeout=0.05)
+    assert runs.cancelled == ['run_1']
+    assert outcomes()['timeouts'] == before['timeouts'] + 1
+
+
+def test_tracker_follows_streamed_states():
+    client, runs = stub_client(['in_progress'])
+    tracker = run_waiter.RunTracker(client, 'thread_1', timeout=5,
+                                    stage='run_stream')
+    assert tracker.update(run('queued')) is False
+    assert tracker.update(run('in_progress')) is False
+    assert tracker.update(run('completed')) is True
+    assert tracker.outcome == 'completed'
+    assert runs.cancelled == []
+
+
+def test_abandoned_run_is_cancelled():
+    client, runs = stub_client(['in_progress'])
+    polls = iter([False, False, True])
+    with pytest.raises(run_waiter.RunCancelledError):
+        wait_for_run(client, 'thread_1', run('queued'), timeout=5,
+                     abandoned=lambda: next(polls))
+    assert runs.cancelled == ['run_1']
+    assert run_waiter.get_poll_stats()['cancelled'] >= 1
@@ -0,0 +1,44 @@
+import threading
+
+import fake_redis
+import pytest
+
+from shared_state import SharedState
+
+
+@pytest.fixture(scope='module')
+def state():
+    server, url = fake_redis.start_server()
+    yield SharedState(url)
+    server.shutdown()
+
+
+def test_extend_keeps_the_lock_for_the_run(state):
+    lock = state.lock('thread:extend', ttl=1)
+    with lock:
+        assert 0 < state.client.pttl(lock.key) <= 1000
+        assert state.extend(lock, 180)
+        assert state.client.pttl(lock.key) > 170 * 1000
+        # Never shortens a longer expiry
+        assert state.extend(lock, 5)
+        assert state.client.pttl(lock.key) > 170 * 1000
+    assert state.client.get(lock.key) is None
+
+
+def test_extend_does_not_touch_a_lock_taken_over(state):
+    lock = state.lock('thread:taken', ttl=1)
+    lock.acquire()
+    # The lock expired and another worker now holds the key
+    state.client.set(lock.key, 'other-worker', px=1000)
+    assert not state.extend(lock, 180)
+    assert state.client.pttl(lock.key) <= 1000
+    lock.release()
+    assert state.client.get(lock.key) == b'other-worker'
+
+
+def test_extend_is_a_no_op_for_local_locks():
+    state = SharedState()
+    lock = state.lock('thread:local')
+    assert isinstance(lock, type(threading.Lock()))
+    with lock:
+        assert state.extend(lock, 180)
@@ -0,0 +1,52 @@
+import pytest
+
+import chatbot
+import run_waiter
+
+
+def outcomes():
+    stats = run_waiter.get_poll_stats()
+    return {key: stats[key] for key in ('completed', 'failed', 'timeouts')}
+
+
+@pytest.fixture
+def stream(app_context, client):
+    # Streams one answer for a fresh user; returns (reply, deltas)
+    def stream(message='¿Qué incluye el mantenimiento?'):
+        deltas = []
+        reply = chatbot.stream_chatbot_response(client.user_id, message,
+                                                deltas.append)
+        return reply, deltas
+    return stream
+
+
+def test_streamed_run_completes(stream):
+    before = outcomes()
+    reply, deltas = stream()
+    assert deltas
+    # The final text is the streamed one with its citations resolved
+    assert reply.startswith(deltas[0])
+    assert reply != chatbot.ERROR_RESPONSE
+    assert outcomes()['completed'] == before['completed'] + 1
+
+
+def test_failed_run_returns_error_response(stream, fake_api):
+    fake_api.failure_rate = 1.0
+    before = outcomes()
+    reply, deltas = stream()
+    assert reply == chatbot.ERROR_RESPONSE
+    assert deltas == []
+    assert outcomes()['failed'] == before['failed'] + 1
+
+
+def test_streamed_run_past_deadline_is_cancelled(stream, fake_api,
+                                                 monkeypatch):
+    fake_api.run_latency = 2.0
+    monkeypatch.setattr(run_waiter, 'RUN_TIMEOUT_SECONDS', 0.3)
+    before = outcomes()
+    reply, deltas = stream()
+    assert reply == chatbot.ERROR_RESPONSE
+    assert outcomes()['timeouts'] == before['timeouts'] + 1
+    cancelled = [run for run in fake_api.runs.values()
+                 if run['status'] == 'cancelled']
+    assert cancelled
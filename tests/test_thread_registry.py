@@ -0,0 +1,108 @@
+import fake_redis
+import pytest
+
+import thread_registry
+from models import db, User
+from shared_state import SharedState
+from thread_registry import ThreadRegistry
+
+
+@pytest.fixture(scope='module')
+def redis_url():
+    server, url = fake_redis.start_server()
+    yield url
+    server.shutdown()
+
+
+@pytest.fixture
+def shared(monkeypatch, redis_url):
+    # Registries in this test behave as workers sharing one Redis
+    state = SharedState(redis_url)
+    monkeypatch.setattr(thread_registry, 'shared_state', state)
+    return state
+
+
+def test_thread_id_is_stored_on_the_user(app_context, client):
+    ThreadRegistry().set(client.user_id, 'thread_a')
+    assert db.session.get(User, client.user_id).thread_id == 'thread_a'
+
+    # A new process reads it back from the database
+    registry = ThreadRegistry()
+    assert registry.get(client.user_id) == 'thread_a'
+    registry.clear(client.user_id)
+    assert db.session.get(User, client.user_id).thread_id is None
+    assert ThreadRegistry().get(client.user_id) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    registry = ThreadRegistry(max_size=2)
+    for user_id in (1, 2, 3):
+        registry._entry(user_id)
+    assert list(registry._entries) == [2, 3]
+
+    registry._entry(2)
+    registry._entry(4)
+    assert list(registry._entries) == [2, 4]
+
+
+def test_locked_and_watched_entries_are_not_evicted(app_context):
+    registry = ThreadRegistry(max_size=2)
+    watch = registry.watch(1)
+    with registry.lock(2):
+        registry._entry(3)
+        registry._entry(4)
+        assert list(registry._entries) == [1, 2]
+    watch.close()
+
+    registry._entry(5)
+    assert list(registry._entries) == [2, 5]
+
+
+def test_reset_is_seen_by_the_reply_in_progress(app_context, client):
+    registry = ThreadRegistry()
+    registry.set(client.user_id, 'thread_a')
+    was_reset = registry.watch(client.user_id)
+    assert not was_reset()
+
+    # The reset does not wait for the user's lock
+    with registry.lock(client.user_id):
+        registry.reset(client.user_id)
+        assert was_reset()
+    assert registry.get(client.user_id) is None
+
+    # A reply started after the reset is not affected
+    assert not registry.watch(client.user_id)()
+    was_reset.close()
+
+
+def test_shared_lock_serializes_workers_and_pins_the_entry(shared):
+    worker_a = ThreadRegistry(max_size=1)
+    worker_b = ThreadRegistry(max_size=1)
+    with worker_a.lock(1):
+        assert not worker_b.lock(1).acquire(blocking=False)
+        # The entry holding the lock survives eviction in its worker
+        worker_a._entry(2)
+        assert 1 in worker_a._entries
+    lock = worker_b.lock(1)
+    assert lock.acquire(blocking=False)
+    lock.release()
+
+    worker_a._entry(3)
+    assert list(worker_a._entries) == [3]
+
+
+def test_workers_see_each_others_threads_and_resets(app_context, client,
+                                                    shared):
+    worker_a = ThreadRegistry()
+    worker_b = ThreadRegistry()
+    worker_a.set(client.user_id, 'thread_a')
+    assert worker_b.get(client.user_id) == 'thread_a'
+    worker_a.set(client.user_id, 'thread_b')
+    assert worker_b.get(client.user_id) == 'thread_b'
+
+    was_reset = worker_b.watch(client.user_id, interval=0)
+    assert not was_reset()
+    worker_a.reset(client.user_id)
+    assert was_reset()
+    assert worker_b.get(client.user_id) is None
+    was_reset.close()
@@ -0,0 +1,96 @@
+import hashlib
+
+import pytest
+
+CONTENT = b'0123456789' * 10
+
+
+def create_session(client, size=len(CONTENT), filename='notas.txt'):
+    return client.post('/upload/sessions',
+                       json={'filename': filename, 'size': size})
+
+
+def put_chunk(client, upload_id, data, offset):
+    end = offset + len(data) - 1
+    return client.put(f'/upload/sessions/{upload_id}', data=data, headers={
+        'Content-Range': f'bytes {offset}-{end}/{len(CONTENT)}'})
+
+
+@pytest.mark.parametrize('size', [True, False, 0, -1, '100', None, 1.5])
+def test_create_rejects_invalid_size(client, size):
+    response = create_session(client, size=size)
+    assert response.status_code == 400
+
+
+def test_chunks_advance_offset_and_resume(client):
+    response = create_session(client)
+    assert response.status_code == 201
+    upload_id = response.get_json()['upload_id']
+
+    response = put_chunk(client, upload_id, CONTENT[:40], 0)
+    assert response.status_code == 200
+    assert response.get_json()['offset'] == 40
+
+    # After an interruption the client asks where to continue from
+    response = client.get(f'/upload/sessions/{upload_id}')
+    assert response.get_json()['offset'] == 40
+
+    response = put_chunk(client, upload_id, CONTENT[40:], 40)
+    assert response.get_json()['offset'] == len(CONTENT)
+
+    response = client.post(f'/upload/sessions/{upload_id}/finalize', json={
+        'sha256': hashlib.sha256(CONTENT).hexdigest()})
+    assert response.status_code == 200
+    assert response.get_json()['file_url'] == \
+        f'/uploads/{hashlib.sha256(CONTENT).hexdigest()}.txt'
+
+
+def test_chunk_at_wrong_offset_conflicts(client):
+    upload_id = create_session(client).get_json()['upload_id']
+    put_chunk(client, upload_id, CONTENT[:40], 0)
+
+    response = put_chunk(client, upload_id, CONTENT[50:], 50)
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == 40
+
+    # A chunk that was already received is not written twice
+    response = put_chunk(client, upload_id, CONTENT[:40], 0)
+    assert response.status_code == 409
+    assert client.get(f'/upload/sessions/{upload_id}').get_json()['offset'] == 40
+
+
+def test_stale_offset_is_reported_before_chunk_size(client):
+    upload_id = create_session(client).get_json()['upload_id']
+    put_chunk(client, upload_id, CONTENT[:40], 0)
+
+    # Too large for offset 90, but the client has to learn it is at 40
+    response = client.put(f'/upload/sessions/{upload_id}?offset=90',
+                          data=CONTENT[:20])
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == 40
+
+    response = client.put(f'/upload/sessions/{upload_id}?offset=40',
+                          data=CONTENT[40:] + b'extra')
+    assert response.status_code == 413
+    assert response.get_json()['max_chunk'] == 60
+
+
+def test_finalize_incomplete_upload_conflicts(client):
+    upload_id = create_session(client).get_json()['upload_id']
+    put_chunk(client, upload_id, CONTENT[:40], 0)
+
+    response = client.post(f'/upload/sessions/{upload_id}/finalize', json={})
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == 40
+
+
+def test_finalize_with_wrong_checksum_discards_upload(client):
+    upload_id = create_session(client).get_json()['upload_id']
+    put_chunk(client, upload_id, CONTENT, 0)
+
+    response = client.post(f'/upload/sessions/{upload_id}/finalize', json={
+        'sha256': hashlib.sha256(b'otro contenido').hexdigest()})
+    assert response.status_code == 422
+    assert response.get_json()['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+    # The session cannot be resumed: the client has to start again
+    assert client.get(f'/upload/sessions/{upload_id}').status_code == 404
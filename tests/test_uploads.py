@@ -0,0 +1,17 @@
+import io
+
+
+def test_upload_with_non_ascii_name_keeps_extension(client, chat_app):
+    # secure_filename('文件.txt') is just 'txt'; the upload must not fail
+    response = client.post('/upload', data={
+        'file': (io.BytesIO(b'contenido'), '文件.txt'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.get_json()['file_url'].endswith('.txt')
+
+
+def test_upload_rejects_name_without_extension(client):
+    response = client.post('/upload', data={
+        'file': (io.BytesIO(b'contenido'), 'txt'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
@@ -0,0 +1,146 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from models import db, User
+from shared_state import shared_state
+
+THREAD_CACHE_SIZE = int(os.environ.get("THREAD_CACHE_SIZE", 1024))
+# Cada cuánto una ejecución en curso consulta en el estado compartido si otro
+# worker reinició la conversación
+RESET_CHECK_INTERVAL = float(os.environ.get("RESET_CHECK_INTERVAL", 0.5))
+
+
+class _Entry:
+    __slots__ = ("thread_id", "lock", "version", "generation", "watchers")
+
+    def __init__(self, thread_id=None):
+        self.thread_id = thread_id
+        self.lock = Lock()
+        self.version = None
+        # Cambia con cada reinicio de la conversación en este proceso
+        self.generation = 0
+        # ResetWatch abiertos; mientras haya alguno la entrada no se descarta
+        self.watchers = 0
+
+
+class ThreadRegistry:
+    # Asocia cada usuario con su hilo remoto del asistente. El id del hilo se
+    # guarda en User.thread_id y se mantiene en memoria en un LRU acotado; cada
+    # entrada tiene su propio lock para serializar los envíos de un usuario.
+    # Con varios workers el lock también se toma en el estado compartido y el
+    # id en memoria se descarta cuando otro worker lo cambia.
+    # Reiniciar la conversación no toma el lock: cambia la generación del
+    # usuario y la ejecución en curso, que la vigila (ver watch), se cancela
+    # y no guarda ni emite nada.
+
+    def __init__(self, max_size=THREAD_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def _entry(self, user_id, watch=False):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+            else:
+                entry = _Entry()
+                self._entries[user_id] = entry
+            if watch:
+                entry.watchers += 1
+            self._evict()
+            return entry
+
+    def _unwatch(self, entry):
+        with self._lock:
+            entry.watchers -= 1
+
+    def _evict(self):
+        # Nunca se descarta una entrada cuyo lock está tomado o que se vigila
+        for user_id in list(self._entries):
+            if len(self._entries) <= self.max_size:
+                break
+            entry = self._entries[user_id]
+            if not entry.lock.locked() and not entry.watchers:
+                del self._entries[user_id]
+
+    def lock(self, user_id):
+        return shared_state.lock(f"thread:{user_id}",
+                                 local=self._entry(user_id).lock)
+
+    def get(self, user_id):
+        entry = self._entry(user_id)
+        version = shared_state.version(f"thread:{user_id}")
+        if version is None or version != entry.version:
+            entry.thread_id = None
+            entry.version = version
+        if entry.thread_id is None:
+            user = db.session.get(User, user_id)
+            entry.thread_id = user.thread_id if user else None
+        return entry.thread_id
+
+    def set(self, user_id, thread_id):
+        entry = self._entry(user_id)
+        entry.thread_id = thread_id
+        User.query.filter_by(id=user_id).update({"thread_id": thread_id})
+        db.session.commit()
+        entry.version = shared_state.bump(f"thread:{user_id}")
+
+    def clear(self, user_id):
+        self.set(user_id, None)
+
+    def reset(self, user_id):
+        # El siguiente mensaje creará un hilo nuevo; lo que esté en curso ve
+        # el cambio de generación
+        self._entry(user_id).generation += 1
+        shared_state.bump(f"conversation:{user_id}")
+        self.clear(user_id)
+
+    def watch(self, user_id, interval=RESET_CHECK_INTERVAL):
+        # ResetWatch desde ahora; hay que cerrarlo al terminar el turno
+        return ResetWatch(self, user_id, interval)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResetWatch:
+    # Llamado, dice si la conversación del usuario se reinició desde que se
+    # creó. La generación local se mira siempre; la compartida, como mucho
+    # cada `interval` segundos.
+
+    def __init__(self, registry, user_id, interval=RESET_CHECK_INTERVAL):
+        self.registry = registry
+        self.user_id = user_id
+        self.interval = interval
+        self._entry = registry._entry(user_id, watch=True)
+        self._generation = self._entry.generation
+        self._version = shared_state.version(f"conversation:{user_id}")
+        self._checked = time.monotonic()
+        self._reset = False
+        self._closed = False
+
+    def __call__(self):
+        if not self._reset:
+            self._reset = self._check()
+        return self._reset
+
+    def _check(self):
+        if self._entry.generation != self._generation:
+            return True
+        if self._version is None or \
+                time.monotonic() - self._checked < self.interval:
+            return False
+        self._checked = time.monotonic()
+        current = shared_state.version(f"conversation:{self.user_id}")
+        return current is not None and current != self._version
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.registry._unwatch(self._entry)
+
+
+registry = ThreadRegistry()
@@ -0,0 +1,289 @@
+import hashlib
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from werkzeug.exceptions import ClientDisconnected
+
+from metrics import Counter, Gauge, upload_bytes_total
+from models import db, UploadSession
+from offload import run_blocking
+from shared_state import shared_state
+from structured_log import log_event
+
+# Subidas por partes: POST crea la sesión, cada PUT escribe un trozo en la
+# posición indicada directamente al archivo parcial (sin pasar por memoria ni
+# por archivos temporales de Werkzeug) y el finalize verifica el tamaño y mueve
+# el archivo a su nombre por hash. El sha256 se calcula a medida que llegan
+# los bytes; si el proceso se reinicia o la sesión pasa a otro worker se
+# recalcula una vez leyendo lo que ya está en disco. Lo ya escrito nunca se
+# pierde: tras un corte el cliente pide el offset y continúa desde ahí.
+UPLOAD_MAX_SIZE = int(os.environ.get("UPLOAD_MAX_SIZE", 100 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 5 * 1024 * 1024))
+UPLOAD_MAX_ACTIVE_PER_USER = int(os.environ.get("UPLOAD_MAX_ACTIVE_PER_USER", 3))
+# Cuerpos de subida (trozos o subidas simples) leyéndose a la vez en el proceso
+UPLOAD_MAX_CONCURRENT = int(os.environ.get("UPLOAD_MAX_CONCURRENT", 16))
+UPLOAD_SESSION_TTL = float(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
+UPLOAD_RETRY_AFTER = 5
+STREAM_BLOCK_SIZE = 64 * 1024
+PARTIAL_DIR = ".partial"
+
+upload_chunks_total = Counter(
+    "upload_chunks_total", "Trozos de subidas por partes por resultado",
+    ["outcome"])
+
+
+class UploadError(Exception):
+    def __init__(self, status, message, **extra):
+        self.status = status
+        self.message = message
+        self.extra = extra
+        super().__init__(message)
+
+    def to_dict(self):
+        return dict(self.extra, error=self.message)
+
+
+class ChunkedUploads:
+
+    def __init__(self, max_size=UPLOAD_MAX_SIZE, chunk_size=UPLOAD_CHUNK_SIZE,
+                 max_active=UPLOAD_MAX_ACTIVE_PER_USER,
+                 max_concurrent=UPLOAD_MAX_CONCURRENT,
+                 ttl=UPLOAD_SESSION_TTL):
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.max_active = max_active
+        self.max_concurrent = max_concurrent
+        self.ttl = ttl
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._in_flight = 0
+        # upload_id -> (offset, sha256 parcial) y upload_id -> lock local
+        self._hashers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        # Limita los cuerpos que se leen a la vez; sin hueco se rechaza antes
+        # de leer un solo byte
+        if not self._slots.acquire(blocking=False):
+            upload_chunks_total.inc(outcome="busy")
+            raise UploadError(503, "Too many uploads in progress, try again later",
+                              retry_after=UPLOAD_RETRY_AFTER)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def in_flight(self):
+        with self._lock:
+            return self._in_flight
+
+    def partial_path(self, folder, upload_id):
+        return os.path.join(folder, PARTIAL_DIR, f"{upload_id}.part")
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            local = self._locks.setdefault(upload_id, threading.Lock())
+        return shared_state.lock(f"upload:{upload_id}", local=local)
+
+    def _forget(self, upload_id):
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+            self._locks.pop(upload_id, None)
+
+    def _expired_before(self):
+        return datetime.utcnow() - timedelta(seconds=self.ttl)
+
+    def create(self, user_id, filename, size, folder):
+        # bool es subclase de int: un "size": true del JSON no es un tamaño
+        if isinstance(size, bool) or not isinstance(size, int) or size <= 0:
+            raise UploadError(400, "A positive file size is required")
+        if size > self.max_size:
+            raise UploadError(413, "File is too large", max_size=self.max_size)
+        self.purge_expired(folder)
+        active = UploadSession.query.filter(
+            UploadSession.user_id == user_id,
+            UploadSession.updated_at >= self._expired_before()).count()
+        if active >= self.max_active:
+            raise UploadError(429, "Too many uploads in progress for this user",
+                              retry_after=UPLOAD_RETRY_AFTER)
+
+        session = UploadSession(id=uuid.uuid4().hex, user_id=user_id,
+                                filename=filename, size=size)
+        os.makedirs(os.path.join(folder, PARTIAL_DIR), exist_ok=True)
+        open(self.partial_path(folder, session.id), "wb").close()
+        db.session.add(session)
+        db.session.commit()
+        return session
+
+    def get(self, user_id, upload_id):
+        session = db.session.get(UploadSession, upload_id)
+        if session is None or session.user_id != user_id:
+            raise UploadError(404, "Upload not found")
+        return session
+
+    def offset(self, session, folder):
+        # Lo escrito en disco es la fuente de verdad del progreso
+        try:
+            return os.path.getsize(self.partial_path(folder, session.id))
+        except FileNotFoundError:
+            raise UploadError(404, "Upload not found")
+
+    def _hasher(self, session, folder, offset):
+        with self._lock:
+            cached = self._hashers.get(session.id)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        # Releer todo lo recibido puede tardar; con eventlet va fuera del hub
+        return run_blocking(self._hash_prefix,
+                            self.partial_path(folder, session.id), offset)
+
+    def _hash_prefix(self, path, offset):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            remaining = offset
+            while remaining:
+                block = f.read(min(STREAM_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+        return digest
+
+    def write_chunk(self, session, folder, offset, stream, content_length=None):
+        # Escribe el trozo que empieza en `offset` y devuelve el nuevo offset.
+        # El offset se valida antes que el tamaño: un reintento de un trozo
+        # ya recibido recibe el 409 con el offset desde el que seguir, no un
+        # 413. Nada del cuerpo se lee antes de las dos comprobaciones.
+        lock = self._upload_lock(session.id)
+        if not lock.acquire(blocking=False):
+            raise UploadError(409, "Another chunk of this upload is in progress",
+                              offset=self.offset(session, folder))
+        try:
+            current = self.offset(session, folder)
+            if offset != current:
+                upload_chunks_total.inc(outcome="offset_mismatch")
+                raise UploadError(409, "Offset does not match the bytes received",
+                                  offset=current)
+            limit = min(self.chunk_size, session.size - current)
+            if content_length is not None and content_length > limit:
+                upload_chunks_total.inc(outcome="too_large")
+                raise UploadError(413, "Chunk is too large", max_chunk=limit,
+                                  offset=current)
+            digest = self._hasher(session, folder, current)
+            written = 0
+            try:
+                with open(self.partial_path(folder, session.id), "r+b") as f:
+                    f.seek(current)
+                    while True:
+                        block = stream.read(min(STREAM_BLOCK_SIZE, limit - written + 1))
+                        if not block:
+                            break
+                        if written + len(block) > limit:
+                            # Lo que sobra no se escribe; lo anterior se conserva
+                            upload_chunks_total.inc(outcome="too_large")
+                            raise UploadError(413, "Chunk is too large",
+                                              max_chunk=limit,
+                                              offset=current + written)
+                        f.write(block)
+                        digest.update(block)
+                        written += len(block)
+            except ClientDisconnected:
+                upload_chunks_total.inc(outcome="interrupted")
+                raise UploadError(400, "Chunk was interrupted",
+                                  offset=current + written)
+            finally:
+                with self._lock:
+                    self._hashers[session.id] = (current + written, digest)
+                upload_bytes_total.inc(written)
+            session.updated_at = datetime.utcnow()
+            db.session.commit()
+            upload_chunks_total.inc(outcome="ok")
+            return current + written
+        finally:
+            lock.release()
+
+    def finalize(self, session, folder, expected_sha256=None):
+        # Mueve el archivo completo a <sha256>.<ext>; devuelve (sha256, nombre)
+        lock = self._upload_lock(session.id)
+        if not lock.acquire(blocking=False):
+            raise UploadError(409, "A chunk of this upload is still in progress",
+                              offset=self.offset(session, folder))
+        try:
+            size = self.offset(session, folder)
+            if size != session.size:
+                raise UploadError(409, "Upload is incomplete", offset=size,
+                                  size=session.size)
+            sha256 = self._hasher(session, folder, size).hexdigest()
+            partial_path = self.partial_path(folder, session.id)
+            if expected_sha256 and expected_sha256.lower() != sha256:
+                # El contenido recibido no es el del cliente: no se puede
+                # reanudar, hay que empezar de nuevo
+                self._discard(session, partial_path)
+                raise UploadError(422, "Checksum mismatch, upload the file again",
+                                  sha256=sha256)
+
+            extension = os.path.splitext(session.filename)[1][1:].lower()
+            filename = f"{sha256}.{extension}"
+            file_path = os.path.join(folder, filename)
+            if os.path.exists(file_path):
+                os.remove(partial_path)
+            else:
+                os.replace(partial_path, file_path)
+            db.session.delete(session)
+            db.session.commit()
+            self._forget(session.id)
+            return sha256, filename
+        finally:
+            lock.release()
+
+    def _discard(self, session, partial_path):
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        db.session.delete(session)
+        db.session.commit()
+        self._forget(session.id)
+
+    def abort(self, session, folder):
+        with self._upload_lock(session.id):
+            self._discard(session, self.partial_path(folder, session.id))
+
+    def purge_expired(self, folder, limit=100):
+        # Sesiones abandonadas: se borran junto con sus archivos parciales
+        expired = UploadSession.query.filter(
+            UploadSession.updated_at < self._expired_before()).limit(limit).all()
+        for session in expired:
+            partial_path = self.partial_path(folder, session.id)
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            db.session.delete(session)
+            self._forget(session.id)
+        if expired:
+            db.session.commit()
+            log_event("upload_sessions_expired", sample_rate=1,
+                      count=len(expired))
+        return len(expired)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight(),
+            "max_concurrent": self.max_concurrent,
+            "max_size": self.max_size,
+            "chunk_size": self.chunk_size,
+            "max_active_per_user": self.max_active,
+            "ttl": self.ttl,
+            "cached_hashers": len(self._hashers),
+        }
+
+
+chunked_uploads = ChunkedUploads()
+
+Gauge("upload_bodies_in_flight", "Cuerpos de subida leyéndose en este momento",
+      chunked_uploads.in_flight)